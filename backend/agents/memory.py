@@ -0,0 +1,42 @@
+from typing import Dict, List
+
+from providers.engine import RoleConfig
+from providers.registry import GEMINI_MODEL_IDS
+
+
+MEMORY_PROMPT = (
+    "You maintain the project memory for Kural IDE, where an Architect plans a\n"
+    "software project and a Builder writes the code one task at a time.\n\n"
+    "You receive the current project memory and the conversation turns that have\n"
+    "just dropped out of the recent context. Rewrite the memory so it covers both.\n\n"
+    "Keep:\n"
+    "- The project goal and the chosen tech stack\n"
+    "- The task list, marking which tasks are done, in progress or pending\n"
+    "- Files, modules, functions and APIs that were created, with one line each\n"
+    "- Decisions, constraints and user corrections that still apply\n\n"
+    "Drop greetings, repeated code and anything superseded later.\n"
+    "Reply with the memory only, as terse bullet points, under 300 words."
+)
+
+
+MEMORY_ROLE = RoleConfig(
+    name="memory",
+    system_prompt=MEMORY_PROMPT,
+    default_model="groq",
+    models={
+        "groq": ("llama-3.1-8b-instant",),
+        "gemini": GEMINI_MODEL_IDS,
+        "mistral": ("mistral-small-latest",),
+        "openrouter": ("deepseek/deepseek-chat-v3-0324:free",),
+        "claude": ("claude-3-haiku-20240307",),
+    },
+    max_tokens={"groq": 600, "mistral": 600, "openrouter": 600, "claude": 600},
+)
+
+
+def build_memory_request(memory: str, turns: List[Dict[str, str]]) -> str:
+    lines = [f"CURRENT MEMORY:\n{memory or '(empty)'}", "", "TURNS TO FOLD IN:"]
+    for item in turns:
+        lines.append(f"[{item.get('role', 'user').upper()} | {item.get('type', 'general')}]")
+        lines.append(item.get("content", ""))
+    return "\n".join(lines)
@@ -0,0 +1,197 @@
+import argparse
+from dataclasses import dataclass, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+# A stand-in for OpenAI-style chat-completions APIs (Mistral, OpenRouter,
+# Groq). Point a provider at it with e.g. MISTRAL_BASE_URL=http://127.0.0.1:8765/v1.
+# Behaviour can be overridden per base URL by prefixing the path with a
+# profile, e.g. http://127.0.0.1:8765/latency=0.5,rate_429=1/v1.
+
+WORDS = ("kural", "builder", "architect", "task", "module", "render", "state", "async")
+
+
+@dataclass(frozen=True)
+class MockProfile:
+    latency: float = 0.05
+    jitter: float = 0.0
+    first_token: float = 0.02
+    response_tokens: int = 200
+    chunk_tokens: int = 8
+    rate_429: float = 0.0
+    rate_413: float = 0.0
+    rate_504: float = 0.0
+    retry_after: float = -1.0
+
+    @classmethod
+    def parse(cls, spec: str, base: "MockProfile") -> "MockProfile":
+        types = {item.name: item.type for item in fields(cls)}
+        overrides: Dict[str, object] = {}
+        for part in filter(None, spec.split(",")):
+            name, _, value = part.partition("=")
+            if name not in types:
+                raise ValueError(f"Unknown mock profile setting: {name}")
+            overrides[name] = int(value) if types[name] is int else float(value)
+        return replace(base, **overrides)
+
+
+class MockStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors: Dict[int, int] = {}
+
+    def record(self, status: int) -> None:
+        with self._lock:
+            self.requests += 1
+            if status != 200:
+                self.errors[status] = self.errors.get(status, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": dict(self.errors)}
+
+
+def _split_profile(path: str, default: MockProfile) -> Tuple[MockProfile, str]:
+    head, _, rest = path.lstrip("/").partition("/")
+    if "=" in head:
+        return MockProfile.parse(head, default), "/" + rest
+    return default, path
+
+
+def _completion_text(tokens: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(tokens))
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40 ms to every keep-alive response.
+    disable_nagle_algorithm = True
+    server: "MockProviderServer"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict[str, str] | None = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.record(status)
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        profile, path = _split_profile(self.path, self.server.profile)
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"No route for {path}"}})
+            return
+        delay = profile.latency + random.uniform(0, profile.jitter)
+        roll = random.random()
+        for status, rate in ((429, profile.rate_429), (413, profile.rate_413), (504, profile.rate_504)):
+            if roll < rate:
+                time.sleep(delay if status == 504 else profile.first_token)
+                headers = {"Retry-After": str(profile.retry_after)} if profile.retry_after >= 0 else {}
+                self._send_json(status, {"error": {"message": f"mock {status}"}}, headers)
+                return
+            roll -= rate
+        prompt_tokens = sum(len(str(item.get("content", ""))) // 4 for item in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": profile.response_tokens}
+        if payload.get("stream"):
+            self._stream(profile, payload.get("model", "mock"), usage)
+            return
+        time.sleep(delay)
+        self._send_json(
+            200,
+            {
+                "model": payload.get("model", "mock"),
+                "choices": [
+                    {"message": {"role": "assistant", "content": _completion_text(profile.response_tokens)}}
+                ],
+                "usage": usage,
+            },
+        )
+
+    def _stream(self, profile: MockProfile, model: str, usage: Dict) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data: str) -> None:
+            raw = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(raw):x}\r\n".encode("ascii") + raw + b"\r\n")
+            self.wfile.flush()
+
+        time.sleep(profile.first_token)
+        chunks = max(1, profile.response_tokens // max(1, profile.chunk_tokens))
+        pause = max(0.0, profile.latency - profile.first_token) / chunks
+        for index in range(chunks):
+            if index:
+                time.sleep(pause)
+            delta = {"content": _completion_text(profile.chunk_tokens) + " "}
+            write(json.dumps({"model": model, "choices": [{"delta": delta}]}))
+        write(json.dumps({"model": model, "choices": [], "usage": usage}))
+        write("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.server.stats.record(200)
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], profile: MockProfile | None = None) -> None:
+        super().__init__(address, MockProviderHandler)
+        self.profile = profile or MockProfile()
+        self.stats = MockStats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    profile: MockProfile | None = None,
+) -> MockProviderServer:
+    server = MockProviderServer((host, port), profile)
+    threading.Thread(target=server.serve_forever, name="mock-provider", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-style mock LLM provider.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--profile",
+        default="",
+        help="Default behaviour, e.g. latency=0.3,jitter=0.1,rate_429=0.05,response_tokens=400",
+    )
+    args = parser.parse_args()
+    server = MockProviderServer((args.host, args.port), MockProfile.parse(args.profile, MockProfile()))
+    print(f"[Kural IDE] Mock provider listening on {server.url}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
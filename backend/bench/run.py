@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from urllib import request as urllib_request
+from urllib.error import HTTPError
+from uuid import uuid4
+
+from bench.mock_provider import MockProfile, start_mock_server
+
+# Usage (from backend/):  python -m bench.run --requests 200 --concurrency 8
+#
+# Everything runs in this process against the local mock provider, so no
+# provider quota is spent. Router overhead is end-to-end latency minus the
+# latency of calling the mock directly; fallback cost is the extra latency
+# when the preferred provider always answers 429.
+
+ENDPOINTS = {
+    "architect": "/api/architect",
+    "builder": "/api/builder",
+    "user-intervention": "/api/user-intervention",
+}
+SCENARIOS = {
+    # (architect preferred model, builder preferred model)
+    "baseline": ("groq", "openrouter"),
+    "fallback": ("mistral", "mistral"),
+}
+
+
+def _configure_environment(mock_url: str, profile: str) -> None:
+    prefix = f"{mock_url}/{profile}" if profile else mock_url
+    os.environ.update(
+        {
+            "GROQ_BASE_URL": f"{prefix}/v1",
+            "OPENROUTER_BASE_URL": f"{prefix}/v1",
+            # Mistral always rate-limits, which drives the fallback scenario.
+            "MISTRAL_BASE_URL": f"{mock_url}/rate_429=1/v1",
+            "GROQ_API_KEY": "bench",
+            "OPENROUTER_API_KEY": "bench",
+            "MISTRAL_API_KEY": "bench",
+            "GEMINI_API_KEY": "",
+            "CLAUDE_API_KEY": "",
+            # Measure the routing path itself, not caches or background work.
+            "KURAL_CACHE": "0",
+            "KURAL_MEMORY": "0",
+            "KURAL_HEDGE": "0",
+            "KURAL_RATE_LIMIT_COOLDOWN": "0",
+        }
+    )
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def _rss_mb() -> float:
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _post(url: str, payload: Dict, headers: Dict[str, str] | None = None) -> int:
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib_request.Request(
+        url,
+        data=data,
+        headers={"Content-Type": "application/json", **(headers or {})},
+        method="POST",
+    )
+    try:
+        with urllib_request.urlopen(req, timeout=120) as response:
+            response.read()
+            return response.status
+    except HTTPError as exc:
+        exc.read()
+        return exc.code
+
+
+def _measure(call: Callable[[int], int], total: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    failures = 0
+
+    def timed(index: int) -> None:
+        nonlocal failures
+        started = time.perf_counter()
+        status = call(index)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            failures += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "failures": failures,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def _endpoint_call(base_url: str, endpoint: str) -> Callable[[int], int]:
+    def call(index: int) -> int:
+        payload: Dict = {"message": f"Benchmark request {index}", "history": []}
+        if endpoint == "user-intervention":
+            payload["panel"] = "architect"
+        return _post(
+            f"{base_url}{ENDPOINTS[endpoint]}",
+            payload,
+            {"X-Kural-Session": uuid4().hex},
+        )
+
+    return call
+
+
+def run(args: argparse.Namespace) -> Dict:
+    mock = start_mock_server(profile=MockProfile.parse(args.profile, MockProfile()))
+    _configure_environment(mock.url, "")
+
+    # Imported only now: adapters read their base URLs and keys at import time.
+    from werkzeug.serving import make_server
+
+    import server as kural_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    http_server = make_server("127.0.0.1", 0, kural_server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, name="bench-flask", daemon=True).start()
+    base_url = f"http://127.0.0.1:{http_server.server_port}"
+
+    rss_start = _rss_mb()
+    direct = _measure(
+        lambda index: _post(
+            f"{mock.url}/v1/chat/completions",
+            {"model": "mock", "messages": [{"role": "user", "content": f"direct {index}"}]},
+        ),
+        args.requests,
+        args.concurrency,
+    )
+    results: Dict = {"direct_provider": direct, "scenarios": {}}
+    for scenario in args.scenarios:
+        architect_model, builder_model = SCENARIOS[scenario]
+        _post(f"{base_url}/api/switch-model", {"panel": "architect", "model": architect_model})
+        _post(f"{base_url}/api/switch-model", {"panel": "builder", "model": builder_model})
+        scenario_results = {}
+        for endpoint in args.endpoints:
+            stats = _measure(_endpoint_call(base_url, endpoint), args.requests, args.concurrency)
+            stats["router_overhead_p50_ms"] = round(stats["p50_ms"] - direct["p50_ms"], 1)
+            scenario_results[endpoint] = stats
+        results["scenarios"][scenario] = scenario_results
+
+    if "baseline" in results["scenarios"] and "fallback" in results["scenarios"]:
+        results["fallback_cost_p50_ms"] = {
+            endpoint: round(
+                results["scenarios"]["fallback"][endpoint]["p50_ms"]
+                - results["scenarios"]["baseline"][endpoint]["p50_ms"],
+                1,
+            )
+            for endpoint in args.endpoints
+        }
+    results["rss_mb"] = {"start": round(rss_start, 1), "end": round(_rss_mb(), 1)}
+    results["mock_provider"] = mock.stats.snapshot()
+    http_server.shutdown()
+    mock.shutdown()
+    return results
+
+
+def _print_table(results: Dict) -> None:
+    direct = results["direct_provider"]
+    print(f"Direct provider call: p50 {direct['p50_ms']} ms, p99 {direct['p99_ms']} ms")
+    header = f"{'scenario':<10} {'endpoint':<18} {'p50 ms':>8} {'p99 ms':>8} {'overhead':>9} {'rps':>7} {'fail':>5}"
+    print(header)
+    print("-" * len(header))
+    for scenario, endpoints in results["scenarios"].items():
+        for endpoint, stats in endpoints.items():
+            print(
+                f"{scenario:<10} {endpoint:<18} {stats['p50_ms']:>8} {stats['p99_ms']:>8} "
+                f"{stats['router_overhead_p50_ms']:>9} {stats['throughput_rps']:>7} {stats['failures']:>5}"
+            )
+    if "fallback_cost_p50_ms" in results:
+        print(f"Fallback cost (p50 ms): {results['fallback_cost_p50_ms']}")
+    print(f"RSS MB: {results['rss_mb']}  Mock provider: {results['mock_provider']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Kural IDE routing against a mock provider.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--profile", default="", help="Mock provider profile, e.g. latency=0.2,jitter=0.05")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+    results = run(args)
+    _print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
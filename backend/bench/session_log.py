@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from session_log import MAX_SEGMENTS, SessionLog
+
+# Usage (from backend/):  python -m bench.session_log --messages 20000
+#
+# Appends a session's worth of messages one at a time (as add_message does),
+# then reopens the log in a new SessionLog, as a restarted server would, and
+# times the full reload and a tail read of the most recent messages. Finally
+# it restarts until the short segments left behind trigger the automatic
+# compaction, and times the reopen that runs it. The log lives in a
+# temporary directory unless --dir is given.
+
+SESSION_ID = "benchsession"
+
+
+def _message(index: int, size: int) -> Dict[str, str]:
+    return {
+        "role": ("user", "architect", "builder")[index % 3],
+        "content": f"message {index} " + "x" * size,
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "type": "general",
+    }
+
+
+def _meta(count: int) -> Dict[str, object]:
+    return {"base_version": 0, "count": count, "memory": "", "memory_version": 0, "memory_pending": 0.0}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _disk_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names
+    )
+
+
+def run(args: argparse.Namespace, root: str) -> Dict:
+    log = SessionLog(root)
+    log.write_session(SESSION_ID, _meta(0), [], 0)
+    appends: List[float] = []
+    started = time.perf_counter()
+    for index in range(args.messages):
+        message = _message(index, args.size)
+        began = time.perf_counter()
+        log.write_session(SESSION_ID, _meta(index + 1), [message], index)
+        appends.append((time.perf_counter() - began) * 1000)
+    append_total = time.perf_counter() - started
+    log.forget(SESSION_ID)
+
+    reopened = SessionLog(root)
+    began = time.perf_counter()
+    meta = reopened.meta(SESSION_ID)
+    messages = reopened.read_messages(SESSION_ID)
+    reload_ms = (time.perf_counter() - began) * 1000
+    assert len(messages) == args.messages and meta["count"] == args.messages
+    reopened.forget(SESSION_ID)
+
+    tail = SessionLog(root)
+    began = time.perf_counter()
+    recent = tail.read_messages(SESSION_ID, tail.meta(SESSION_ID)["count"] - args.tail)
+    tail_ms = (time.perf_counter() - began) * 1000
+    assert recent[-1]["content"] == messages[-1]["content"]
+    tail.forget(SESSION_ID)
+
+    # Every restart appends to a fresh segment; one past MAX_SEGMENTS short
+    # ones, opening the session compacts them into a new generation.
+    count = args.messages
+    for _ in range(MAX_SEGMENTS):
+        restarted = SessionLog(root)
+        restarted.write_session(SESSION_ID, _meta(count + 1), [_message(count, args.size)], count)
+        restarted.forget(SESSION_ID)
+        count += 1
+    before = _disk_bytes(root)
+    compacting = SessionLog(root)
+    began = time.perf_counter()
+    compacting.meta(SESSION_ID)
+    compact_ms = (time.perf_counter() - began) * 1000
+    assert len([name for name in os.listdir(os.path.join(root, SESSION_ID)) if name.endswith(".jsonl")]) == 1
+    return {
+        "messages": args.messages,
+        "append_p50_ms": round(statistics.median(appends), 3),
+        "append_p99_ms": round(_percentile(appends, 0.99), 3),
+        "append_total_s": round(append_total, 2),
+        "reload_ms": round(reload_ms, 1),
+        "tail_messages": args.tail,
+        "tail_read_ms": round(tail_ms, 2),
+        "compact_ms": round(compact_ms, 1),
+        "disk_bytes": before,
+        "disk_bytes_compacted": _disk_bytes(root),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure session log append and reload cost.")
+    parser.add_argument("--messages", type=int, default=10000, help="Messages appended to the session")
+    parser.add_argument("--size", type=int, default=400, help="Approximate characters per message")
+    parser.add_argument("--tail", type=int, default=50, help="Messages read back by the tail read")
+    parser.add_argument("--dir", help="Log directory (a temporary one by default)")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+    if args.dir:
+        results = run(args, args.dir)
+    else:
+        with tempfile.TemporaryDirectory() as root:
+            results = run(args, root)
+    for name, value in results.items():
+        print(f"{name:<22} {value}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
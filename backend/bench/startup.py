@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+from providers.registry import PROVIDERS
+
+# Usage (from backend/):  python -m bench.startup --repeat 5
+#
+# Every measurement runs in a fresh interpreter so nothing is already
+# imported. Reports the cold import of the app (with tracing off and on),
+# the import cost of the heavier dependencies, and what loading each
+# provider adapter adds the first time it is used.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPENDENCIES = ("flask", "httpx", "prometheus_client", "sqlite3")
+TIMER = (
+    "import time, resource\n"
+    "{setup}\n"
+    "started = time.perf_counter()\n"
+    "{statement}\n"
+    "elapsed = (time.perf_counter() - started) * 1000\n"
+    "print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)\n"
+)
+
+
+def _measure(statement: str, setup: str = "", env: Dict[str, str] | None = None, repeat: int = 5) -> Dict:
+    timings: List[float] = []
+    rss: List[float] = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(setup=setup, statement=statement)],
+            cwd=BACKEND_DIR,
+            env={**os.environ, **(env or {})},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        timings.append(float(output[-2]))
+        rss.append(float(output[-1]))
+    return {
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "rss_mb": round(statistics.median(rss), 1),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    tracing_off = {"KURAL_TRACE_EXPORTER": "", "KURAL_PREWARM": ""}
+    results: Dict = {
+        "server": _measure("import server", env=tracing_off, repeat=args.repeat),
+        "server_with_tracing": _measure(
+            "import server",
+            env={**tracing_off, "KURAL_TRACE_EXPORTER": "file", "KURAL_TRACE_FILE": os.devnull},
+            repeat=args.repeat,
+        ),
+        "dependencies": {
+            name: _measure(f"import {name}", repeat=args.repeat) for name in DEPENDENCIES
+        },
+        # Incremental cost on top of an already imported app, as paid by the
+        # first request that uses the provider.
+        "providers": {
+            name: _measure(
+                f"get_adapter({name!r})",
+                setup="import server\nfrom providers.registry import get_adapter",
+                env=tracing_off,
+                repeat=args.repeat,
+            )
+            for name in PROVIDERS
+        },
+    }
+    results["tracing_cost_ms"] = round(
+        results["server_with_tracing"]["median_ms"] - results["server"]["median_ms"], 1
+    )
+    return results
+
+
+def _print_table(results: Dict) -> None:
+    print(f"{'import':<28} {'median ms':>10} {'min ms':>8} {'rss MB':>8}")
+    rows = [("server", results["server"]), ("server (tracing on)", results["server_with_tracing"])]
+    rows += [(name, stats) for name, stats in results["dependencies"].items()]
+    rows += [(f"first use: {name}", stats) for name, stats in results["providers"].items()]
+    for name, stats in rows:
+        print(f"{name:<28} {stats['median_ms']:>10} {stats['min_ms']:>8} {stats['rss_mb']:>8}")
+    print(f"Tracing adds {results['tracing_cost_ms']} ms to start-up when enabled.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure Kural IDE start-up and per-provider import cost.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    args = parser.parse_args()
+    results = run(args)
+    _print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from providers import engine
+
+CACHE_ENABLED = os.getenv("KURAL_CACHE", "1").lower() not in {"0", "false", "no"}
+CACHE_MAX_ENTRIES = int(os.getenv("KURAL_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("KURAL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("KURAL_CACHE_TTL", "3600"))
+CACHE_DB_PATH = os.getenv("KURAL_CACHE_DB", "")
+
+
+def request_key(
+    role: engine.RoleConfig,
+    model_name: str,
+    history: List[Dict[str, str]],
+    message: str,
+) -> str | None:
+    choice, adapter = engine.resolve_adapter(role, model_name)
+    if adapter is None:
+        return None
+    request = engine.build_request(role, adapter, history, message)
+    material = {
+        "agent": role.name,
+        "provider": choice,
+        "models": list(request.models),
+        "system": request.system_prompt,
+        "max_tokens": request.max_tokens,
+        "messages": [
+            [item.get("role", ""), item.get("type", ""), item.get("content", "")]
+            for item in request.messages
+        ],
+    }
+    encoded = json.dumps(material, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        db_path: str = CACHE_DB_PATH,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db: sqlite3.Connection | None = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def _store_memory(self, key: str, expires_at: float, value: Dict, size: int) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Dict | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._entries.pop(key)
+                self._bytes -= entry[1]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._store_memory(key, row[1], value, len(row[0]))
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict) -> None:
+        encoded = json.dumps(value)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store_memory(key, expires_at, value, len(encoded))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, encoded, expires_at),
+                )
+                self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": CACHE_ENABLED,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "disk": self._db is not None,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+from agents.memory import build_memory_request
+from providers import engine
+from router import call_with_fallback_async
+from utils.history import claim_memory_backlog, store_memory
+
+MEMORY_ENABLED = os.getenv("KURAL_MEMORY", "1").lower() not in {"0", "false", "no"}
+# Turns always sent verbatim; only older middle turns are folded into memory.
+MEMORY_RECENT_MESSAGES = int(os.getenv("KURAL_MEMORY_RECENT", "8"))
+# Fold turns in batches so the summarizer runs every few exchanges, not every one.
+MEMORY_BATCH_MESSAGES = int(os.getenv("KURAL_MEMORY_BATCH", "6"))
+
+
+async def _summarize(session_id: str, memory: str, turns, base_version: int, upto: int) -> None:
+    summary = None
+    try:
+        result = await call_with_fallback_async(
+            "memory",
+            [],
+            build_memory_request(memory, turns),
+            use_cache=False,
+        )
+        summary = result["response"].strip()
+    except Exception as exc:
+        print(f"[Kural IDE] Project memory update failed: {exc}")
+    finally:
+        # Always release the claim, so the next exchange can retry. The
+        # session lock may be held by a request thread, so not on the loop.
+        await asyncio.to_thread(store_memory, summary, base_version, upto, session_id)
+
+
+def schedule_memory_update(session_id: str) -> bool:
+    if not MEMORY_ENABLED:
+        return False
+    backlog = claim_memory_backlog(MEMORY_RECENT_MESSAGES, MEMORY_BATCH_MESSAGES, session_id)
+    if backlog is None:
+        return False
+    memory, turns, base_version, upto = backlog
+    asyncio.run_coroutine_threadsafe(
+        _summarize(session_id, memory, turns, base_version, upto),
+        engine.get_loop(),
+    )
+    return True
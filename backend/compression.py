@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import gzip
+import os
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only without it
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("KURAL_COMPRESSION", "1").lower() not in {"0", "false", "no"}
+# Below this size the encoding overhead outweighs the saving.
+COMPRESSION_MIN_BYTES = int(os.getenv("KURAL_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("KURAL_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("KURAL_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str], available: Optional[Tuple[str, ...]] = None) -> Optional[str]:
+    # The first of `available` (in preference order, by default what this
+    # process can encode) the client accepts.
+    if not accept_encoding:
+        return None
+    accepted = _accepted(accept_encoding)
+    for encoding in available if available is not None else encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encoding: Optional[str]):
+    # Encodes buffered text responses (API JSON mostly). Streams (SSE) and
+    # file responses are left alone: the former must flush per event, the
+    # latter are sent by the server as they are.
+    if not COMPRESSION_ENABLED:
+        return response
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    if "no-transform" in (response.headers.get("Cache-Control") or ""):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    # A strong validator names one exact byte sequence; the encoded body is
+    # a different one.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
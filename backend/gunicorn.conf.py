@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Production entry point:  gunicorn -c gunicorn.conf.py server:app  (from backend/)
+#
+# LLM calls spend nearly all their time waiting on the provider, so each
+# worker serves many requests on threads, and the shared engine loop in each
+# worker multiplexes the provider connections. Streams hold a thread for
+# their whole duration, so size KURAL_THREADS for concurrent streams.
+
+bind = os.getenv("KURAL_BIND", f"0.0.0.0:{os.getenv('FLASK_PORT', '5000')}")
+workers = int(os.getenv("KURAL_WORKERS", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "gthread"
+threads = int(os.getenv("KURAL_THREADS", "32"))
+# gthread caps open client connections (including idle keep-alives) per worker.
+worker_connections = int(os.getenv("KURAL_WORKER_CONNECTIONS", "256"))
+backlog = int(os.getenv("KURAL_BACKLOG", "512"))
+keepalive = int(os.getenv("KURAL_KEEPALIVE", "5"))
+
+# Heartbeat timeout for a stuck worker; must outlive the slowest provider call.
+timeout = int(os.getenv("KURAL_WORKER_TIMEOUT", str(int(os.getenv("MODEL_HTTP_TIMEOUT", "120")) + 60)))
+# On SIGTERM, stop accepting and give in-flight answers and streams time to finish.
+graceful_timeout = int(os.getenv("KURAL_GRACEFUL_TIMEOUT", "60"))
+# Recycle workers now and then so slow leaks never accumulate.
+max_requests = int(os.getenv("KURAL_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+# Workers import the app after forking, so each gets its own engine loop and
+# connection pools rather than inheriting the master's.
+preload_app = False
+accesslog = os.getenv("KURAL_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("KURAL_LOG_LEVEL", "info")
+
+# Metrics from every worker are aggregated through a shared directory.
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="kural-metrics-")
+    _OWNS_METRICS_DIR = True
+else:
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    _OWNS_METRICS_DIR = False
+
+# Several workers must share the active models, session histories and provider
+# health; without an explicit choice they share them through SQLite, at
+# KURAL_STATE_DB (backend/kural-state.db by default), which outlives restarts.
+if workers > 1 and not os.getenv("KURAL_STATE_BACKEND"):
+    os.environ["KURAL_STATE_BACKEND"] = "sqlite"
+
+
+def worker_exit(server, worker):
+    from providers.clients import close_clients
+    from providers.engine import run_sync
+
+    try:
+        run_sync(close_clients())
+    except Exception as exc:
+        server.log.warning("Closing provider clients failed: %s", exc)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if _OWNS_METRICS_DIR:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+import os
+import threading
+import time
+from typing import Deque, Dict, Iterator, List
+
+import state
+
+EWMA_ALPHA = float(os.getenv("KURAL_HEALTH_EWMA_ALPHA", "0.3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("KURAL_BREAKER_FAILURES", "3"))
+BREAKER_ERROR_RATE = float(os.getenv("KURAL_BREAKER_ERROR_RATE", "0.6"))
+BREAKER_MIN_REQUESTS = 5
+BREAKER_OPEN_SECONDS = float(os.getenv("KURAL_BREAKER_OPEN_SECONDS", "30"))
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.getenv("KURAL_RATE_LIMIT_COOLDOWN", "20"))
+LATENCY_SAMPLES = 100
+
+# Error classes that move the router on to the next model in the chain.
+FALLBACK_REASONS = {
+    "rate_limited",
+    "too_large",
+    "timeout",
+    "server_error",
+    "connection",
+    "not_configured",
+    "auth",
+}
+# Error classes that count against a provider's circuit breaker.
+BREAKER_REASONS = {"timeout", "server_error", "connection"}
+
+
+def classify_error(exc: BaseException) -> str:
+    reason = getattr(exc, "reason", None)
+    if reason:
+        return reason
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        return "unknown"
+    if status == 429:
+        return "rate_limited"
+    if status == 413:
+        return "too_large"
+    if status in (408, 504):
+        return "timeout"
+    if status in (401, 403):
+        return "auth"
+    if status >= 500:
+        return "server_error"
+    return "client_error"
+
+
+@dataclass
+class ProviderHealth:
+    latency_ewma: float | None = None
+    ttft_ewma: float | None = None
+    error_rate: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    state: str = "closed"
+    open_until: float = 0.0
+    cooldown_until: float = 0.0
+    trial_in_flight: bool = False
+    last_error: str = ""
+    samples: Dict[str, Deque[float]] = field(default_factory=dict)
+
+
+_PROVIDERS: Dict[str, ProviderHealth] = {}
+_SHARED_LOCKS: Dict[str, state.SharedLock] = {}
+_LOCK = threading.Lock()
+
+
+def _get(model: str) -> ProviderHealth:
+    health = _PROVIDERS.get(model)
+    if health is None:
+        health = _PROVIDERS[model] = ProviderHealth()
+    return health
+
+
+def _encode(health: ProviderHealth) -> Dict:
+    data = {item.name: getattr(health, item.name) for item in fields(health)}
+    data["samples"] = {kind: list(values) for kind, values in health.samples.items()}
+    return data
+
+
+def _decode(data: Dict | None) -> ProviderHealth:
+    if not data:
+        return ProviderHealth()
+    samples = {kind: deque(values, maxlen=LATENCY_SAMPLES) for kind, values in data["samples"].items()}
+    return ProviderHealth(**{**data, "samples": samples})
+
+
+@contextmanager
+def _provider(model: str, update: bool = True) -> Iterator[ProviderHealth]:
+    if not state.backend.shared:
+        with _LOCK:
+            yield _get(model)
+        return
+    if not update:
+        yield _decode(state.backend.get("health", model))
+        return
+    # Shared health is read, changed and written back under a lock held
+    # across workers, so breakers and cooldowns apply to all of them.
+    with _LOCK:
+        lock = _SHARED_LOCKS.get(model)
+        if lock is None:
+            lock = _SHARED_LOCKS[model] = state.SharedLock(state.backend.lock_path(f"health-{model}"))
+    with lock:
+        before = state.backend.get("health", model)
+        health = _decode(before)
+        yield health
+        after = _encode(health)
+        if after != before:
+            state.backend.set("health", model, after)
+
+
+def _ewma(current: float | None, value: float) -> float:
+    return value if current is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * current
+
+
+def is_available(model: str, now: float | None = None) -> bool:
+    # A read-only check for ranking chains; it never moves a breaker, so
+    # only an attempt that actually starts can take the half-open trial.
+    now = time.time() if now is None else now
+    with _provider(model, update=False) as health:
+        if now < health.cooldown_until:
+            return False
+        if health.state == "open" and now < health.open_until:
+            return False
+        return health.state == "closed" or not health.trial_in_flight
+
+
+def try_acquire_trial(model: str, now: float | None = None) -> bool:
+    # Called as an attempt starts. An open breaker whose open period has
+    # passed lets exactly one trial through; the check and the claim happen
+    # under the same lock so two callers cannot both take it.
+    now = time.time() if now is None else now
+    with _provider(model) as health:
+        if health.state == "closed":
+            return True
+        if health.state == "open":
+            if now < health.open_until:
+                return False
+            health.state = "half_open"
+        if health.trial_in_flight:
+            return False
+        health.trial_in_flight = True
+        return True
+
+
+def record_success(model: str, kind: str, seconds: float) -> None:
+    with _provider(model) as health:
+        health.requests += 1
+        health.error_rate = _ewma(health.error_rate, 0.0)
+        health.consecutive_failures = 0
+        health.state = "closed"
+        health.trial_in_flight = False
+        if kind == "first_token":
+            health.ttft_ewma = _ewma(health.ttft_ewma, seconds)
+        else:
+            health.latency_ewma = _ewma(health.latency_ewma, seconds)
+        health.samples.setdefault(kind, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+
+def record_cancelled(model: str) -> None:
+    with _provider(model) as health:
+        health.trial_in_flight = False
+
+
+def record_failure(model: str, exc: BaseException) -> str:
+    reason = classify_error(exc)
+    now = time.time()
+    with _provider(model) as health:
+        health.requests += 1
+        health.failures += 1
+        health.last_error = f"{reason}: {exc}"[:300]
+        health.trial_in_flight = False
+        if reason == "rate_limited":
+            retry_after = getattr(exc, "retry_after", None)
+            health.cooldown_until = now + (
+                retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN_SECONDS
+            )
+        if reason not in BREAKER_REASONS:
+            return reason
+        health.error_rate = _ewma(health.error_rate, 1.0)
+        health.consecutive_failures += 1
+        tripped = health.consecutive_failures >= BREAKER_FAILURE_THRESHOLD or (
+            health.requests >= BREAKER_MIN_REQUESTS and health.error_rate >= BREAKER_ERROR_RATE
+        )
+        if health.state == "half_open" or tripped:
+            health.state = "open"
+            health.open_until = now + BREAKER_OPEN_SECONDS
+    return reason
+
+
+def latency_percentile(model: str, kind: str, percentile: float, min_samples: int) -> float | None:
+    with _provider(model, update=False) as health:
+        samples = sorted(health.samples.get(kind, ()))
+    if len(samples) < min_samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+def order_chain(chain: List[str]) -> List[str]:
+    now = time.time()
+    available = [model for model in chain if is_available(model, now)]
+    # If every provider is cooling down, try them anyway rather than failing outright.
+    return available or list(chain)
+
+
+def _summary(health: ProviderHealth, now: float) -> Dict:
+    return {
+        "state": health.state,
+        "latency_ewma": health.latency_ewma,
+        "ttft_ewma": health.ttft_ewma,
+        "error_rate": round(health.error_rate, 3),
+        "requests": health.requests,
+        "failures": health.failures,
+        "cooldown_seconds": round(max(0.0, health.cooldown_until - now), 1),
+        "open_seconds": round(max(0.0, health.open_until - now), 1)
+        if health.state == "open"
+        else 0.0,
+        "last_error": health.last_error,
+    }
+
+
+def snapshot() -> Dict[str, Dict]:
+    now = time.time()
+    if state.backend.shared:
+        return {
+            model: _summary(_decode(data), now)
+            for model, data in state.backend.items("health").items()
+        }
+    with _LOCK:
+        return {model: _summary(health, now) for model, health in _PROVIDERS.items()}
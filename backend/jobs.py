@@ -0,0 +1,570 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent import futures
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Mapping, Optional
+from uuid import uuid4
+
+import state
+from compaction import schedule_memory_update
+from providers import engine
+import health
+from providers.registry import configured_providers
+from router import BUILDER_FALLBACK_CHAIN, stream_with_fallback_async
+from utils.extract import CodeBlockExtractor, merge_documents
+from utils.history import add_message, add_message_compressed, context_history, session_lock
+from utils.plan import (
+    AWAITING_DECISION_MARKER,
+    batch_review_message,
+    parallel_task_instruction,
+    parse_task_graph,
+    task_instruction,
+)
+
+# Jobs beyond this many wait as "queued" for a free slot.
+JOB_CONCURRENCY = int(os.getenv("KURAL_JOB_CONCURRENCY", "4"))
+JOB_TTL_SECONDS = float(os.getenv("KURAL_JOB_TTL", str(6 * 60 * 60)))
+# A "running" job whose snapshot has not changed for this long lost its
+# worker (restart, recycle) and may be resumed elsewhere.
+JOB_STALE_SECONDS = float(os.getenv("KURAL_JOB_STALE", "600"))
+# Independent tasks of a plan are built this many at a time, then reviewed
+# in one Architect call. 1 runs the plan strictly in order.
+JOB_PARALLEL_TASKS = max(1, int(os.getenv("KURAL_JOB_PARALLEL_TASKS", "3")))
+JOB_HEARTBEAT_SECONDS = 15.0
+JOB_POLL_SECONDS = 0.5
+
+ACTIVE_STATUSES = {"queued", "running"}
+RESUMABLE_STATUSES = {"paused", "failed"}
+
+
+class JobError(RuntimeError):
+    def __init__(self, message: str, status_code: int = 400, code: str = "") -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class Job:
+    def __init__(self, job_id: str, session_id: str, plan: str, tasks: List[Dict], auto: bool) -> None:
+        self.id = job_id
+        self.session_id = session_id
+        self.plan = plan
+        self.auto = auto
+        self.tasks = [{"title": task["title"], "depends_on": task["depends_on"], "status": "pending"} for task in tasks]
+        self.status = "queued"
+        # The next step: build the tasks in `batch` (picking a new batch when
+        # it is empty), or review them. current_task is the first task not
+        # yet built, for display.
+        self.current_task = 0
+        self.batch: List[int] = []
+        self.phase = "build"
+        self.document = ""
+        self.next_plan = ""
+        self.error = ""
+        self.results: List[Dict] = []
+        self.events: List[Dict] = []
+        self.seq = 0
+        self.created_at = self.updated_at = time.time()
+        self.pause_requested = False
+        self.cancel_requested = False
+        self.future: Optional[futures.Future] = None
+        self.changed = threading.Condition()
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict) -> "Job":
+        job = cls(snapshot["id"], snapshot["session_id"], snapshot["plan"], [], snapshot["auto"])
+        job.tasks = [dict(task) for task in snapshot["tasks"]]
+        for name in ("status", "current_task", "phase", "next_plan", "error", "created_at", "updated_at"):
+            setattr(job, name, snapshot[name])
+        job.batch = list(snapshot["batch"])
+        job.document = snapshot["document"]
+        job.results = [dict(result) for result in snapshot["results"]]
+        job.seq = snapshot["last_seq"]
+        return job
+
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def snapshot(self) -> Dict:
+        with self.changed:
+            return {
+                "id": self.id,
+                "session_id": self.session_id,
+                "status": self.status,
+                "auto": self.auto,
+                "plan": self.plan,
+                "tasks": [dict(task) for task in self.tasks],
+                "current_task": self.current_task,
+                "batch": list(self.batch),
+                "phase": self.phase,
+                "next_plan": self.next_plan,
+                "error": self.error,
+                "document": self.document,
+                "results": [dict(result) for result in self.results],
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+                "last_seq": self.seq,
+            }
+
+    def publish(self, event: str, data: Dict, transient: bool = False) -> Optional[Dict]:
+        # Tokens are transient: live subscribers see them, but they are
+        # dropped once the step completes and its full text is recorded.
+        # Returns the event for the caller to persist, None if transient.
+        with self.changed:
+            self.seq += 1
+            if not transient:
+                self.events = [item for item in self.events if not item["transient"]]
+            record = {"seq": self.seq, "event": event, "data": data, "transient": transient}
+            self.events.append(record)
+            self.updated_at = time.time()
+            self.changed.notify_all()
+        return None if transient else record
+
+    def set_status(self, status: str, **fields) -> Dict:
+        with self.changed:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return self.publish(
+            "status",
+            {
+                "status": status,
+                "current_task": self.current_task,
+                "next_plan": self.next_plan,
+                "error": self.error,
+            },
+        )
+
+    def set_task_status(self, index: int, status: str) -> Dict:
+        with self.changed:
+            self.tasks[index]["status"] = status
+            self.current_task = next(
+                (position for position, task in enumerate(self.tasks) if task["status"] != "completed"),
+                len(self.tasks),
+            )
+        return self.publish("task", {"index": index, "status": status, "total": len(self.tasks)})
+
+
+# Jobs with a runner in this process; everything else is read from the
+# state backend, which every milestone is written to.
+_RUNNING: Dict[str, Job] = {}
+# Guards submit/resume so one session never gets two runners, across workers too.
+_JOBS_LOCK = state.SharedLock(state.backend.lock_path("jobs"))
+_SLOTS: asyncio.Semaphore | None = None
+_SLOTS_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+def _events_namespace(job_id: str) -> str:
+    return f"job_events:{job_id}"
+
+
+def _persist(job: Job, event: Dict) -> None:
+    # Each event is written once under its own key; the snapshot holds only
+    # the job's current state, so a step costs the same however long the
+    # job has run. The event goes first: a follower that sees last_seq
+    # finds it.
+    state.backend.set(_events_namespace(job.id), f"{event['seq']:010d}", event)
+    state.backend.set("jobs", job.id, job.snapshot())
+
+
+async def _save(job: Job, event: Dict) -> None:
+    await asyncio.to_thread(_persist, job, event)
+
+
+def _persisted_events(job_id: str, after: int = 0) -> List[Dict]:
+    events = state.backend.items(_events_namespace(job_id))
+    return [events[key] for key in sorted(events) if events[key]["seq"] > after]
+
+
+def _delete(job_id: str) -> None:
+    for key in state.backend.items(_events_namespace(job_id)):
+        state.backend.delete(_events_namespace(job_id), key)
+    state.backend.delete("jobs", job_id)
+
+
+def _slots() -> asyncio.Semaphore:
+    global _SLOTS, _SLOTS_LOOP
+    loop = asyncio.get_running_loop()
+    if _SLOTS is None or _SLOTS_LOOP is not loop:
+        _SLOTS, _SLOTS_LOOP = asyncio.Semaphore(JOB_CONCURRENCY), loop
+    return _SLOTS
+
+
+def _is_stale(snapshot: Dict) -> bool:
+    return snapshot["status"] in ACTIVE_STATUSES and time.time() - snapshot["updated_at"] > JOB_STALE_SECONDS
+
+
+def _take_control(job_id: str) -> Optional[str]:
+    # Pause and cancel from another worker arrive through the state backend.
+    control = state.backend.get("job_control", job_id)
+    if control:
+        state.backend.delete("job_control", job_id)
+    return control
+
+
+async def _stop_requested(job: Job) -> bool:
+    control = await asyncio.to_thread(_take_control, job.id)
+    if control:
+        job.pause_requested = job.pause_requested or control == "pause"
+        job.cancel_requested = job.cancel_requested or control == "cancel"
+    if job.cancel_requested:
+        await _save(job, job.set_status("cancelled"))
+        return True
+    if job.pause_requested:
+        job.pause_requested = False
+        await _save(job, job.set_status("paused"))
+        return True
+    return False
+
+
+async def _stream(
+    job: Job,
+    agent_type: str,
+    index: int,
+    history: List[Dict],
+    message: str,
+    preferred: str,
+    extractor: CodeBlockExtractor | None = None,
+) -> Dict:
+    async for event in stream_with_fallback_async(agent_type, history, message, preferred_model=preferred):
+        if event["type"] != "token":
+            if extractor is not None:
+                for block in extractor.close():
+                    job.publish("block", {"index": index, **block}, transient=True)
+            return event
+        job.publish(
+            "token",
+            {"panel": agent_type, "index": index, "text": event["text"], "model": event["model"]},
+            transient=True,
+        )
+        if extractor is not None:
+            for block in extractor.feed(event["text"]):
+                job.publish("block", {"index": index, **block}, transient=True)
+    raise RuntimeError(f"The {agent_type} stream ended without a response.")
+
+
+def _next_batch(job: Job) -> List[int]:
+    done = {index for index, task in enumerate(job.tasks) if task["status"] == "completed"}
+    ready = [
+        index
+        for index, task in enumerate(job.tasks)
+        if index not in done and all(dependency in done for dependency in task["depends_on"])
+    ]
+    return ready[:JOB_PARALLEL_TASKS]
+
+
+def _context(session_id: str) -> List[Dict]:
+    with session_lock(session_id):
+        return context_history(session_id)
+
+
+def _record_task(session_id: str, message: str, response: str) -> None:
+    with session_lock(session_id):
+        add_message("user", message, "task", session_id)
+        add_message_compressed("builder", response, "code", session_id)
+
+
+def _record_review(session_id: str, message: str, response: str) -> None:
+    with session_lock(session_id):
+        add_message("user", message, "project_idea", session_id)
+        add_message("architect", response, "plan", session_id)
+        schedule_memory_update(session_id)
+
+
+def _schedule_memory_update(session_id: str) -> None:
+    with session_lock(session_id):
+        schedule_memory_update(session_id)
+
+
+def _builder_models(preferred: str, count: int) -> List[str]:
+    # The selected Builder takes the first task of a batch; the others go to
+    # further configured, healthy providers so they do not queue on one
+    # provider's rate limit. Each call still falls back along the usual chain.
+    configured = set(configured_providers())
+    models = [preferred]
+    models += [
+        model
+        for model in BUILDER_FALLBACK_CHAIN
+        if model != preferred and model in configured and health.is_available(model)
+    ]
+    return [models[position % len(models)] for position in range(count)]
+
+
+async def _build(job: Job, index: int, history: List[Dict], model: str) -> None:
+    title = job.tasks[index]["title"]
+    if len(job.batch) > 1:
+        siblings = [job.tasks[other]["title"] for other in job.batch if other != index]
+        message = parallel_task_instruction(title, index, siblings)
+    else:
+        message = task_instruction(title, index)
+    await _save(job, job.set_task_status(index, "in-progress"))
+    extractor = CodeBlockExtractor()
+    result = await _stream(job, "builder", index, history, message, model, extractor)
+    response = result["response"]
+    # The session lock (and the history it guards) is shared with request
+    # threads, so it is never taken on the engine loop.
+    await asyncio.to_thread(_record_task, job.session_id, message, response)
+    record = {
+        "index": index,
+        "response": response,
+        "model_used": result["model_used"],
+        "fallback_used": result["fallback_used"],
+        "cached": result["cached"],
+        "usage": result["usage"],
+        "codeBlocks": extractor.blocks,
+    }
+    with job.changed:
+        job.results = [item for item in job.results if item["index"] != index] + [record]
+    await _save(job, job.publish("builder", record))
+    await _save(job, job.set_task_status(index, "completed"))
+
+
+async def _build_batch(job: Job, active_models: Mapping[str, str]) -> None:
+    # Every task in the batch starts from the same history; a task that
+    # already finished before a pause or failure is not built again.
+    pending = [index for index in job.batch if job.tasks[index]["status"] != "completed"]
+    history = await asyncio.to_thread(_context, job.session_id)
+    models = await asyncio.to_thread(_builder_models, active_models["builder"], len(pending))
+    outcomes = await asyncio.gather(
+        *(_build(job, index, history, model) for index, model in zip(pending, models)),
+        return_exceptions=True,
+    )
+    await asyncio.to_thread(_schedule_memory_update, job.session_id)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    results = sorted(job.results, key=lambda item: item["index"])
+    document = merge_documents([item["codeBlocks"] for item in results])
+    with job.changed:
+        job.phase = "review"
+        job.document = document
+    if document:
+        await _save(job, job.publish("document", {"batch": list(job.batch), "html": document}))
+
+
+async def _review(job: Job, active_models: Mapping[str, str]) -> str:
+    by_index = {item["index"]: item for item in job.results}
+    message = batch_review_message(
+        [
+            {"index": index, "title": job.tasks[index]["title"], "response": by_index[index]["response"]}
+            for index in job.batch
+        ]
+    )
+    history = await asyncio.to_thread(_context, job.session_id)
+    result = await _stream(job, "architect", job.batch[-1], history, message, active_models["architect"])
+    response = result["response"]
+    await asyncio.to_thread(_record_review, job.session_id, message, response)
+    with job.changed:
+        for index in job.batch:
+            by_index[index]["review"] = response
+            by_index[index]["review_model"] = result["model_used"]
+        batch = job.batch
+        job.batch = []
+        job.phase = "build"
+    await _save(
+        job,
+        job.publish(
+            "review",
+            {
+                "index": batch[-1],
+                "batch": batch,
+                "response": response,
+                "model_used": result["model_used"],
+                "fallback_used": result["fallback_used"],
+            },
+        ),
+    )
+    return response
+
+
+async def _run(job: Job, active_models: Mapping[str, str]) -> None:
+    # The browser's Builder -> Architect review cycle, over batches of tasks
+    # whose dependencies are done, stopping where the browser would have
+    # asked the user.
+    try:
+        async with _slots():
+            if await _stop_requested(job):
+                return
+            await _save(job, job.set_status("running"))
+            while True:
+                if await _stop_requested(job):
+                    return
+                if job.phase == "build":
+                    if not job.batch:
+                        with job.changed:
+                            job.batch = _next_batch(job)
+                    if not job.batch:
+                        break
+                    await _build_batch(job, active_models)
+                    continue
+                review = await _review(job, active_models)
+                if AWAITING_DECISION_MARKER in review:
+                    await _save(job, job.set_status("awaiting_user_decision", next_plan=review))
+                    return
+                if job.current_task >= len(job.tasks) or not job.auto:
+                    await _save(job, job.set_status("awaiting_approval", next_plan=review))
+                    return
+            await _save(job, job.set_status("awaiting_approval", next_plan=job.next_plan or job.plan))
+    except asyncio.CancelledError:
+        await _save(job, job.set_status("cancelled"))
+        raise
+    except Exception as exc:
+        print(f"[Kural IDE] Job {job.id} failed: {exc}")
+        await _save(job, job.set_status("failed", error=str(exc)))
+
+
+def _start(job: Job, active_models: Mapping[str, str]) -> None:
+    _RUNNING[job.id] = job
+    _persist(job, job.set_status("queued", error=""))
+    job.future = asyncio.run_coroutine_threadsafe(_run(job, active_models), engine.get_loop())
+    job.future.add_done_callback(lambda _: _settle(job))
+
+
+def _settle(job: Job) -> None:
+    # A job cancelled before its coroutine ever ran never reports it.
+    if job.is_active():
+        _persist(job, job.set_status("cancelled"))
+    if _RUNNING.get(job.id) is job:
+        del _RUNNING[job.id]
+
+
+def _snapshot(job_id: str, session_id: str) -> Dict:
+    job = _RUNNING.get(job_id)
+    snapshot = job.snapshot() if job is not None else state.backend.get("jobs", job_id)
+    if snapshot is None or snapshot["session_id"] != session_id:
+        raise JobError("Job not found.", 404, "job_not_found")
+    return snapshot
+
+
+def _prune(now: float) -> None:
+    for job_id, snapshot in state.backend.items("jobs").items():
+        if now - snapshot["updated_at"] > JOB_TTL_SECONDS and snapshot["status"] not in ACTIVE_STATUSES:
+            _delete(job_id)
+
+
+def submit(session_id: str, plan: str, auto: bool, active_models: Mapping[str, str]) -> Dict:
+    tasks = parse_task_graph(plan)
+    if not tasks:
+        raise JobError("The plan has no 'Task N:' lines to run.")
+    with _JOBS_LOCK:
+        _prune(time.time())
+        for snapshot in state.backend.items("jobs").values():
+            if snapshot["session_id"] != session_id:
+                continue
+            if snapshot["status"] in ACTIVE_STATUSES and not _is_stale(snapshot):
+                raise JobError("A job is already running for this session.", 409, "job_active")
+            if snapshot["status"] in RESUMABLE_STATUSES:
+                # A new approved plan supersedes a paused or failed run.
+                _cancel_idle(snapshot)
+        job = Job(uuid4().hex, session_id, plan, tasks, auto)
+        _start(job, active_models)
+        return job.snapshot()
+
+
+def _cancel_idle(snapshot: Dict) -> None:
+    job = Job.from_snapshot(snapshot)
+    _persist(job, job.set_status("cancelled"))
+
+
+def pause(job_id: str, session_id: str) -> Dict:
+    snapshot = _snapshot(job_id, session_id)
+    if snapshot["status"] not in ACTIVE_STATUSES:
+        return snapshot
+    job = _RUNNING.get(job_id)
+    if job is not None:
+        job.pause_requested = True
+    else:
+        state.backend.set("job_control", job_id, "pause")
+    # Takes effect once the step in flight has finished, like the browser loop.
+    return {**snapshot, "pause_requested": True}
+
+
+def resume(job_id: str, session_id: str, active_models: Mapping[str, str]) -> Dict:
+    with _JOBS_LOCK:
+        snapshot = _snapshot(job_id, session_id)
+        job = _RUNNING.get(job_id)
+        if job is not None and job.is_active():
+            job.pause_requested = False
+            return job.snapshot()
+        if job is not None:
+            # Its runner has just stopped; let it wind down before starting anew.
+            futures.wait([job.future], timeout=JOB_HEARTBEAT_SECONDS)
+            snapshot = _snapshot(job_id, session_id)
+        if snapshot["status"] not in RESUMABLE_STATUSES and not _is_stale(snapshot):
+            raise JobError(f"Job is {snapshot['status']} and cannot be resumed.", 409, "job_not_resumable")
+        # Whichever worker ran it before (if any, before a restart), the
+        # persisted snapshot holds its progress; continue it here.
+        job = Job.from_snapshot(state.backend.get("jobs", job_id))
+        job.events = _persisted_events(job_id)
+        state.backend.delete("job_control", job_id)
+        job.pause_requested = job.cancel_requested = False
+        _start(job, active_models)
+        return job.snapshot()
+
+
+def cancel(job_id: str, session_id: str) -> Dict:
+    with _JOBS_LOCK:
+        snapshot = _snapshot(job_id, session_id)
+        job = _RUNNING.get(job_id)
+        if snapshot["status"] in ACTIVE_STATUSES and not _is_stale(snapshot):
+            if job is None:
+                state.backend.set("job_control", job_id, "cancel")
+                return snapshot
+            job.cancel_requested = True
+            if job.future is not None:
+                job.future.cancel()
+            return job.snapshot()
+        if snapshot["status"] in RESUMABLE_STATUSES or _is_stale(snapshot):
+            _cancel_idle(snapshot)
+        return _snapshot(job_id, session_id)
+
+
+def get_job(job_id: str, session_id: str) -> Dict:
+    return _snapshot(job_id, session_id)
+
+
+def session_jobs(session_id: str) -> List[Dict]:
+    jobs = [
+        _RUNNING[job_id].snapshot() if job_id in _RUNNING else snapshot
+        for job_id, snapshot in state.backend.items("jobs").items()
+        if snapshot["session_id"] == session_id
+    ]
+    return sorted(jobs, key=lambda item: item["created_at"], reverse=True)
+
+
+def iter_events(job_id: str, after: int = 0) -> Iterator[Optional[Dict]]:
+    # Yields events with seq > after until the job stops running; None means
+    # "nothing new", so the caller can send a keep-alive.
+    last_sent = time.monotonic()
+    while True:
+        job = _RUNNING.get(job_id)
+        if job is not None:
+            with job.changed:
+                pending = [event for event in job.events if event["seq"] > after]
+                if not pending and job.is_active():
+                    job.changed.wait(JOB_HEARTBEAT_SECONDS)
+                    pending = [event for event in job.events if event["seq"] > after]
+                active = job.is_active()
+        else:
+            # Running on another worker: follow its persisted snapshot.
+            snapshot = state.backend.get("jobs", job_id)
+            if snapshot is None:
+                return
+            pending = _persisted_events(job_id, after) if snapshot["last_seq"] > after else []
+            active = snapshot["status"] in ACTIVE_STATUSES and not _is_stale(snapshot)
+            if not pending and active:
+                time.sleep(JOB_POLL_SECONDS)
+        for event in pending:
+            after = event["seq"]
+            yield event
+        if pending:
+            last_sent = time.monotonic()
+            continue
+        if not active:
+            return
+        if time.monotonic() - last_sent >= JOB_HEARTBEAT_SECONDS:
+            last_sent = time.monotonic()
+            yield None
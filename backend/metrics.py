@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, List
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+import health
+import quota
+from cache import response_cache
+from utils.tokens import get_counter
+
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+# Provider calls run from ~0.3 s (Groq) to two minutes (slow free tiers).
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+BREAKER_STATES = ("closed", "half_open", "open")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "kural_http_request_seconds",
+    "Time to produce a response (headers, for streams) per endpoint.",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_CALL_SECONDS = Histogram(
+    "kural_provider_call_seconds",
+    "Latency of successful provider calls.",
+    ["provider", "agent"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_FIRST_TOKEN_SECONDS = Histogram(
+    "kural_provider_first_token_seconds",
+    "Time to first streamed token per provider.",
+    ["provider", "agent"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_FAILURES = Counter(
+    "kural_provider_failures_total",
+    "Failed provider calls by error class.",
+    ["provider", "agent", "reason"],
+)
+FALLBACKS = Counter(
+    "kural_fallbacks_total",
+    "Requests answered by a model other than the preferred one.",
+    ["agent", "preferred", "provider"],
+)
+HEDGE_CANCELLATIONS = Counter(
+    "kural_hedge_cancellations_total",
+    "Hedged provider calls cancelled because another model won.",
+    ["provider", "agent"],
+)
+TOKENS = Counter(
+    "kural_tokens_total",
+    "Tokens sent and received; provider-reported when available, else estimated.",
+    ["provider", "agent", "direction"],
+)
+CONTEXT_MESSAGES = Histogram(
+    "kural_context_messages",
+    "Messages in the context handed to the router per request.",
+    ["agent"],
+    buckets=(0, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+def observe_http_request(endpoint: str, method: str, status: int, seconds: float) -> None:
+    HTTP_REQUEST_SECONDS.labels(endpoint, method, str(status)).observe(seconds)
+
+
+def observe_provider_success(provider: str, agent: str, kind: str, seconds: float) -> None:
+    histogram = PROVIDER_FIRST_TOKEN_SECONDS if kind == "first_token" else PROVIDER_CALL_SECONDS
+    histogram.labels(provider, agent).observe(seconds)
+
+
+def observe_provider_failure(provider: str, agent: str, reason: str) -> None:
+    PROVIDER_FAILURES.labels(provider, agent, reason).inc()
+
+
+def observe_outcome(agent: str, preferred: str, provider: str, cancelled: List[str]) -> None:
+    if provider != preferred:
+        FALLBACKS.labels(agent, preferred, provider).inc()
+    for name in cancelled:
+        HEDGE_CANCELLATIONS.labels(name, agent).inc()
+
+
+def observe_context(agent: str, history: List[Dict]) -> None:
+    CONTEXT_MESSAGES.labels(agent).observe(len(history))
+
+
+def observe_tokens(
+    provider: str,
+    agent: str,
+    usage: Dict[str, int],
+    history: List[Dict],
+    message: str,
+    response: str,
+) -> None:
+    if usage.get("input_tokens") or usage.get("output_tokens"):
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        TOKENS.labels(provider, agent, "cached").inc(usage.get("cached_tokens", 0))
+    else:
+        counter = get_counter(provider)
+        input_tokens = counter.count_messages(history) + counter.count_text(message)
+        output_tokens = counter.count_text(response)
+    TOKENS.labels(provider, agent, "in").inc(input_tokens)
+    TOKENS.labels(provider, agent, "out").inc(output_tokens)
+
+
+class _StateCollector(Collector):
+    # Read at scrape time so the cache and health registry stay unaware of Prometheus.
+    def collect(self):
+        stats = response_cache.stats()
+        lookups = CounterMetricFamily(
+            "kural_response_cache_lookups",
+            "Response cache lookups by result.",
+            labels=["result"],
+        )
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield GaugeMetricFamily("kural_response_cache_entries", "Entries in the response cache.", stats["entries"])
+        yield GaugeMetricFamily("kural_response_cache_bytes", "Bytes held by the response cache.", stats["bytes"])
+        yield GaugeMetricFamily("kural_response_cache_hit_ratio", "Response cache hit ratio.", stats["hit_rate"])
+
+        breaker = GaugeMetricFamily(
+            "kural_provider_breaker_state",
+            "Circuit breaker state per provider (1 for the current state).",
+            labels=["provider", "state"],
+        )
+        latency = GaugeMetricFamily(
+            "kural_provider_latency_ewma_seconds",
+            "Smoothed provider latency used for routing.",
+            labels=["provider", "kind"],
+        )
+        error_rate = GaugeMetricFamily(
+            "kural_provider_error_rate",
+            "Smoothed provider error rate used by the circuit breaker.",
+            labels=["provider"],
+        )
+        cooldown = GaugeMetricFamily(
+            "kural_provider_cooldown_seconds",
+            "Seconds left in a provider's rate-limit cooldown.",
+            labels=["provider"],
+        )
+        for provider, state in health.snapshot().items():
+            for name in BREAKER_STATES:
+                breaker.add_metric([provider, name], 1.0 if state["state"] == name else 0.0)
+            if state["latency_ewma"] is not None:
+                latency.add_metric([provider, "complete"], state["latency_ewma"])
+            if state["ttft_ewma"] is not None:
+                latency.add_metric([provider, "first_token"], state["ttft_ewma"])
+            error_rate.add_metric([provider], state["error_rate"])
+            cooldown.add_metric([provider], state["cooldown_seconds"])
+        yield breaker
+        yield latency
+        yield error_rate
+        yield cooldown
+
+        remaining = GaugeMetricFamily(
+            "kural_provider_quota_remaining",
+            "Requests or tokens left in a provider's rate-limit budget.",
+            labels=["provider", "limit"],
+        )
+        headroom = GaugeMetricFamily(
+            "kural_provider_quota_headroom_ratio",
+            "Fraction left of a provider's tightest rate-limit budget.",
+            labels=["provider"],
+        )
+        for provider, budget in quota.snapshot().items():
+            for name, values in budget["limits"].items():
+                remaining.add_metric([provider, name], values["remaining"])
+            headroom.add_metric([provider], budget["headroom"])
+        yield remaining
+        yield headroom
+
+
+REGISTRY.register(_StateCollector())
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if not MULTIPROCESS_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    # Under gunicorn every worker writes its samples to MULTIPROCESS_DIR and a
+    # scrape aggregates them; cache and health gauges are the answering worker's.
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_StateCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,133 @@
+from abc import ABC, abstractmethod
+import os
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+import quota
+import state
+from utils.history import get_trimmed_history, get_trimmed_history_for_model
+from utils.tokens import get_counter
+
+
+@dataclass
+class ChatRequest:
+    system_prompt: str
+    messages: List[Dict[str, str]]
+    models: Tuple[str, ...]
+    max_tokens: Optional[int] = None
+    # Leading messages that repeat on every call (the project brief); adapters
+    # that support prompt caching mark the system prompt plus these as cacheable.
+    cache_prefix: int = 0
+
+
+class Usage(dict):
+    # Token counts normalized across providers. Streams yield one as their
+    # final item so the router can tell it apart from text chunks.
+    pass
+
+
+def make_usage(
+    input_tokens: Optional[int] = 0,
+    output_tokens: Optional[int] = 0,
+    cached_tokens: Optional[int] = 0,
+    cache_write_tokens: Optional[int] = 0,
+) -> Usage:
+    return Usage(
+        input_tokens=input_tokens or 0,
+        output_tokens=output_tokens or 0,
+        cached_tokens=cached_tokens or 0,
+        cache_write_tokens=cache_write_tokens or 0,
+    )
+
+
+@dataclass
+class ChatResponse:
+    text: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+class ProviderError(RuntimeError):
+    def __init__(
+        self,
+        provider: str,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        reason: Optional[str] = None,
+    ) -> None:
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+        # Set when there is no HTTP status: "timeout", "connection", "not_configured".
+        self.reason = reason
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+PROMPT_CACHE_ENABLED = os.getenv("KURAL_PROMPT_CACHE", "1").lower() not in {"0", "false", "no"}
+
+
+class ProviderAdapter(ABC):
+    name = ""
+    label = ""
+    api_key_env = ""
+    base_url = ""
+    # None means "use MODEL_TOKEN_LIMITS for this provider".
+    context_tokens: Optional[int] = None
+
+    def __init__(self) -> None:
+        # e.g. MISTRAL_BASE_URL=http://127.0.0.1:8765/v1 points at a local mock.
+        override = os.getenv(f"{self.name.upper()}_BASE_URL", "").strip().rstrip("/")
+        if override:
+            self.base_url = override
+
+    def api_key(self) -> str:
+        api_key = os.getenv(self.api_key_env, "")
+        if not api_key:
+            raise ProviderError(
+                self.name,
+                f"{self.api_key_env} is not set.",
+                reason="not_configured",
+            )
+        return api_key
+
+    def is_configured(self) -> bool:
+        return bool(os.getenv(self.api_key_env, "").strip())
+
+    def trim(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        if self.context_tokens is not None:
+            return get_trimmed_history(self.context_tokens, history, get_counter(self.name))
+        return get_trimmed_history_for_model(self.name, history)
+
+    async def check_response(self, response: httpx.Response) -> None:
+        await state.offload(quota.observe_headers, self.name, response.headers)
+        if response.status_code == 200:
+            return
+        body = (await response.aread()).decode("utf-8", errors="replace")
+        raise ProviderError(
+            self.name,
+            f"{self.label} error {response.status_code}: {body}",
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers.get("retry-after")),
+        )
+
+    @abstractmethod
+    async def complete(self, request: ChatRequest) -> ChatResponse:
+        ...
+
+    async def stream(self, request: ChatRequest) -> AsyncIterator[str | Usage]:
+        response = await self.complete(request)
+        yield response.text
+        if response.usage:
+            yield Usage(response.usage)
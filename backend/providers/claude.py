@@ -0,0 +1,123 @@
+import json
+from typing import AsyncIterator, Dict, List
+
+from providers.base import (
+    PROMPT_CACHE_ENABLED,
+    ChatRequest,
+    ChatResponse,
+    ProviderAdapter,
+    ProviderError,
+    Usage,
+    make_usage,
+)
+from providers.clients import get_client
+from utils.sse import aiter_sse_data
+
+ANTHROPIC_VERSION = "2023-06-01"
+DEFAULT_MAX_TOKENS = 1024
+CACHE_CONTROL = {"type": "ephemeral"}
+STREAM_ERROR_STATUS = {
+    "rate_limit_error": 429,
+    "request_too_large": 413,
+    "overloaded_error": 529,
+    "api_error": 500,
+}
+
+
+def _usage(usage: Dict) -> Usage:
+    cached = usage.get("cache_read_input_tokens") or 0
+    written = usage.get("cache_creation_input_tokens") or 0
+    return make_usage(
+        (usage.get("input_tokens") or 0) + cached + written,
+        usage.get("output_tokens"),
+        cached,
+        written,
+    )
+
+
+class ClaudeAdapter(ProviderAdapter):
+    name = "claude"
+    label = "Claude"
+    api_key_env = "CLAUDE_API_KEY"
+    base_url = "https://api.anthropic.com/v1"
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "x-api-key": self.api_key(),
+            "anthropic-version": ANTHROPIC_VERSION,
+            "content-type": "application/json",
+        }
+
+    def _body(self, request: ChatRequest, stream: bool) -> Dict:
+        messages: List[Dict] = []
+        for item in request.messages:
+            role = "user" if item.get("role") == "user" else "assistant"
+            messages.append({"role": role, "content": item.get("content", "")})
+        system: str | List[Dict] = request.system_prompt
+        if PROMPT_CACHE_ENABLED:
+            # Breakpoints after the system prompt and after the stable brief;
+            # prefixes under the model's minimum length are just not cached.
+            system = [{"type": "text", "text": request.system_prompt, "cache_control": CACHE_CONTROL}]
+            if 0 < request.cache_prefix < len(messages):
+                last = messages[request.cache_prefix - 1]
+                last["content"] = [
+                    {"type": "text", "text": last["content"], "cache_control": CACHE_CONTROL}
+                ]
+        body: Dict = {
+            "model": request.models[0],
+            "max_tokens": request.max_tokens or DEFAULT_MAX_TOKENS,
+            "system": system,
+            "messages": messages,
+        }
+        if stream:
+            body["stream"] = True
+        return body
+
+    async def complete(self, request: ChatRequest) -> ChatResponse:
+        response = await get_client(self.name).post(
+            f"{self.base_url}/messages",
+            headers=self._headers(),
+            json=self._body(request, stream=False),
+        )
+        await self.check_response(response)
+        payload = response.json()
+        text = "".join(
+            block.get("text", "")
+            for block in payload.get("content") or []
+            if block.get("type") == "text"
+        )
+        return ChatResponse(
+            text=text,
+            model=request.models[0],
+            usage=_usage(payload.get("usage") or {}),
+        )
+
+    async def stream(self, request: ChatRequest) -> AsyncIterator[str | Usage]:
+        usage: Dict = {}
+        async with get_client(self.name).stream(
+            "POST",
+            f"{self.base_url}/messages",
+            headers=self._headers(),
+            json=self._body(request, stream=True),
+        ) as response:
+            await self.check_response(response)
+            async for data in aiter_sse_data(response):
+                event = json.loads(data)
+                if event.get("type") == "error":
+                    error = event.get("error") or {}
+                    raise ProviderError(
+                        self.name,
+                        f"Claude error: {error.get('message', data)}",
+                        status_code=STREAM_ERROR_STATUS.get(error.get("type", "")),
+                    )
+                if event.get("type") == "message_start":
+                    usage.update((event.get("message") or {}).get("usage") or {})
+                if event.get("type") == "message_delta":
+                    usage.update(event.get("usage") or {})
+                if event.get("type") == "message_stop":
+                    break
+                delta = event.get("delta") or {}
+                if event.get("type") == "content_block_delta" and delta.get("text"):
+                    yield delta["text"]
+        if usage:
+            yield _usage(usage)
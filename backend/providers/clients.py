@@ -0,0 +1,44 @@
+import os
+from typing import Dict
+
+import httpx
+
+from tracing import TracingTransport
+
+REQUEST_TIMEOUT_SECONDS = int(os.getenv("MODEL_HTTP_TIMEOUT", "120"))
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("KURAL_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("KURAL_HTTP_POOL_MAXSIZE", "16"))
+HTTP_KEEPALIVE = int(os.getenv("KURAL_HTTP_KEEPALIVE", "8"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("KURAL_HTTP_KEEPALIVE_EXPIRY", "90"))
+
+# Clients are bound to the engine event loop, so they are only ever touched
+# from that loop's thread and need no locking. A forked worker starts over.
+_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+_CLIENTS_PID = os.getpid()
+
+
+def get_client(provider: str) -> httpx.AsyncClient:
+    global _CLIENTS_PID
+    if _CLIENTS_PID != os.getpid():
+        _CLIENTS.clear()
+        _CLIENTS_PID = os.getpid()
+    client = _CLIENTS.get(provider)
+    if client is None:
+        limits = httpx.Limits(
+            max_connections=HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            transport=TracingTransport(httpx.AsyncHTTPTransport(limits=limits), provider),
+        )
+        _CLIENTS[provider] = client
+    return client
+
+
+async def close_clients() -> None:
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    for client in clients:
+        await client.aclose()
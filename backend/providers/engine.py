@@ -0,0 +1,190 @@
+import asyncio
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Tuple
+
+import httpx
+
+import tracing
+from providers.base import ChatRequest, ChatResponse, ProviderAdapter, ProviderError, Usage
+from providers.clients import get_client
+from providers.registry import configured_providers, get_adapter
+from utils.history import HEAD_MESSAGES
+
+PREWARM_TIMEOUT_SECONDS = float(os.getenv("KURAL_PREWARM_TIMEOUT", "5"))
+UNCONFIGURED_PROVIDERS = {
+    "gpt4o": "GPT-4o is not configured on the backend.",
+}
+
+
+@dataclass(frozen=True)
+class RoleConfig:
+    name: str
+    system_prompt: str
+    default_model: str
+    models: Dict[str, Tuple[str, ...]]
+    max_tokens: Dict[str, int] = field(default_factory=dict)
+
+
+_LOOP: asyncio.AbstractEventLoop | None = None
+_LOOP_PID: int | None = None
+_LOOP_LOCK = threading.Lock()
+_END = object()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    # One event loop per process carries every in-flight provider call.
+    global _LOOP, _LOOP_PID
+    with _LOOP_LOCK:
+        if _LOOP is None or _LOOP_PID != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="kural-engine", daemon=True).start()
+            _LOOP, _LOOP_PID = loop, os.getpid()
+        return _LOOP
+
+
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iterate_sync(chunks: AsyncIterator) -> Iterator:
+    items: queue.Queue = queue.Queue()
+
+    async def pump() -> None:
+        try:
+            async for item in chunks:
+                items.put((item, None))
+        except asyncio.CancelledError:
+            items.put((_END, None))
+            raise
+        except Exception as exc:
+            items.put((_END, exc))
+        else:
+            items.put((_END, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
+
+
+def resolve_adapter(role: RoleConfig, model_name: str) -> Tuple[str, ProviderAdapter | None]:
+    choice = (model_name or role.default_model).lower()
+    if choice in UNCONFIGURED_PROVIDERS:
+        return choice, None
+    adapter = get_adapter(choice)
+    if adapter is None or choice not in role.models:
+        adapter = get_adapter(role.default_model)
+    return adapter.name, adapter
+
+
+def build_request(
+    role: RoleConfig,
+    adapter: ProviderAdapter,
+    history: List[Dict[str, str]],
+    current_message: str,
+) -> ChatRequest:
+    if current_message:
+        history = list(history) + [
+            {
+                "role": "user",
+                "content": current_message,
+                "type": "input",
+            }
+        ]
+    with tracing.span("context.build", **{"kural.provider": adapter.name}) as current:
+        messages = adapter.trim(history)
+        current.set_attributes(
+            {"kural.history_messages": len(history), "kural.context_messages": len(messages)}
+        )
+    cache_prefix = 0
+    # Only the untouched opening turns are a stable prefix; the newest message never is.
+    while (
+        cache_prefix < min(HEAD_MESSAGES, len(messages) - 1)
+        and messages[cache_prefix].get("content") == history[cache_prefix].get("content")
+    ):
+        cache_prefix += 1
+    return ChatRequest(
+        system_prompt=role.system_prompt,
+        messages=messages,
+        models=role.models[adapter.name],
+        max_tokens=role.max_tokens.get(adapter.name),
+        cache_prefix=cache_prefix,
+    )
+
+
+def _transport_error(adapter: ProviderAdapter, exc: httpx.HTTPError) -> ProviderError:
+    if isinstance(exc, httpx.TimeoutException):
+        return ProviderError(
+            adapter.name,
+            f"{adapter.label} request timed out: {exc!r}",
+            reason="timeout",
+        )
+    return ProviderError(
+        adapter.name,
+        f"{adapter.label} request failed: {exc!r}",
+        reason="connection",
+    )
+
+
+async def respond(
+    role: RoleConfig,
+    model_name: str,
+    history: List[Dict[str, str]],
+    current_message: str,
+) -> ChatResponse:
+    choice, adapter = resolve_adapter(role, model_name)
+    if adapter is None:
+        return ChatResponse(text=UNCONFIGURED_PROVIDERS[choice], model=choice)
+    request = build_request(role, adapter, history, current_message)
+    try:
+        return await adapter.complete(request)
+    except httpx.HTTPError as exc:
+        raise _transport_error(adapter, exc) from exc
+
+
+async def stream(
+    role: RoleConfig,
+    model_name: str,
+    history: List[Dict[str, str]],
+    current_message: str,
+) -> AsyncIterator[str | Usage]:
+    choice, adapter = resolve_adapter(role, model_name)
+    if adapter is None:
+        yield UNCONFIGURED_PROVIDERS[choice]
+        return
+    request = build_request(role, adapter, history, current_message)
+    try:
+        async for chunk in adapter.stream(request):
+            yield chunk
+    except httpx.HTTPError as exc:
+        raise _transport_error(adapter, exc) from exc
+
+
+async def prewarm(providers: Iterable[str] | None = None) -> Dict[str, str]:
+    results: Dict[str, str] = {}
+    for name in providers or configured_providers():
+        adapter = get_adapter(name)
+        if adapter is None:
+            results[name] = "unknown provider"
+            continue
+        try:
+            # Any response will do; the point is an open keep-alive TLS connection.
+            await get_client(adapter.name).head(adapter.base_url, timeout=PREWARM_TIMEOUT_SECONDS)
+            results[name] = "ok"
+        except httpx.HTTPError as exc:
+            results[name] = f"failed: {exc!r}"
+    return results
+
+
+def prewarm_sync(providers: Iterable[str] | None = None) -> Dict[str, str]:
+    return run_sync(prewarm(providers))
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from providers.base import (
+    PROMPT_CACHE_ENABLED,
+    ChatRequest,
+    ChatResponse,
+    ProviderAdapter,
+    ProviderError,
+    Usage,
+    make_usage,
+)
+from providers.clients import get_client
+from utils.history import format_for_gemini
+from utils.sse import aiter_sse_data
+from utils.tokens import count_tokens
+
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("KURAL_GEMINI_CACHE_TTL", "600"))
+# Gemini rejects cached contents below a model-specific minimum size.
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("KURAL_GEMINI_CACHE_MIN_TOKENS", "4096"))
+# Extend a cache that is still in use once less than this share of its TTL remains.
+CONTEXT_CACHE_REFRESH_FRACTION = 0.25
+
+
+def _usage(metadata: Dict) -> Usage:
+    return make_usage(
+        metadata.get("promptTokenCount"),
+        metadata.get("candidatesTokenCount"),
+        metadata.get("cachedContentTokenCount"),
+    )
+
+
+def _candidate_text(payload: Dict) -> str:
+    candidates = payload.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+class GeminiAdapter(ProviderAdapter):
+    name = "gemini"
+    label = "Gemini"
+    api_key_env = "GEMINI_API_KEY"
+    base_url = "https://generativelanguage.googleapis.com/v1beta"
+
+    def _headers(self) -> Dict[str, str]:
+        return {"x-goog-api-key": self.api_key(), "Content-Type": "application/json"}
+
+    def __init__(self) -> None:
+        super().__init__()
+        # prefix hash -> (cachedContents name, expiry); None marks a prefix the
+        # API refused, so it is not offered again until the process restarts.
+        self._context_caches: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def _body(self, request: ChatRequest, cached_content: Optional[str] = None) -> Dict:
+        contents = format_for_gemini(request.messages)
+        if cached_content:
+            body: Dict = {
+                "cachedContent": cached_content,
+                "contents": contents[request.cache_prefix:],
+            }
+        else:
+            body = {
+                "systemInstruction": {"parts": [{"text": request.system_prompt}]},
+                "contents": contents,
+            }
+        if request.max_tokens:
+            body["generationConfig"] = {"maxOutputTokens": request.max_tokens}
+        return body
+
+    def _prefix_key(self, model_id: str, request: ChatRequest) -> str:
+        prefix = [request.system_prompt] + [
+            item.get("content", "") for item in request.messages[: request.cache_prefix]
+        ]
+        encoded = json.dumps([model_id, prefix], ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    async def _context_cache(self, model_id: str, request: ChatRequest) -> Optional[str]:
+        if not PROMPT_CACHE_ENABLED or request.cache_prefix >= len(request.messages):
+            return None
+        key = self._prefix_key(model_id, request)
+        if key in self._context_caches and self._context_caches[key] is None:
+            return None
+        now = time.time()
+        entry = self._context_caches.get(key)
+        if entry is not None:
+            name, expires_at = entry
+            if expires_at - now > CONTEXT_CACHE_TTL_SECONDS * CONTEXT_CACHE_REFRESH_FRACTION:
+                return name
+            if expires_at > now + 5 and await self._extend_context_cache(name):
+                self._context_caches[key] = (name, now + CONTEXT_CACHE_TTL_SECONDS)
+                return name
+            self._context_caches.pop(key, None)
+        prefix = request.messages[: request.cache_prefix]
+        size = count_tokens(request.system_prompt, self.name) + sum(
+            count_tokens(item.get("content", ""), self.name) for item in prefix
+        )
+        if size < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        try:
+            response = await get_client(self.name).post(
+                f"{self.base_url}/cachedContents",
+                headers=self._headers(),
+                json={
+                    "model": f"models/{model_id}",
+                    "systemInstruction": {"parts": [{"text": request.system_prompt}]},
+                    "contents": format_for_gemini(prefix),
+                    "ttl": f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                },
+            )
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            # Not every model or tier supports explicit caching; use plain calls.
+            self._context_caches[key] = None
+            return None
+        name = response.json().get("name")
+        if not name:
+            return None
+        for stale, other in list(self._context_caches.items()):
+            if other is not None and other[1] <= now:
+                del self._context_caches[stale]
+        self._context_caches[key] = (name, now + CONTEXT_CACHE_TTL_SECONDS)
+        return name
+
+    async def _extend_context_cache(self, name: str) -> bool:
+        try:
+            response = await get_client(self.name).patch(
+                f"{self.base_url}/{name}",
+                params={"updateMask": "ttl"},
+                headers=self._headers(),
+                json={"ttl": f"{CONTEXT_CACHE_TTL_SECONDS}s"},
+            )
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    def _forget_context_cache(self, model_id: str, request: ChatRequest) -> None:
+        self._context_caches.pop(self._prefix_key(model_id, request), None)
+
+    def _all_failed(self, errors: List[str], last: Optional[ProviderError]) -> ProviderError:
+        return ProviderError(
+            self.name,
+            "Gemini request failed for all configured model IDs. "
+            f"Details: {' | '.join(errors)}",
+            status_code=last.status_code if last else None,
+            retry_after=last.retry_after if last else None,
+            reason=last.reason if last else None,
+        )
+
+    async def complete(self, request: ChatRequest) -> ChatResponse:
+        errors: List[str] = []
+        last: Optional[ProviderError] = None
+        for model_id in dict.fromkeys(request.models):
+            cached_content = await self._context_cache(model_id, request)
+            try:
+                response = await get_client(self.name).post(
+                    f"{self.base_url}/models/{model_id}:generateContent",
+                    headers=self._headers(),
+                    json=self._body(request, cached_content),
+                )
+                if cached_content and response.status_code in (400, 403, 404):
+                    # The cache expired or was evicted server-side; retry without it.
+                    self._forget_context_cache(model_id, request)
+                    response = await get_client(self.name).post(
+                        f"{self.base_url}/models/{model_id}:generateContent",
+                        headers=self._headers(),
+                        json=self._body(request),
+                    )
+                await self.check_response(response)
+            except ProviderError as exc:
+                errors.append(f"{model_id}: {exc}")
+                last = exc
+                continue
+            payload = response.json()
+            return ChatResponse(
+                text=_candidate_text(payload),
+                model=model_id,
+                usage=_usage(payload.get("usageMetadata") or {}),
+            )
+        raise self._all_failed(errors, last)
+
+    async def stream(self, request: ChatRequest) -> AsyncIterator[str | Usage]:
+        errors: List[str] = []
+        last: Optional[ProviderError] = None
+        for model_id in dict.fromkeys(request.models):
+            cached_content = await self._context_cache(model_id, request)
+            for use_cache in (True, False) if cached_content else (False,):
+                async with get_client(self.name).stream(
+                    "POST",
+                    f"{self.base_url}/models/{model_id}:streamGenerateContent",
+                    params={"alt": "sse"},
+                    headers=self._headers(),
+                    json=self._body(request, cached_content if use_cache else None),
+                ) as response:
+                    if use_cache and response.status_code in (400, 403, 404):
+                        self._forget_context_cache(model_id, request)
+                        continue
+                    try:
+                        await self.check_response(response)
+                    except ProviderError as exc:
+                        errors.append(f"{model_id}: {exc}")
+                        last = exc
+                        break
+                    metadata: Dict = {}
+                    async for data in aiter_sse_data(response):
+                        payload = json.loads(data)
+                        metadata = payload.get("usageMetadata") or metadata
+                        text = _candidate_text(payload)
+                        if text:
+                            yield text
+                    if metadata:
+                        yield _usage(metadata)
+                    return
+        raise self._all_failed(errors, last)
@@ -0,0 +1,123 @@
+import json
+from typing import AsyncIterator, Dict, List
+
+from providers.base import ChatRequest, ChatResponse, ProviderAdapter, Usage, make_usage
+from providers.clients import get_client
+from utils.history import format_for_groq
+from utils.sse import aiter_sse_data
+
+
+def _usage(usage: Dict) -> Usage:
+    # These APIs cache long prompt prefixes automatically; the hit shows up
+    # as prompt_tokens_details.cached_tokens (or a top-level field on some).
+    details = usage.get("prompt_tokens_details") or {}
+    return make_usage(
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+        details.get("cached_tokens") or usage.get("cached_tokens"),
+    )
+
+
+class OpenAICompatibleAdapter(ProviderAdapter):
+    extra_headers: Dict[str, str] = {}
+    # Extra body fields that make the API report usage at the end of a stream.
+    stream_usage_options: Dict = {"stream_options": {"include_usage": True}}
+
+    def format_messages(self, request: ChatRequest) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": request.system_prompt}]
+        for item in request.messages:
+            role = "user" if item.get("role") == "user" else "assistant"
+            messages.append({"role": role, "content": item.get("content", "")})
+        return messages
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key()}",
+            "Content-Type": "application/json",
+            **self.extra_headers,
+        }
+
+    def _body(self, request: ChatRequest, stream: bool) -> Dict:
+        body: Dict = {
+            "model": request.models[0],
+            "messages": self.format_messages(request),
+        }
+        if request.max_tokens:
+            body["max_tokens"] = request.max_tokens
+        if stream:
+            body["stream"] = True
+            body.update(self.stream_usage_options)
+        return body
+
+    async def complete(self, request: ChatRequest) -> ChatResponse:
+        response = await get_client(self.name).post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            json=self._body(request, stream=False),
+        )
+        await self.check_response(response)
+        payload = response.json()
+        return ChatResponse(
+            text=payload["choices"][0]["message"]["content"] or "",
+            model=request.models[0],
+            usage=_usage(payload.get("usage") or {}),
+        )
+
+    async def stream(self, request: ChatRequest) -> AsyncIterator[str | Usage]:
+        usage: Dict = {}
+        async with get_client(self.name).stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            json=self._body(request, stream=True),
+        ) as response:
+            await self.check_response(response)
+            async for data in aiter_sse_data(response):
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage") or usage
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+        if usage:
+            yield _usage(usage)
+
+
+class MistralAdapter(OpenAICompatibleAdapter):
+    name = "mistral"
+    label = "Mistral"
+    api_key_env = "MISTRAL_API_KEY"
+    base_url = "https://api.mistral.ai/v1"
+    context_tokens = 4000
+    # Mistral reports usage on the last chunk without being asked.
+    stream_usage_options: Dict = {}
+
+
+class OpenRouterAdapter(OpenAICompatibleAdapter):
+    name = "openrouter"
+    label = "OpenRouter"
+    api_key_env = "OPENROUTER_API_KEY"
+    base_url = "https://openrouter.ai/api/v1"
+    context_tokens = 4000
+    extra_headers = {
+        "HTTP-Referer": "http://localhost:3000",
+        "X-Title": "Kural IDE",
+    }
+
+
+class GroqAdapter(OpenAICompatibleAdapter):
+    name = "groq"
+    label = "Groq"
+    api_key_env = "GROQ_API_KEY"
+    base_url = "https://api.groq.com/openai/v1"
+    # Groq reports stream usage under x_groq on the last chunk.
+    stream_usage_options: Dict = {}
+
+    def format_messages(self, request: ChatRequest) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": request.system_prompt}]
+        messages.extend(format_for_groq(request.messages))
+        return messages
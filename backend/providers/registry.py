@@ -0,0 +1,50 @@
+import importlib
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from providers.base import ProviderAdapter
+
+GEMINI_MODEL_IDS = (
+    "gemini-1.5-flash",
+    "gemini-1.5-flash-latest",
+    "gemini-2.0-flash",
+    "gemini-2.0-flash-lite",
+)
+
+# Adapter modules are imported the first time a provider is used, so a
+# deployment with only OpenRouter configured never loads the others.
+# name -> (module, class, API key variable)
+PROVIDERS: Dict[str, Tuple[str, str, str]] = {
+    "gemini": ("providers.gemini", "GeminiAdapter", "GEMINI_API_KEY"),
+    "groq": ("providers.openai_compat", "GroqAdapter", "GROQ_API_KEY"),
+    "claude": ("providers.claude", "ClaudeAdapter", "CLAUDE_API_KEY"),
+    "mistral": ("providers.openai_compat", "MistralAdapter", "MISTRAL_API_KEY"),
+    "openrouter": ("providers.openai_compat", "OpenRouterAdapter", "OPENROUTER_API_KEY"),
+}
+
+_ADAPTERS: Dict[str, ProviderAdapter] = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+
+def get_adapter(name: str) -> Optional[ProviderAdapter]:
+    key = (name or "").lower()
+    adapter = _ADAPTERS.get(key)
+    if adapter is not None or key not in PROVIDERS:
+        return adapter
+    with _ADAPTERS_LOCK:
+        adapter = _ADAPTERS.get(key)
+        if adapter is None:
+            module_name, class_name, _ = PROVIDERS[key]
+            adapter_class = getattr(importlib.import_module(module_name), class_name)
+            adapter = _ADAPTERS[key] = adapter_class()
+        return adapter
+
+
+def configured_providers() -> List[str]:
+    # Checked from the environment so unconfigured adapters stay unloaded.
+    return [name for name, (_, _, key_env) in PROVIDERS.items() if os.getenv(key_env, "").strip()]
+
+
+def load_configured() -> List[str]:
+    return [name for name in configured_providers() if get_adapter(name) is not None]
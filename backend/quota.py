@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Mapping, Optional
+
+import state
+from utils.tokens import TokenCounter
+
+QUOTA_ENABLED = os.getenv("KURAL_QUOTA", "1").lower() not in {"0", "false", "no"}
+# A request that would wait longer than this for its provider's budget is
+# sent to the next provider in the chain instead of queueing.
+QUOTA_MAX_WAIT_SECONDS = float(os.getenv("KURAL_QUOTA_MAX_WAIT", "3"))
+# Reserved per request for the answer until the provider reports usage.
+QUOTA_OUTPUT_TOKENS = int(os.getenv("KURAL_QUOTA_OUTPUT_TOKENS", "1024"))
+
+LIMIT_WINDOWS = {"rpm": 60.0, "tpm": 60.0, "rpd": 24 * 60 * 60.0}
+# Free-tier limits of the models the agents use. <PROVIDER>_RPM, _TPM and
+# _RPD override them; 0 means no limit. Response headers refine them at run time.
+DEFAULT_LIMITS = {
+    "gemini": {"rpm": 15, "tpm": 1_000_000, "rpd": 1500},
+    "openrouter": {"rpm": 20, "tpm": 0, "rpd": 50},
+    "groq": {"rpm": 30, "tpm": 12_000, "rpd": 1000},
+    "mistral": {"rpm": 60, "tpm": 500_000, "rpd": 0},
+}
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class QuotaExhausted(RuntimeError):
+    # Every provider that could take the request is out of budget for longer
+    # than KURAL_QUOTA_MAX_WAIT; the caller should come back after retry_after.
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Bucket:
+    # A token bucket whose level may go negative: each reservation is taken
+    # immediately and the caller waits until the refill has covered it.
+    limit: float = 0.0
+    window: float = 60.0
+    level: float = 0.0
+    updated: float = 0.0
+    # When a provider last reported the level in its response headers.
+    observed: float = 0.0
+
+    def refill(self, now: float) -> None:
+        if self.limit:
+            self.level = min(self.limit, self.level + (now - self.updated) * self.limit / self.window)
+        self.updated = now
+
+    def wait(self, amount: float) -> float:
+        if not self.limit:
+            return 0.0
+        # A request larger than the whole budget can only wait for a full bucket.
+        deficit = min(amount, self.limit) - self.level
+        return max(0.0, deficit * self.window / self.limit)
+
+
+@dataclass
+class ProviderQuota:
+    buckets: Dict[str, Bucket] = field(default_factory=dict)
+
+
+_PROVIDERS: Dict[str, ProviderQuota] = {}
+_SHARED_LOCKS: Dict[str, state.SharedLock] = {}
+_LOCK = threading.Lock()
+
+
+def configured_limits(provider: str) -> Dict[str, float]:
+    limits = dict(DEFAULT_LIMITS.get(provider, {}))
+    for name in LIMIT_WINDOWS:
+        value = os.getenv(f"{provider.upper()}_{name.upper()}", "").strip()
+        if value:
+            limits[name] = float(value)
+    return {name: float(limits.get(name, 0)) for name in LIMIT_WINDOWS}
+
+
+def _new(provider: str, now: float) -> ProviderQuota:
+    return ProviderQuota(
+        buckets={
+            name: Bucket(limit=limit, window=LIMIT_WINDOWS[name], level=limit, updated=now)
+            for name, limit in configured_limits(provider).items()
+        }
+    )
+
+
+def _encode(quota: ProviderQuota) -> Dict:
+    return {name: asdict(bucket) for name, bucket in quota.buckets.items()}
+
+
+def _decode(provider: str, data: Dict | None, now: float) -> ProviderQuota:
+    if not data:
+        return _new(provider, now)
+    return ProviderQuota(buckets={name: Bucket(**bucket) for name, bucket in data.items()})
+
+
+@contextmanager
+def _provider(provider: str, update: bool = True) -> Iterator[ProviderQuota]:
+    now = time.time()
+    if not state.backend.shared:
+        with _LOCK:
+            quota = _PROVIDERS.get(provider)
+            if quota is None:
+                quota = _PROVIDERS[provider] = _new(provider, now)
+            for bucket in quota.buckets.values():
+                bucket.refill(now)
+            yield quota
+        return
+    if not update:
+        quota = _decode(provider, state.backend.get("quota", provider), now)
+        for bucket in quota.buckets.values():
+            bucket.refill(now)
+        yield quota
+        return
+    # Shared budgets are read, changed and written back under a lock held
+    # across workers, so every worker draws from the same buckets.
+    with _LOCK:
+        lock = _SHARED_LOCKS.get(provider)
+        if lock is None:
+            lock = _SHARED_LOCKS[provider] = state.SharedLock(state.backend.lock_path(f"quota-{provider}"))
+    with lock:
+        quota = _decode(provider, state.backend.get("quota", provider), now)
+        for bucket in quota.buckets.values():
+            bucket.refill(now)
+        yield quota
+        state.backend.set("quota", provider, _encode(quota))
+
+
+def _costs(tokens: int) -> Dict[str, float]:
+    return {"rpm": 1.0, "tpm": float(tokens), "rpd": 1.0}
+
+
+def estimate_tokens(
+    system_prompt: str,
+    messages: List[Dict],
+    max_tokens: Optional[int],
+    counter: TokenCounter,
+) -> int:
+    # The prompt the provider will actually be sent, counted the way its
+    # context was trimmed, plus room for the answer; settle() corrects it
+    # once the provider reports usage.
+    prompt = counter.count_text(system_prompt) + counter.count_messages(messages)
+    return prompt + (max_tokens or QUOTA_OUTPUT_TOKENS)
+
+
+def wait_time(provider: str, tokens: int) -> float:
+    if not QUOTA_ENABLED:
+        return 0.0
+    with _provider(provider, update=False) as quota:
+        costs = _costs(tokens)
+        return max((bucket.wait(costs[name]) for name, bucket in quota.buckets.items()), default=0.0)
+
+
+def reserve(provider: str, tokens: int) -> float:
+    # Takes the request's share of every budget and returns how long to wait
+    # before sending it.
+    if not QUOTA_ENABLED:
+        return 0.0
+    with _provider(provider) as quota:
+        costs = _costs(tokens)
+        delay = max((bucket.wait(costs[name]) for name, bucket in quota.buckets.items()), default=0.0)
+        for name, bucket in quota.buckets.items():
+            if bucket.limit:
+                bucket.level -= costs[name]
+        return delay
+
+
+def settle(provider: str, reserved_tokens: int, used_tokens: int | None, reserved_at: float = 0.0) -> None:
+    # used_tokens=None (a failed request) gives the reserved tokens back; the
+    # request itself still counts against the request budgets. A level the
+    # provider reported after the reservation already accounts for this
+    # request, so correcting it again would count the tokens twice.
+    if not QUOTA_ENABLED:
+        return
+    with _provider(provider) as quota:
+        bucket = quota.buckets.get("tpm")
+        if bucket is not None and bucket.limit and bucket.observed < reserved_at:
+            bucket.level = min(bucket.limit, bucket.level + reserved_tokens - (used_tokens or 0))
+
+
+def _header(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _reset_seconds(value: Optional[str], now: float) -> Optional[float]:
+    # "2m59.56s" and "120ms" (OpenAI, Groq), epoch milliseconds (OpenRouter),
+    # RFC 3339 timestamps (Anthropic) or plain seconds.
+    if not value:
+        return None
+    number = _number(value)
+    if number is not None:
+        return max(0.0, number / 1000 - now) if number > 1e11 else number
+    parts = _DURATION_RE.findall(value)
+    if parts:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    try:
+        return max(0.0, datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() - now)
+    except ValueError:
+        return None
+
+
+def observe_headers(provider: str, headers: Mapping[str, str]) -> None:
+    # Providers report what is left of their budgets; trust them over our
+    # own count, and learn the limits when they differ from the defaults.
+    if not QUOTA_ENABLED:
+        return
+    reports = []
+    for kind, bucket_name in (("requests", "rpm"), ("tokens", "tpm")):
+        remaining = _number(
+            _header(headers, f"x-ratelimit-remaining-{kind}", f"anthropic-ratelimit-{kind}-remaining")
+            or (_header(headers, "x-ratelimit-remaining") if kind == "requests" else None)
+        )
+        if remaining is None:
+            continue
+        limit = _number(
+            _header(headers, f"x-ratelimit-limit-{kind}", f"anthropic-ratelimit-{kind}-limit")
+            or (_header(headers, "x-ratelimit-limit") if kind == "requests" else None)
+        )
+        reset = _reset_seconds(
+            _header(headers, f"x-ratelimit-reset-{kind}", f"anthropic-ratelimit-{kind}-reset")
+            or (_header(headers, "x-ratelimit-reset") if kind == "requests" else None),
+            time.time(),
+        )
+        # Some providers count requests per day here (Groq), others per minute.
+        if kind == "requests" and reset is not None and reset > 2 * LIMIT_WINDOWS["rpm"]:
+            bucket_name = "rpd"
+        reports.append((bucket_name, remaining, limit))
+    if not reports:
+        return
+    with _provider(provider) as quota:
+        for bucket_name, remaining, limit in reports:
+            bucket = quota.buckets.setdefault(bucket_name, Bucket(window=LIMIT_WINDOWS[bucket_name], updated=time.time()))
+            if limit:
+                bucket.limit = limit
+            if bucket.limit:
+                bucket.level = min(bucket.limit, remaining)
+                bucket.observed = time.time()
+
+
+def _summary(quota: ProviderQuota) -> Dict:
+    limits = {
+        name: {"limit": bucket.limit, "remaining": max(0, int(bucket.level))}
+        for name, bucket in quota.buckets.items()
+        if bucket.limit
+    }
+    headroom = min((item["remaining"] / item["limit"] for item in limits.values()), default=1.0)
+    return {
+        "limits": limits,
+        "headroom": round(headroom, 3),
+        "wait_seconds": round(
+            max((bucket.wait(_costs(QUOTA_OUTPUT_TOKENS)[name]) for name, bucket in quota.buckets.items()), default=0.0),
+            1,
+        ),
+    }
+
+
+def snapshot(providers: List[str] | None = None) -> Dict[str, Dict]:
+    if providers is None:
+        seen = state.backend.items("quota") if state.backend.shared else _PROVIDERS
+        providers = sorted(set(DEFAULT_LIMITS) | set(seen))
+    result = {}
+    for provider in providers:
+        with _provider(provider, update=False) as quota:
+            result[provider] = _summary(quota)
+    return result
@@ -1,6 +1,20 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import asyncio
+import os
+from contextlib import contextmanager
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Tuple
+
+from cache import CACHE_ENABLED, request_key, response_cache
+import health
+import metrics
+import quota
+import state
+import tracing
+from providers import engine
+from providers.base import Usage
+from utils.tokens import get_counter
 
 ARCHITECT_FALLBACK_CHAIN = [
     "gemini",
@@ -15,64 +29,503 @@ BUILDER_FALLBACK_CHAIN = [
     "groq",
 ]
 
-FALLBACK_ERRORS = [
-    "429",
-    "413",
-    "504",
-    "rate_limit",
-    "quota",
-    "exceeded",
-    "limit",
-    "timeout",
-    "timed out",
-    "gateway timeout",
+MEMORY_FALLBACK_CHAIN = [
+    "groq",
+    "gemini",
+    "mistral",
 ]
 
+FALLBACK_CHAINS = {
+    "architect": ARCHITECT_FALLBACK_CHAIN,
+    "builder": BUILDER_FALLBACK_CHAIN,
+    "memory": MEMORY_FALLBACK_CHAIN,
+}
 
-def should_fallback(error_message: str) -> bool:
-    error_lower = (error_message or "").lower()
-    return any(code in error_lower for code in FALLBACK_ERRORS)
+HEDGE_ENABLED = os.getenv("KURAL_HEDGE", "").lower() in {"1", "true", "yes"}
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("KURAL_HEDGE_DELAY", "8"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("KURAL_HEDGE_MIN_DELAY", "1"))
+HEDGE_PERCENTILE = float(os.getenv("KURAL_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = 5
+HEDGE_MAX_IN_FLIGHT = int(os.getenv("KURAL_HEDGE_MAX_IN_FLIGHT", "2"))
 
 
-def call_with_fallback(
-    agent_type: str,
-    history: List[Dict],
-    message: str,
-    preferred_model: str | None = None,
-) -> Dict:
-    from agents.architect import get_architect_response
-    from agents.builder import get_builder_response
+def hedge_delay(model: str, kind: str) -> float:
+    delay = health.latency_percentile(model, kind, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    if delay is None:
+        return HEDGE_DEFAULT_DELAY_SECONDS
+    return max(delay, HEDGE_MIN_DELAY_SECONDS)
+
+
+def should_fallback(exc: BaseException) -> bool:
+    return health.classify_error(exc) in health.FALLBACK_REASONS
 
-    base_chain = ARCHITECT_FALLBACK_CHAIN if agent_type == "architect" else BUILDER_FALLBACK_CHAIN
+
+def _build_chain(agent_type: str, preferred_model: str | None) -> List[str]:
+    base_chain = FALLBACK_CHAINS.get(agent_type, BUILDER_FALLBACK_CHAIN)
     chain: List[str] = []
     if preferred_model:
         chain.append(preferred_model.lower())
     for model in base_chain:
         if model not in chain:
             chain.append(model)
-    last_error = None
+    return chain
 
-    for index, model in enumerate(chain):
-        try:
-            print(f"[Kural IDE] Trying {model} for {agent_type}...")
-            if agent_type == "architect":
-                response = get_architect_response(model, history, message)
+
+def _role(agent_type: str) -> engine.RoleConfig:
+    from agents.architect import ARCHITECT_ROLE
+    from agents.builder import BUILDER_ROLE
+    from agents.memory import MEMORY_ROLE
+
+    if agent_type == "memory":
+        return MEMORY_ROLE
+    return ARCHITECT_ROLE if agent_type == "architect" else BUILDER_ROLE
+
+
+def _cache_key(
+    role: engine.RoleConfig,
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None,
+    use_cache: bool,
+) -> str | None:
+    if not (use_cache and CACHE_ENABLED):
+        return None
+    return request_key(role, _build_chain(agent_type, preferred_model)[0], history, message)
+
+
+class _Attempts:
+    def __init__(
+        self,
+        agent_type: str,
+        role: engine.RoleConfig,
+        history: List[Dict],
+        message: str,
+        preferred_model: str | None,
+        hedge: bool | None,
+        kind: str,
+    ) -> None:
+        self.agent_type = agent_type
+        self.role = role
+        self.history = history
+        self.message = message
+        self.chain = _build_chain(agent_type, preferred_model)
+        self.preferred = self.chain[0]
+        self.hedge = HEDGE_ENABLED if hedge is None else hedge
+        self.kind = kind
+        self.next_index = 0
+        self.fired: List[str] = []
+        self.started: Dict[int, float] = {}
+        self.delays: Dict[int, float] = {}
+        self.reserved_at: Dict[int, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.last_error: str | None = None
+
+    async def rank(self) -> None:
+        self.chain = await state.offload(health.order_chain, self.chain)
+
+    def can_launch(self) -> bool:
+        return self.next_index < len(self.chain)
+
+    def tokens_for(self, model: str) -> int:
+        # Each provider trims the history to its own context window, so the
+        # reservation is sized from the request that provider will be sent.
+        if model not in self.tokens:
+            _, adapter = engine.resolve_adapter(self.role, model)
+            if adapter is None:
+                self.tokens[model] = 0
             else:
-                response = get_builder_response(model, history, message)
+                request = engine.build_request(self.role, adapter, self.history, self.message)
+                self.tokens[model] = quota.estimate_tokens(
+                    request.system_prompt, request.messages, request.max_tokens, get_counter(adapter.name)
+                )
+        return self.tokens[model]
 
-            return {
-                "response": response,
-                "model_used": model,
-                "fallback_used": index != 0,
-            }
+    def _pick_within_quota(self) -> None:
+        # Prefer the first remaining model that has budget for this request
+        # now (or soon). If none has, the request fails fast rather than
+        # holding a worker until the soonest budget frees up.
+        remaining = range(self.next_index, len(self.chain))
+        waits = {index: quota.wait_time(self.chain[index], self.tokens_for(self.chain[index])) for index in remaining}
+        choice = next(
+            (index for index in remaining if waits[index] <= quota.QUOTA_MAX_WAIT_SECONDS),
+            min(remaining, key=lambda index: waits[index]),
+        )
+        if waits[choice] > quota.QUOTA_MAX_WAIT_SECONDS:
+            raise quota.QuotaExhausted(
+                f"All models for {self.agent_type} are out of quota; the soonest frees up in {waits[choice]:.0f}s.",
+                waits[choice],
+            )
+        if choice != self.next_index:
+            print(
+                f"[Kural IDE] {self.chain[self.next_index]} is out of quota for {waits[self.next_index]:.1f}s; "
+                f"routing {self.agent_type} to {self.chain[choice]}"
+            )
+            self.chain.insert(self.next_index, self.chain.pop(choice))
+
+    async def launch(self) -> Tuple[int, str]:
+        while True:
+            await state.offload(self._pick_within_quota)
+            index, model = self.next_index, self.chain[self.next_index]
+            self.next_index += 1
+            # Another request may have taken the breaker's half-open trial
+            # since the chain was ranked; move on unless nothing is left.
+            if await state.offload(health.try_acquire_trial, model) or not self.can_launch():
+                break
+            print(f"[Kural IDE] {model} is already running its circuit breaker trial; skipping")
+        self.fired.append(model)
+        self.reserved_at[index] = time.time()
+        self.delays[index] = await state.offload(quota.reserve, model, self.tokens_for(model))
+        # Time spent queueing for quota is not provider latency.
+        self.started[index] = time.monotonic() + self.delays[index]
+        print(f"[Kural IDE] Trying {model} for {self.agent_type}...")
+        return index, model
+
+    async def hedge_timeout(self, in_flight: List[int]) -> float | None:
+        if not self.hedge or not self.can_launch() or not in_flight:
+            return None
+        if len(in_flight) >= HEDGE_MAX_IN_FLIGHT:
+            return None
+        newest = max(in_flight)
+        delay = await state.offload(hedge_delay, self.chain[newest], self.kind)
+        return max(0.0, delay - (time.monotonic() - self.started[newest]))
+
+    async def failed(self, index: int, exc: Exception) -> bool:
+        model = self.chain[index]
+        error_str = str(exc)
+        reason = await state.offload(health.record_failure, model, exc)
+        await state.offload(quota.settle, model, self.tokens_for(model), None, self.reserved_at[index])
+        metrics.observe_provider_failure(model, self.agent_type, reason)
+        print(f"[Kural IDE] {model} failed ({reason}): {error_str}")
+        self.last_error = error_str
+        if reason in health.FALLBACK_REASONS:
+            return True
+        # Stop walking the chain; whatever is already in flight may still win.
+        self.next_index = len(self.chain)
+        return False
+
+    async def settle(self, index: int, usage: Dict) -> None:
+        model = self.chain[index]
+        reserved = self.tokens_for(model)
+        used = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+        await state.offload(quota.settle, model, reserved, used or reserved, self.reserved_at[index])
+
+    async def finished(self, index: int, in_flight: List[int]) -> Dict:
+        model = self.chain[index]
+        elapsed = time.monotonic() - self.started[index]
+        await state.offload(health.record_success, model, self.kind, elapsed)
+        metrics.observe_provider_success(model, self.agent_type, self.kind, elapsed)
+        cancelled = [self.chain[other] for other in in_flight if other != index]
+        metrics.observe_outcome(self.agent_type, self.preferred, model, cancelled)
+        for name in cancelled:
+            await state.offload(health.record_cancelled, name)
+        if cancelled:
+            print(f"[Kural IDE] {model} won the hedge; cancelled {', '.join(cancelled)}")
+        return {
+            "model_used": model,
+            "fallback_used": model != self.preferred,
+            "hedged_with": cancelled,
+        }
+
+    def exhausted(self) -> RuntimeError:
+        return RuntimeError(
+            f"All models exhausted for {self.agent_type}. Last error: {self.last_error}. "
+            "Please wait and try again."
+        )
+
+
+@contextmanager
+def _attempt_span(agent_type: str, model: str, kind: str, delay: float = 0.0) -> Iterator:
+    with tracing.span(
+        "router.attempt",
+        **{"kural.agent": agent_type, "kural.model": model, "kural.kind": kind},
+    ) as current:
+        try:
+            if delay:
+                current.set_attribute("kural.quota_wait_ms", round(delay * 1000))
+            yield current
+        except asyncio.CancelledError:
+            current.set_attribute("kural.outcome", "cancelled")
+            raise
         except Exception as exc:
-            error_str = str(exc)
-            print(f"[Kural IDE] {model} failed: {error_str}")
-            last_error = error_str
-            if should_fallback(error_str):
-                continue
+            reason = health.classify_error(exc)
+            current.set_attribute("kural.outcome", "failed")
+            current.set_attribute("kural.retry_reason", reason)
+            tracing.mark_error(current, exc, reason)
             raise
+        current.set_attribute("kural.outcome", "success")
+
+
+async def _respond(
+    agent_type: str,
+    role: engine.RoleConfig,
+    model: str,
+    history: List[Dict],
+    message: str,
+    delay: float = 0.0,
+) -> engine.ChatResponse:
+    with _attempt_span(agent_type, model, "complete", delay):
+        if delay:
+            await asyncio.sleep(delay)
+        return await engine.respond(role, model, history, message)
+
+
+async def call_with_fallback_async(
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None = None,
+    hedge: bool | None = None,
+    use_cache: bool = True,
+) -> Dict:
+    with tracing.span(
+        "router.call_with_fallback",
+        **{"kural.agent": agent_type, "kural.preferred_model": preferred_model},
+    ) as current:
+        result = await _call_with_fallback(
+            agent_type, history, message, preferred_model, hedge, use_cache
+        )
+        current.set_attributes(
+            {
+                "kural.model_used": result["model_used"],
+                "kural.fallback_used": result["fallback_used"],
+                "kural.cached": result["cached"],
+            }
+        )
+        return result
+
+
+async def _call_with_fallback(
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None = None,
+    hedge: bool | None = None,
+    use_cache: bool = True,
+) -> Dict:
+    role = _role(agent_type)
+    metrics.observe_context(agent_type, history)
+    key = _cache_key(role, agent_type, history, message, preferred_model, use_cache)
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        print(f"[Kural IDE] Cache hit for {agent_type} ({cached['model_used']})")
+        return {**cached, "hedged_with": [], "cached": True, "usage": {}}
+    attempts = _Attempts(agent_type, role, history, message, preferred_model, hedge, "complete")
+    await attempts.rank()
+    pending: Dict[asyncio.Task, int] = {}
+
+    async def launch() -> None:
+        index, model = await attempts.launch()
+        pending[
+            asyncio.create_task(_respond(agent_type, role, model, history, message, attempts.delays[index]))
+        ] = index
+
+    try:
+        await launch()
+        while pending:
+            timeout = await attempts.hedge_timeout(list(pending.values()))
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                try:
+                    await launch()
+                except quota.QuotaExhausted:
+                    # No budget for a hedge; keep waiting on what is in flight.
+                    attempts.hedge = False
+                continue
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    response = task.result()
+                except Exception as exc:
+                    if not await attempts.failed(index, exc) and not pending:
+                        raise
+                    continue
+                result = {
+                    "response": response.text,
+                    **await attempts.finished(index, list(pending.values())),
+                    "cached": False,
+                    "usage": dict(response.usage),
+                }
+                await attempts.settle(index, result["usage"])
+                metrics.observe_tokens(
+                    result["model_used"], agent_type, result["usage"], history, message, response.text
+                )
+                if key:
+                    response_cache.put(key, _cacheable(result))
+                return result
+            if not pending and attempts.can_launch():
+                await launch()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise attempts.exhausted()
+
+
+def _cacheable(result: Dict) -> Dict:
+    return {
+        "response": result["response"],
+        "model_used": result["model_used"],
+        "fallback_used": result["fallback_used"],
+    }
+
+
+def call_with_fallback(
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None = None,
+    hedge: bool | None = None,
+    use_cache: bool = True,
+) -> Dict:
+    return engine.run_sync(
+        call_with_fallback_async(agent_type, history, message, preferred_model, hedge, use_cache)
+    )
 
-    raise RuntimeError(
-        f"All models exhausted for {agent_type}. Last error: {last_error}. Please wait and try again."
+
+async def _pump_stream(
+    index: int,
+    agent_type: str,
+    role: engine.RoleConfig,
+    model: str,
+    history: List[Dict],
+    message: str,
+    events: asyncio.Queue,
+    delay: float = 0.0,
+) -> None:
+    try:
+        with _attempt_span(agent_type, model, "stream", delay) as current:
+            if delay:
+                await asyncio.sleep(delay)
+            first_token = True
+            async for chunk in engine.stream(role, model, history, message):
+                if isinstance(chunk, Usage):
+                    await events.put((index, "usage", chunk))
+                elif chunk:
+                    if first_token:
+                        current.add_event("first_token")
+                        first_token = False
+                    await events.put((index, "token", chunk))
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        await events.put((index, "error", exc))
+        return
+    await events.put((index, "end", None))
+
+
+async def stream_with_fallback_async(
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None = None,
+    hedge: bool | None = None,
+    use_cache: bool = True,
+) -> AsyncIterator[Dict]:
+    role = _role(agent_type)
+    metrics.observe_context(agent_type, history)
+    key = _cache_key(role, agent_type, history, message, preferred_model, use_cache)
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        print(f"[Kural IDE] Cache hit for {agent_type} ({cached['model_used']})")
+        if cached["response"]:
+            yield {"type": "token", "text": cached["response"], "model": cached["model_used"]}
+        yield {"type": "done", **cached, "hedged_with": [], "cached": True, "usage": {}}
+        return
+    attempts = _Attempts(agent_type, role, history, message, preferred_model, hedge, "first_token")
+    await attempts.rank()
+    events: asyncio.Queue = asyncio.Queue()
+    producers: Dict[int, asyncio.Task] = {}
+    winner: int | None = None
+    parts: List[str] = []
+    summary: Dict = {}
+    usage: Dict[int, Dict] = {}
+
+    async def launch() -> None:
+        index, model = await attempts.launch()
+        producers[index] = asyncio.create_task(
+            _pump_stream(index, agent_type, role, model, history, message, events, attempts.delays[index])
+        )
+
+    try:
+        await launch()
+        while True:
+            timeout = None if winner is not None else await attempts.hedge_timeout(list(producers))
+            try:
+                index, kind, payload = await asyncio.wait_for(events.get(), timeout)
+            except asyncio.TimeoutError:
+                try:
+                    await launch()
+                except quota.QuotaExhausted:
+                    attempts.hedge = False
+                continue
+            if winner is not None and index != winner:
+                continue
+            if kind == "usage":
+                usage[index] = dict(payload)
+                continue
+            if kind == "error":
+                producers.pop(index, None)
+                if winner is not None:
+                    await state.offload(health.record_failure, attempts.chain[index], payload)
+                    raise payload
+                if not await attempts.failed(index, payload) and not producers:
+                    raise payload
+                if not producers:
+                    if not attempts.can_launch():
+                        raise attempts.exhausted()
+                    await launch()
+                continue
+            if winner is None:
+                # The first token (or an empty answer) decides the race; once
+                # text reaches the client the model can no longer change.
+                winner = index
+                first_token_ms = round((time.monotonic() - attempts.started[index]) * 1000)
+                summary = await attempts.finished(index, list(producers))
+                for other, task in list(producers.items()):
+                    if other != index:
+                        task.cancel()
+                        producers.pop(other)
+            if kind == "token":
+                parts.append(payload)
+                yield {"type": "token", "text": payload, "model": attempts.chain[index]}
+                continue
+            result = {"response": "".join(parts), **summary, "cached": False}
+            await attempts.settle(index, usage.get(index, {}))
+            metrics.observe_provider_success(
+                attempts.chain[index],
+                agent_type,
+                "complete",
+                time.monotonic() - attempts.started[index],
+            )
+            metrics.observe_tokens(
+                attempts.chain[index], agent_type, usage.get(index, {}), history, message, result["response"]
+            )
+            if key:
+                response_cache.put(key, _cacheable(result))
+            yield {
+                "type": "done",
+                **result,
+                "usage": usage.get(index, {}),
+                "first_token_ms": first_token_ms,
+            }
+            return
+    finally:
+        for task in producers.values():
+            task.cancel()
+
+
+def stream_with_fallback(
+    agent_type: str,
+    history: List[Dict],
+    message: str,
+    preferred_model: str | None = None,
+    hedge: bool | None = None,
+    use_cache: bool = True,
+) -> Iterator[Dict]:
+    return engine.iterate_sync(
+        stream_with_fallback_async(agent_type, history, message, preferred_model, hedge, use_cache)
     )
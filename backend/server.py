@@ -1,25 +1,70 @@
+import hashlib
+import math
 import os
-from typing import Dict, List
-
-from flask import Flask, jsonify, request, send_from_directory, abort
+import re
+import threading
+import time
+from typing import Dict
+from uuid import uuid4
+
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    jsonify,
+    request,
+    send_file,
+    stream_with_context,
+)
 from flask_cors import CORS
 from dotenv import load_dotenv
 
-from router import call_with_fallback
-from utils.extract import extract_code_blocks
+from cache import response_cache
+from compaction import schedule_memory_update
+import compression
+import health
+import jobs
+import metrics
+import quota
+import state
+from static_assets import IMMUTABLE_CACHE, REVALIDATE_CACHE, StaticAssets
+import tracing
+from providers.engine import prewarm_sync
+from providers.registry import load_configured
+from router import call_with_fallback, stream_with_fallback
+from utils.extract import CodeBlockExtractor, extract_code_blocks
 from utils.history import (
+    HistoryConflict,
     add_message,
+    add_message_compressed,
+    apply_history_delta,
+    as_dicts,
     clear_history,
+    context_history,
     get_history,
+    get_history_page,
+    get_history_since,
+    history_version,
+    memory_state,
+    session_lock,
     set_history,
 )
+from utils.sse import format_sse
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 FRONTEND_DIR = os.path.join(ROOT_DIR, "frontend")
+static_assets = StaticAssets(FRONTEND_DIR)
 load_dotenv(os.path.join(ROOT_DIR, ".env"))
 
+SESSION_COOKIE = "kural_session"
+SESSION_HEADER = "X-Kural-Session"
+HISTORY_PAGE_MAX = 500
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
 app = Flask(__name__)
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=[SESSION_HEADER])
+tracing.instrument_flask(app)
 
 
 def _default_model() -> str:
@@ -39,58 +84,230 @@ def _default_builder_model() -> str:
     return "groq"
 
 
-ACTIVE_MODELS = {
-    "architect": _default_model(),
-    "builder": _default_builder_model(),
-}
+ACTIVE_MODELS = state.SharedMap(
+    "active_models",
+    {
+        "architect": _default_model(),
+        "builder": _default_builder_model(),
+    },
+)
+
+
+PREWARM_MODE = os.getenv("KURAL_PREWARM", "").lower()
+
+
+def _prewarm_providers() -> None:
+    # Providers otherwise load on first use; "imports" only loads the
+    # configured adapters, anything else also opens their connections.
+    if PREWARM_MODE == "imports":
+        print(f"[Kural IDE] Pre-loaded providers: {load_configured()}")
+        return
+    print(f"[Kural IDE] Pre-warmed provider connections: {prewarm_sync()}")
+
+
+if PREWARM_MODE in {"1", "true", "yes", "imports"}:
+    threading.Thread(target=_prewarm_providers, name="kural-prewarm", daemon=True).start()
+
+
+def _session_id() -> str:
+    if "session_id" in g:
+        return g.session_id
+    candidate = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE) or ""
+    if _SESSION_ID_RE.match(candidate):
+        g.session_id = candidate
+    else:
+        g.session_id = uuid4().hex
+        g.new_session = True
+    return g.session_id
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_http_request(
+            endpoint, request.method, response.status_code, time.perf_counter() - started
+        )
+    return response
+
+
+@app.after_request
+def _attach_session(response):
+    if "session_id" in g:
+        response.headers[SESSION_HEADER] = g.session_id
+        if g.get("new_session"):
+            response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite="Lax")
+    return response
+
+
+@app.after_request
+def _compress(response):
+    return compression.compress_response(response, request.headers.get("Accept-Encoding"))
 
 
-def _sync_history(payload_history: List[Dict[str, str]] | None) -> None:
+def _sync_history(session_id: str, payload: Dict) -> int | None:
+    payload_history = payload.get("history")
     if payload_history is not None:
-        set_history(payload_history)
+        set_history(payload_history, session_id)
+        return None
+    if payload.get("history_version") is None:
+        return None
+    try:
+        version = int(payload["history_version"])
+    except (TypeError, ValueError):
+        raise HistoryConflict(history_version(session_id))
+    return apply_history_delta(version, payload.get("history_delta") or [], session_id)
+
+
+def _use_cache(payload: Dict) -> bool:
+    if payload.get("cache") is False:
+        return False
+    return "no-cache" not in (request.headers.get("Cache-Control") or "").lower()
+
+
+def _include_history(payload: Dict) -> bool:
+    # Clients that keep their own copy can opt out of history in responses
+    # and get the new version only.
+    if payload.get("include_history") is False:
+        return False
+    return request.args.get("history") != "none"
+
+
+def _history_fields(session_id: str, known_version: int | None, include: bool = True) -> Dict:
+    if not include:
+        return {"history_version": history_version(session_id)}
+    if known_version is not None:
+        delta = get_history_since(known_version, session_id)
+        if delta is not None:
+            return {"history_delta": as_dicts(delta), "history_version": history_version(session_id)}
+    fields = {
+        "history": as_dicts(get_history(session_id)),
+        "history_version": history_version(session_id),
+    }
+    if known_version is not None:
+        fields["history_reset"] = True
+    return fields
 
 
 def _error(message: str, status: int = 400):
     return jsonify({"error": message}), status
 
 
+@app.errorhandler(HistoryConflict)
+def _history_conflict(exc: HistoryConflict):
+    return (
+        jsonify(
+            {
+                "error": str(exc),
+                "code": "history_conflict",
+                "history_version": exc.current_version,
+            }
+        ),
+        409,
+    )
+
+
+@app.errorhandler(quota.QuotaExhausted)
+def _quota_exhausted(exc: quota.QuotaExhausted):
+    response = jsonify({"error": str(exc), "code": "quota_exhausted", "retry_after": math.ceil(exc.retry_after)})
+    response.headers["Retry-After"] = str(math.ceil(exc.retry_after))
+    return response, 429
+
+
+def _stream_error(exc: Exception) -> str:
+    # The SSE response has already started, so a rate limit is reported in
+    # the event instead of the status line.
+    if isinstance(exc, quota.QuotaExhausted):
+        return format_sse(
+            "error", {"error": str(exc), "code": "quota_exhausted", "retry_after": math.ceil(exc.retry_after)}
+        )
+    return format_sse("error", {"error": str(exc)})
+
+
+@app.errorhandler(jobs.JobError)
+def _job_error(exc: jobs.JobError):
+    body = {"error": str(exc)}
+    if exc.code:
+        body["code"] = exc.code
+    return jsonify(body), exc.status_code
+
+
+def _event_stream(events):
+    return Response(
+        stream_with_context(tracing.wrap_stream(events)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _static_response(name: str):
+    found = static_assets.lookup(name)
+    if found is None:
+        abort(404)
+    asset, immutable = found
+    encoding = static_assets.encoding(asset, request.headers.get("Accept-Encoding"))
+    if asset.bodies:
+        response = Response(asset.bodies[encoding], mimetype=asset.mimetype)
+    else:
+        response = send_file(asset.files[encoding], mimetype=asset.mimetype, etag=False, conditional=False)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.set_etag(f"{asset.etag}-{encoding}" if encoding else asset.etag)
+    # Fingerprinted names change with the content, so browsers keep them for
+    # good; plain names (the page itself) are revalidated against the ETag.
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+    return response.make_conditional(request)
+
+
 @app.get("/")
 def index():
-    return send_from_directory(FRONTEND_DIR, "index.html")
+    return _static_response("index.html")
 
 
 @app.get("/<path:filename>")
 def frontend_assets(filename: str):
-    if filename.endswith(".env") or filename.endswith(".py"):
-        abort(404)
-    file_path = os.path.join(FRONTEND_DIR, filename)
-    if not os.path.isfile(file_path):
-        abort(404)
-    return send_from_directory(FRONTEND_DIR, filename)
+    return _static_response(filename)
 
 
 @app.post("/api/architect")
 def api_architect():
     payload = request.get_json(silent=True) or {}
-    _sync_history(payload.get("history"))
+    session_id = _session_id()
     message = payload.get("message", "")
     if not message:
         return _error("message is required")
+    with session_lock(session_id):
+        known_version = _sync_history(session_id, payload)
+        history = context_history(session_id)
     result = call_with_fallback(
         "architect",
-        get_history(),
+        history,
         message,
         preferred_model=ACTIVE_MODELS["architect"],
+        use_cache=_use_cache(payload),
     )
     response_text = result["response"]
-    add_message("user", message, "project_idea")
-    add_message("architect", response_text, "plan")
+    with session_lock(session_id):
+        add_message("user", message, "project_idea", session_id)
+        add_message("architect", response_text, "plan", session_id)
+        schedule_memory_update(session_id)
+        history_fields = _history_fields(session_id, known_version, _include_history(payload))
     return jsonify(
         {
             "response": response_text,
             "model_used": result["model_used"],
             "fallback_used": result["fallback_used"],
-            "history": get_history(),
+            "hedged_with": result["hedged_with"],
+            "cached": result["cached"],
+            "usage": result["usage"],
+            **history_fields,
         }
     )
 
@@ -98,30 +315,146 @@ def api_architect():
 @app.post("/api/builder")
 def api_builder():
     payload = request.get_json(silent=True) or {}
-    _sync_history(payload.get("history"))
+    session_id = _session_id()
     message = payload.get("message", "")
     if not message:
         return _error("message is required")
+    with session_lock(session_id):
+        known_version = _sync_history(session_id, payload)
+        history = context_history(session_id)
     result = call_with_fallback(
         "builder",
-        get_history(),
+        history,
         message,
         preferred_model=ACTIVE_MODELS["builder"],
+        use_cache=_use_cache(payload),
     )
     response_text = result["response"]
-    add_message("user", message, "task")
-    add_message("builder", response_text, "code")
+    with session_lock(session_id):
+        add_message("user", message, "task", session_id)
+        add_message_compressed("builder", response_text, "code", session_id)
+        schedule_memory_update(session_id)
+        history_fields = _history_fields(session_id, known_version, _include_history(payload))
     return jsonify(
         {
             "response": response_text,
             "model_used": result["model_used"],
             "fallback_used": result["fallback_used"],
+            "hedged_with": result["hedged_with"],
+            "cached": result["cached"],
+            "usage": result["usage"],
             "codeBlocks": extract_code_blocks(response_text),
-            "history": get_history(),
+            **history_fields,
         }
     )
 
 
+@app.post("/api/architect/stream")
+def api_architect_stream():
+    payload = request.get_json(silent=True) or {}
+    session_id = _session_id()
+    message = payload.get("message", "")
+    if not message:
+        return _error("message is required")
+    with session_lock(session_id):
+        known_version = _sync_history(session_id, payload)
+        history = context_history(session_id)
+    use_cache = _use_cache(payload)
+
+    def events():
+        try:
+            for event in stream_with_fallback(
+                "architect",
+                history,
+                message,
+                preferred_model=ACTIVE_MODELS["architect"],
+                use_cache=use_cache,
+            ):
+                if event["type"] == "token":
+                    yield format_sse("token", {"text": event["text"], "model": event["model"]})
+                    continue
+                response_text = event["response"]
+                with session_lock(session_id):
+                    add_message("user", message, "project_idea", session_id)
+                    add_message("architect", response_text, "plan", session_id)
+                    schedule_memory_update(session_id)
+                    history_fields = _history_fields(session_id, known_version, _include_history(payload))
+                yield format_sse(
+                    "done",
+                    {
+                        "response": response_text,
+                        "model_used": event["model_used"],
+                        "fallback_used": event["fallback_used"],
+                        "hedged_with": event["hedged_with"],
+                        "cached": event["cached"],
+                        "usage": event["usage"],
+                        "first_token_ms": event.get("first_token_ms"),
+                        **history_fields,
+                    },
+                )
+        except Exception as exc:
+            yield _stream_error(exc)
+
+    return _event_stream(events())
+
+
+@app.post("/api/builder/stream")
+def api_builder_stream():
+    payload = request.get_json(silent=True) or {}
+    session_id = _session_id()
+    message = payload.get("message", "")
+    if not message:
+        return _error("message is required")
+    with session_lock(session_id):
+        known_version = _sync_history(session_id, payload)
+        history = context_history(session_id)
+    use_cache = _use_cache(payload)
+
+    def events():
+        # Blocks are sent as soon as their fence closes, so the editor and
+        # preview update while the rest of the answer is still streaming.
+        extractor = CodeBlockExtractor()
+        try:
+            for event in stream_with_fallback(
+                "builder",
+                history,
+                message,
+                preferred_model=ACTIVE_MODELS["builder"],
+                use_cache=use_cache,
+            ):
+                if event["type"] == "token":
+                    yield format_sse("token", {"text": event["text"], "model": event["model"]})
+                    for block in extractor.feed(event["text"]):
+                        yield format_sse("block", block)
+                    continue
+                for block in extractor.close():
+                    yield format_sse("block", block)
+                response_text = event["response"]
+                with session_lock(session_id):
+                    add_message("user", message, "task", session_id)
+                    add_message_compressed("builder", response_text, "code", session_id)
+                    schedule_memory_update(session_id)
+                    history_fields = _history_fields(session_id, known_version, _include_history(payload))
+                yield format_sse(
+                    "done",
+                    {
+                        "response": response_text,
+                        "model_used": event["model_used"],
+                        "fallback_used": event["fallback_used"],
+                        "hedged_with": event["hedged_with"],
+                        "cached": event["cached"],
+                        "usage": event["usage"],
+                        "first_token_ms": event.get("first_token_ms"),
+                        "codeBlocks": extractor.blocks,
+                        **history_fields,
+                    },
+                )
+        except Exception as exc:
+            yield _stream_error(exc)
+
+    return _event_stream(events())
+
+
 @app.post("/api/switch-model")
 def api_switch_model():
     payload = request.get_json(silent=True) or {}
@@ -137,19 +470,130 @@ def api_switch_model():
 
 @app.post("/api/clear")
 def api_clear():
-    clear_history()
-    return jsonify({"status": "cleared"})
+    session_id = _session_id()
+    clear_history(session_id)
+    return jsonify({"status": "cleared", "history_version": history_version(session_id)})
 
 
 @app.get("/api/history")
 def api_history():
-    return jsonify({"history": get_history()})
+    session_id = _session_id()
+    since = request.args.get("since", type=int)
+    limit = request.args.get("limit", type=int)
+    before = request.args.get("before", type=int)
+    with session_lock(session_id):
+        version = history_version(session_id)
+        # The version changes with every append and reset, so it names the
+        # response exactly; the session and query tell responses apart.
+        tag = hashlib.sha1(f"{session_id}:{version}:{request.query_string.decode()}".encode()).hexdigest()[:16]
+        if request.if_none_match.contains_weak(tag):
+            response = Response(status=304)
+        elif limit is not None:
+            page = get_history_page(before, max(1, min(limit, HISTORY_PAGE_MAX)), session_id)
+            if page is None:
+                raise HistoryConflict(version)
+            messages, cursor, has_more = page
+            response = jsonify(
+                {
+                    "history": as_dicts(messages),
+                    "history_version": version,
+                    "cursor": cursor,
+                    "has_more": has_more,
+                }
+            )
+        else:
+            response = jsonify(_history_fields(session_id, since))
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@app.get("/api/memory")
+def api_memory():
+    return jsonify(memory_state(_session_id()))
+
+
+@app.get("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(response_cache.stats())
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@app.get("/api/providers/health")
+def api_provider_health():
+    return jsonify({"providers": health.snapshot()})
+
+
+@app.get("/api/providers/quota")
+def api_provider_quota():
+    return jsonify({"providers": quota.snapshot()})
+
+
+@app.post("/api/jobs")
+def api_submit_job():
+    payload = request.get_json(silent=True) or {}
+    session_id = _session_id()
+    plan = (payload.get("plan") or "").strip()
+    if not plan:
+        return _error("plan is required")
+    with session_lock(session_id):
+        _sync_history(session_id, payload)
+    job = jobs.submit(session_id, plan, bool(payload.get("auto")), ACTIVE_MODELS)
+    return jsonify({"job": job}), 202
+
+
+@app.get("/api/jobs")
+def api_list_jobs():
+    return jsonify({"jobs": jobs.session_jobs(_session_id())})
+
+
+@app.get("/api/jobs/<job_id>")
+def api_get_job(job_id: str):
+    return jsonify({"job": jobs.get_job(job_id, _session_id())})
+
+
+@app.get("/api/jobs/<job_id>/events")
+def api_job_events(job_id: str):
+    session_id = _session_id()
+    after = request.args.get("after", type=int)
+    if after is None:
+        after = int(request.headers.get("Last-Event-ID") or 0)
+    jobs.get_job(job_id, session_id)
+
+    def events():
+        for event in jobs.iter_events(job_id, after):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield format_sse(event["event"], event["data"], event["seq"])
+
+    return _event_stream(events())
+
+
+@app.post("/api/jobs/<job_id>/pause")
+def api_pause_job(job_id: str):
+    return jsonify({"job": jobs.pause(job_id, _session_id())})
+
+
+@app.post("/api/jobs/<job_id>/resume")
+def api_resume_job(job_id: str):
+    return jsonify({"job": jobs.resume(job_id, _session_id(), ACTIVE_MODELS)})
+
+
+@app.post("/api/jobs/<job_id>/cancel")
+def api_cancel_job(job_id: str):
+    return jsonify({"job": jobs.cancel(job_id, _session_id())})
 
 
 @app.post("/api/user-intervention")
 def api_user_intervention():
     payload = request.get_json(silent=True) or {}
-    _sync_history(payload.get("history"))
+    session_id = _session_id()
     target = (payload.get("panel") or "").lower()
     message = payload.get("message", "")
     if target not in ACTIVE_MODELS:
@@ -157,31 +601,45 @@ def api_user_intervention():
     if not message:
         return _error("message is required")
     correction = f"USER CORRECTION ({target.upper()}): {message}"
-    add_message("user", correction, "correction")
+    with session_lock(session_id):
+        known_version = _sync_history(session_id, payload)
+        add_message("user", correction, "correction", session_id)
+        history = context_history(session_id)
     try:
         result = call_with_fallback(
             target,
-            get_history(),
+            history,
             correction,
             preferred_model=ACTIVE_MODELS[target],
+            use_cache=_use_cache(payload),
         )
+    except quota.QuotaExhausted:
+        raise
     except Exception as exc:
         return _error(str(exc), 502)
     response_text = result["response"]
-    if target == "architect":
-        add_message("architect", response_text, "correction")
-    else:
-        add_message("builder", response_text, "correction")
+    with session_lock(session_id):
+        if target == "architect":
+            add_message("architect", response_text, "correction", session_id)
+        else:
+            add_message("builder", response_text, "correction", session_id)
+        schedule_memory_update(session_id)
+        history_fields = _history_fields(session_id, known_version, _include_history(payload))
     return jsonify(
         {
             "response": response_text,
             "model_used": result["model_used"],
             "fallback_used": result["fallback_used"],
-            "history": get_history(),
+            "hedged_with": result["hedged_with"],
+            "cached": result["cached"],
+            "usage": result["usage"],
+            **history_fields,
         }
     )
 
 
 if __name__ == "__main__":
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py).
     port = int(os.getenv("FLASK_PORT", "5000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    debug = os.getenv("FLASK_DEBUG", "1").lower() in {"1", "true", "yes"}
+    app.run(host="0.0.0.0", port=port, debug=debug, threaded=True)
@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import state
+
+# Durability for session histories: each session is an append-only log under
+# KURAL_SESSION_LOG_DIR, so a restart picks up where it left off. With the
+# memory backend it is the only copy on disk; with a shared backend every
+# worker writes through to it too, and a session the shared store no longer
+# has (pruned, or a new database) is restored from it. It defaults to
+# backend/kural-sessions wherever the server is started from; an empty
+# KURAL_SESSION_LOG_DIR turns it off.
+SESSION_LOG_DIR = os.getenv(
+    "KURAL_SESSION_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "kural-sessions")
+).strip()
+SEGMENT_BYTES = int(os.getenv("KURAL_SESSION_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+# More short segments than this (they pile up across restarts) are merged.
+MAX_SEGMENTS = int(os.getenv("KURAL_SESSION_MAX_SEGMENTS", "8"))
+RETENTION_SECONDS = float(os.getenv("KURAL_SESSION_LOG_RETENTION", str(7 * 24 * 60 * 60)))
+FSYNC = os.getenv("KURAL_SESSION_LOG_FSYNC", "").lower() in {"1", "true", "yes"}
+
+# One fixed-size index entry per message: segment number and byte offset, so
+# message i is found with one seek whatever the length of the session.
+_INDEX_ENTRY = struct.Struct("<IQ")
+_SAFE_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class _OpenSession:
+    # Files of the current generation of one session. A generation holds the
+    # messages since the last reset; a reset starts a new one.
+    __slots__ = (
+        "meta", "generation", "count", "segment", "segment_size", "segment_file", "index_file", "index_stamp",
+    )
+
+    def __init__(self, meta: Dict[str, object], generation: int, count: int, segment: int) -> None:
+        self.meta = meta
+        self.generation = generation
+        self.count = count
+        self.segment = segment
+        self.segment_size = 0
+        self.segment_file = None
+        self.index_file = None
+        # Size and mtime of the index after this process last wrote it.
+        self.index_stamp: Optional[Tuple[int, int]] = None
+
+    def close(self) -> None:
+        for handle in (self.segment_file, self.index_file):
+            if handle is not None:
+                handle.close()
+        self.segment_file = self.index_file = None
+
+
+class SessionLog:
+    def __init__(self, root: str, shared: bool = False) -> None:
+        # Shared: other processes write the same sessions (each under the
+        # session's SharedLock), so cached positions are checked against the
+        # files before they are used.
+        self.root = root
+        self.shared = shared
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._open: Dict[str, _OpenSession] = {}
+
+    def _dir(self, session_id: str) -> str:
+        name = session_id if _SAFE_NAME_RE.match(session_id) else hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, name)
+
+    def _segment_path(self, session_id: str, generation: int, segment: int) -> str:
+        return os.path.join(self._dir(session_id), f"{generation:06d}-{segment:06d}.jsonl")
+
+    def _index_path(self, session_id: str, generation: int) -> str:
+        return os.path.join(self._dir(session_id), f"{generation:06d}.idx")
+
+    def _segments(self, session_id: str, generation: int) -> List[int]:
+        prefix = f"{generation:06d}-"
+        try:
+            names = os.listdir(self._dir(session_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[7:13]) for name in names if name.startswith(prefix) and name.endswith(".jsonl"))
+
+    def _write_meta(self, session_id: str, meta: Dict[str, object]) -> None:
+        path = os.path.join(self._dir(session_id), "meta.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as handle:
+            json.dump(meta, handle, ensure_ascii=False)
+            if FSYNC:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def _read_meta(self, session_id: str) -> Optional[Dict[str, object]]:
+        try:
+            with open(os.path.join(self._dir(session_id), "meta.json"), encoding="utf-8") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _valid_count(self, session_id: str, generation: int) -> int:
+        # Drops index entries whose line never made it to disk in full (a
+        # crash mid-append), so a reload never sees a torn message.
+        path = self._index_path(session_id, generation)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        count = size // _INDEX_ENTRY.size
+        segment_sizes: Dict[int, int] = {}
+        with open(path, "rb") as handle:
+            while count:
+                handle.seek((count - 1) * _INDEX_ENTRY.size)
+                segment, offset = _INDEX_ENTRY.unpack(handle.read(_INDEX_ENTRY.size))
+                if segment not in segment_sizes:
+                    try:
+                        segment_sizes[segment] = os.path.getsize(self._segment_path(session_id, generation, segment))
+                    except FileNotFoundError:
+                        segment_sizes[segment] = 0
+                if offset < segment_sizes[segment] and self._line_complete(session_id, generation, segment, offset):
+                    break
+                count -= 1
+        if count * _INDEX_ENTRY.size != size:
+            with open(path, "r+b") as handle:
+                handle.truncate(count * _INDEX_ENTRY.size)
+        return count
+
+    def _line_complete(self, session_id: str, generation: int, segment: int, offset: int) -> bool:
+        with open(self._segment_path(session_id, generation, segment), "rb") as handle:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data.find(b"\n", offset) != -1
+
+    def _index_stamp(self, session_id: str, generation: int) -> Optional[Tuple[int, int]]:
+        try:
+            info = os.stat(self._index_path(session_id, generation))
+        except FileNotFoundError:
+            return None
+        return info.st_size, info.st_mtime_ns
+
+    def _next_segment(self, session_id: str, current: _OpenSession) -> None:
+        # Continues in a segment no other process has written to.
+        if current.segment_file is not None:
+            current.segment_file.close()
+            current.segment_file = None
+        current.segment = max(self._segments(session_id, current.generation) + [current.segment]) + 1
+
+    def _sync(self, session_id: str, current: _OpenSession) -> Optional[_OpenSession]:
+        meta = self._read_meta(session_id)
+        if meta is None or int(meta.pop("generation", 0)) != current.generation:
+            # Reset, compacted or pruned by another process: start over.
+            current.close()
+            del self._open[session_id]
+            return self._session(session_id)
+        current.meta = meta
+        if self._index_stamp(session_id, current.generation) != current.index_stamp:
+            current.count = self._valid_count(session_id, current.generation)
+            self._next_segment(session_id, current)
+            current.index_stamp = self._index_stamp(session_id, current.generation)
+        return current
+
+    def _session(self, session_id: str) -> Optional[_OpenSession]:
+        current = self._open.get(session_id)
+        if current is not None:
+            return self._sync(session_id, current) if self.shared else current
+        meta = self._read_meta(session_id)
+        if meta is None:
+            return None
+        generation = int(meta.pop("generation", 0))
+        segments = self._segments(session_id, generation)
+        # Appends from this process go to a fresh segment, never after a
+        # line a previous process may have left half-written.
+        current = _OpenSession(meta, generation, self._valid_count(session_id, generation), (segments[-1] + 1) if segments else 0)
+        current.index_stamp = self._index_stamp(session_id, generation)
+        self._open[session_id] = current
+        if self._needs_compaction(session_id, current):
+            current = self._compact(session_id, current)
+        return current
+
+    def _index_entries(self, session_id: str, generation: int, start: int, end: int) -> List[Tuple[int, int]]:
+        if end <= start:
+            return []
+        with open(self._index_path(session_id, generation), "rb") as handle:
+            handle.seek(start * _INDEX_ENTRY.size)
+            raw = handle.read((end - start) * _INDEX_ENTRY.size)
+        return list(_INDEX_ENTRY.iter_unpack(raw))
+
+    def _read(self, session_id: str, current: _OpenSession, start: int, end: int) -> List[Dict[str, str]]:
+        # Long sessions are read through memory maps: only the pages holding
+        # the requested messages are touched.
+        if current.segment_file is not None:
+            current.segment_file.flush()
+        messages: List[Dict[str, str]] = []
+        maps: Dict[int, mmap.mmap] = {}
+        try:
+            for segment, offset in self._index_entries(session_id, current.generation, start, end):
+                data = maps.get(segment)
+                if data is None:
+                    with open(self._segment_path(session_id, current.generation, segment), "rb") as handle:
+                        data = maps[segment] = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                messages.append(json.loads(data[offset:data.find(b"\n", offset)]))
+        finally:
+            for data in maps.values():
+                data.close()
+        return messages
+
+    def _append(self, session_id: str, current: _OpenSession, messages: List[Dict[str, str]]) -> None:
+        if current.segment_file is None or current.segment_size >= SEGMENT_BYTES:
+            if current.segment_file is not None:
+                current.segment_file.close()
+                current.segment += 1
+            path = self._segment_path(session_id, current.generation, current.segment)
+            current.segment_file = open(path, "ab")
+            current.segment_size = current.segment_file.tell()
+        if current.index_file is None:
+            current.index_file = open(self._index_path(session_id, current.generation), "ab")
+        lines = []
+        entries = []
+        offset = current.segment_size
+        for message in messages:
+            line = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            entries.append(_INDEX_ENTRY.pack(current.segment, offset))
+            lines.append(line)
+            offset += len(line)
+        # Lines first, then their index entries: an entry never points past
+        # what was written.
+        current.segment_file.write(b"".join(lines))
+        current.segment_file.flush()
+        current.index_file.write(b"".join(entries))
+        current.index_file.flush()
+        if FSYNC:
+            os.fsync(current.segment_file.fileno())
+            os.fsync(current.index_file.fileno())
+        current.segment_size = offset
+        current.count += len(messages)
+        current.index_stamp = self._index_stamp(session_id, current.generation)
+
+    def _new_generation(
+        self,
+        session_id: str,
+        meta: Dict[str, object],
+        messages: List[Dict[str, str]],
+        previous: Optional[_OpenSession],
+    ) -> _OpenSession:
+        os.makedirs(self._dir(session_id), exist_ok=True)
+        old_generation = previous.generation if previous is not None else None
+        if previous is not None:
+            previous.close()
+        generation = (old_generation + 1) if old_generation is not None else 0
+        current = _OpenSession(dict(meta), generation, 0, 0)
+        for stale in self._segments(session_id, generation):
+            os.remove(self._segment_path(session_id, generation, stale))
+        open(self._index_path(session_id, generation), "wb").close()
+        current.index_stamp = self._index_stamp(session_id, generation)
+        self._open[session_id] = current
+        if messages:
+            self._append(session_id, current, messages)
+        self._write_meta(session_id, {**current.meta, "generation": generation})
+        if old_generation is not None:
+            self._remove_generation(session_id, old_generation)
+        return current
+
+    def _remove_generation(self, session_id: str, generation: int) -> None:
+        for segment in self._segments(session_id, generation):
+            os.remove(self._segment_path(session_id, generation, segment))
+        try:
+            os.remove(self._index_path(session_id, generation))
+        except FileNotFoundError:
+            pass
+
+    def write_session(
+        self,
+        session_id: str,
+        meta: Dict[str, object],
+        messages: List[Dict[str, str]],
+        start: Optional[int],
+    ) -> None:
+        # Same contract as the sqlite backend: start=None updates the metadata
+        # only, start=0 replaces the history, otherwise messages go at `start`.
+        meta = {key: value for key, value in meta.items() if key != "count"}
+        with self._lock:
+            current = self._session(session_id)
+            if current is None or start == 0:
+                current = self._new_generation(session_id, meta, messages if start is not None else [], current)
+                return
+            if start is not None and messages:
+                if start < current.count:
+                    # Overwriting the tail: forget the entries, the bytes are
+                    # dropped by the next compaction.
+                    current.close()
+                    with open(self._index_path(session_id, current.generation), "r+b") as handle:
+                        handle.truncate(start * _INDEX_ENTRY.size)
+                    current.count = start
+                    self._next_segment(session_id, current)
+                self._append(session_id, current, messages)
+                if self._needs_compaction(session_id, current):
+                    current = self._compact(session_id, current)
+            if meta != current.meta:
+                current.meta = meta
+                self._write_meta(session_id, {**meta, "generation": current.generation})
+
+    def meta(self, session_id: str) -> Optional[Dict[str, object]]:
+        with self._lock:
+            current = self._session(session_id)
+            if current is None:
+                return None
+            return {**current.meta, "count": current.count}
+
+    def read_messages(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict[str, str]]:
+        with self._lock:
+            current = self._session(session_id)
+            if current is None:
+                return []
+            end = current.count if end is None else min(end, current.count)
+            return self._read(session_id, current, max(0, start), end)
+
+    def _needs_compaction(self, session_id: str, current: _OpenSession) -> bool:
+        # Every restart and every rewritten tail leaves a short segment
+        # behind; full segments are already as compact as they get.
+        short = 0
+        for segment in self._segments(session_id, current.generation):
+            if segment == current.segment:
+                continue
+            if os.path.getsize(self._segment_path(session_id, current.generation, segment)) < SEGMENT_BYTES // 2:
+                short += 1
+        return short > MAX_SEGMENTS
+
+    def _compact(self, session_id: str, current: _OpenSession) -> _OpenSession:
+        # Rewrites the live messages into a new generation of full segments
+        # and drops the old files, including bytes orphaned by torn writes
+        # and rewritten tails.
+        messages = self._read(session_id, current, 0, current.count)
+        return self._new_generation(session_id, current.meta, messages, current)
+
+    def forget(self, session_id: str) -> None:
+        # Closes the session's files; the log itself stays on disk.
+        with self._lock:
+            current = self._open.pop(session_id, None)
+            if current is not None:
+                current.close()
+
+    def prune_sessions(self, idle_seconds: float = RETENTION_SECONDS, keep: Iterable[str] = ()) -> int:
+        cutoff = time.time() - idle_seconds
+        kept = {os.path.basename(self._dir(session_id)) for session_id in keep}
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name in kept or not os.path.isdir(path):
+                    continue
+                newest = max((entry.stat().st_mtime for entry in os.scandir(path)), default=0.0)
+                if newest >= cutoff:
+                    continue
+                for session_id, current in list(self._open.items()):
+                    if os.path.basename(self._dir(session_id)) == name:
+                        current.close()
+                        del self._open[session_id]
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+log: Optional[SessionLog] = SessionLog(SESSION_LOG_DIR, state.backend.shared) if SESSION_LOG_DIR else None
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process backend is available
+    fcntl = None
+
+# "memory" keeps state in this process (single worker). "sqlite" shares the
+# active models, session histories and provider health between every worker
+# process on the host through KURAL_STATE_DB.
+STATE_BACKEND = os.getenv("KURAL_STATE_BACKEND", "memory").strip().lower()
+# Relative to the backend directory by default, not to wherever the server
+# was started from.
+STATE_DB_PATH = os.getenv("KURAL_STATE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "kural-state.db"))
+STATE_BUSY_TIMEOUT_MS = int(os.getenv("KURAL_STATE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _lock_file(path: str):
+    # Lock files of pruned sessions are deleted while locked; a waiter that
+    # opened the old file then holds a lock nobody else sees, so it retries
+    # until the file it locked is the one at `path`.
+    while True:
+        handle = open(path, "a+b")
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino:
+                return handle
+        except FileNotFoundError:
+            pass
+        handle.close()
+
+
+def _remove_lock_file(path: str) -> None:
+    # Only an unheld lock file is removed, and only while holding it.
+    try:
+        handle = open(path, "r+b")
+    except OSError:
+        return
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    handle.close()
+
+
+class SharedLock:
+    # Reentrant within a thread like an RLock; with a path, the outermost
+    # acquisition also takes an exclusive flock so other processes wait too.
+    def __init__(self, path: Optional[str] = None, on_acquire: Optional[Callable[[], None]] = None) -> None:
+        self._lock = threading.RLock()
+        self._path = path
+        self._on_acquire = on_acquire
+        self._handle = None
+        self._depth = 0
+
+    def acquire(self) -> bool:
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                if self._path is not None:
+                    self._handle = _lock_file(self._path)
+                if self._on_acquire is not None:
+                    self._on_acquire()
+            except BaseException:
+                self.release()
+                raise
+        return True
+
+    def release(self) -> None:
+        if self._depth == 1 and self._handle is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+        self._depth -= 1
+        self._lock.release()
+
+    def __enter__(self) -> "SharedLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class MemoryBackend:
+    # Values must be JSON-like; they are kept as given, without copying.
+    shared = False
+
+    def __init__(self) -> None:
+        self._data: Dict[str, Dict[str, object]] = {}
+        self._lock = threading.Lock()
+
+    def lock_path(self, name: str) -> Optional[str]:
+        return None
+
+    def get(self, namespace: str, key: str, default=None):
+        with self._lock:
+            return self._data.get(namespace, {}).get(key, default)
+
+    def set(self, namespace: str, key: str, value) -> None:
+        with self._lock:
+            self._data.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+    def items(self, namespace: str) -> Dict[str, object]:
+        with self._lock:
+            return dict(self._data.get(namespace, {}))
+
+
+class SqliteBackend:
+    # Key-value rows plus one row per session message, so appending a turn
+    # writes only that turn and a worker catching up reads only what it missed.
+    shared = True
+
+    def __init__(self, path: str = STATE_DB_PATH) -> None:
+        if fcntl is None:
+            raise RuntimeError("The sqlite state backend needs POSIX file locks (fcntl).")
+        self.path = path
+        self.lock_dir = f"{path}.locks"
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._db_pid: int | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so each process opens its own.
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=STATE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                "session_id TEXT NOT NULL, position INTEGER NOT NULL, message TEXT NOT NULL, "
+                "PRIMARY KEY (session_id, position))"
+            )
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def lock_path(self, name: str) -> str:
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.lock_dir, f"{digest}.lock")
+
+    def get(self, namespace: str, key: str, default=None):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value) -> None:
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, encoded, time.time()),
+                )
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str) -> Dict[str, object]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT key, value FROM state WHERE namespace = ?",
+                (namespace,),
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def read_messages(self, session_id: str, start: int = 0, end: Optional[int] = None) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT message FROM session_messages WHERE session_id = ? AND position >= ? AND position < ? "
+                "ORDER BY position",
+                (session_id, start, end if end is not None else 2**62),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def write_session(
+        self,
+        session_id: str,
+        meta: Dict[str, object],
+        messages: List[Dict[str, str]],
+        start: Optional[int],
+    ) -> None:
+        # start=None updates the metadata only; start=0 replaces the history.
+        with self._lock:
+            db = self._connection()
+            with db:
+                if start == 0:
+                    db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                if start is not None and messages:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO session_messages (session_id, position, message) VALUES (?, ?, ?)",
+                        [
+                            (session_id, start + offset, json.dumps(message, ensure_ascii=False))
+                            for offset, message in enumerate(messages)
+                        ],
+                    )
+                db.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value, updated_at) VALUES ('sessions', ?, ?, ?)",
+                    (session_id, json.dumps(meta, ensure_ascii=False), time.time()),
+                )
+
+    def prune_sessions(self, idle_seconds: float, keep: Iterable[str] = ()) -> int:
+        cutoff = time.time() - idle_seconds
+        kept = set(keep)
+        with self._lock:
+            db = self._connection()
+            with db:
+                stale = [
+                    row[0]
+                    for row in db.execute(
+                        "SELECT key FROM state WHERE namespace = 'sessions' AND updated_at < ?",
+                        (cutoff,),
+                    ).fetchall()
+                    if row[0] not in kept
+                ]
+                for session_id in stale:
+                    db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                    db.execute("DELETE FROM state WHERE namespace = 'sessions' AND key = ?", (session_id,))
+        for session_id in stale:
+            _remove_lock_file(self.lock_path(f"session-{session_id}"))
+        return len(stale)
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "sqlite": SqliteBackend,
+}
+
+
+def _create_backend():
+    factory = BACKENDS.get(STATE_BACKEND)
+    if factory is None:
+        raise RuntimeError(
+            f"Unknown KURAL_STATE_BACKEND '{STATE_BACKEND}' (expected one of: {', '.join(BACKENDS)})."
+        )
+    return factory()
+
+
+backend = _create_backend()
+
+
+async def offload(func: Callable, *args):
+    # Shared state means flock waits and SQLite I/O; async callers run it in
+    # a worker thread so the event loop keeps serving every other request.
+    # In-process state only takes a short threading lock, so it runs inline.
+    if not backend.shared:
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+class SharedMap:
+    # A fixed set of keys with per-process defaults, stored in the backend so
+    # a change made through any worker is seen by all of them.
+    def __init__(self, namespace: str, defaults: Dict[str, object]) -> None:
+        self.namespace = namespace
+        self._defaults = dict(defaults)
+
+    def __getitem__(self, key: str):
+        if key not in self._defaults:
+            raise KeyError(key)
+        return backend.get(self.namespace, key, self._defaults[key])
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self._defaults:
+            raise KeyError(key)
+        backend.set(self.namespace, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._defaults
+
+    def __iter__(self):
+        return iter(self._defaults)
+
+    def __len__(self) -> int:
+        return len(self._defaults)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import compression
+
+# Assets up to this size are held in memory with their compressed variants;
+# larger ones are streamed from disk (with a prebuilt .gz/.br next to them
+# when one exists).
+STATIC_MEMORY_MAX_BYTES = int(os.getenv("KURAL_STATIC_MEMORY_MAX", str(512 * 1024)))
+# Rescan the frontend when its files change, for editing without restarts.
+STATIC_RELOAD = os.getenv("KURAL_STATIC_RELOAD", "").lower() in {"1", "true", "yes"}
+RELOAD_CHECK_SECONDS = 1.0
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+_HIDDEN_SUFFIXES = (".env", ".py", ".gz", ".br")
+_REFERENCE_RE = re.compile(r"""(\b(?:src|href)=["'])([^"':?#]+)(["'])""")
+_ENCODED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+@dataclass
+class Asset:
+    mimetype: str
+    etag: str
+    # Bodies by Content-Encoding ("" for the file itself) for assets held in
+    # memory, or the files holding them for assets served from disk.
+    bodies: Dict[str, bytes] = field(default_factory=dict)
+    files: Dict[str, str] = field(default_factory=dict)
+
+
+class StaticAssets:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+        self._assets: Dict[str, Asset] = {}
+        # Fingerprinted name -> plain name, e.g. app.1c9e2f0a7b3d.js -> app.js.
+        self._fingerprinted: Dict[str, str] = {}
+        self._checked = 0.0
+        self._signature: Dict[str, float] = {}
+        self.build()
+
+    def _scan(self) -> Dict[str, float]:
+        found: Dict[str, float] = {}
+        for folder, folders, names in os.walk(self.root):
+            folders[:] = [name for name in folders if not name.startswith(".")]
+            for name in names:
+                if name.startswith(".") or name.endswith(_HIDDEN_SUFFIXES):
+                    continue
+                path = os.path.join(folder, name)
+                found[os.path.relpath(path, self.root).replace(os.sep, "/")] = os.path.getmtime(path)
+        return found
+
+    def _load(self, name: str, path: str, data: bytes) -> Asset:
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        asset = Asset(mimetype=mimetype, etag=hashlib.sha256(data).hexdigest()[:12])
+        if len(data) > STATIC_MEMORY_MAX_BYTES:
+            asset.files[""] = path
+            for encoding, suffix in _ENCODED_SUFFIXES.items():
+                if os.path.isfile(path + suffix):
+                    asset.files[encoding] = path + suffix
+        else:
+            asset.bodies[""] = data
+            if mimetype in compression.COMPRESSIBLE_TYPES and len(data) >= compression.COMPRESSION_MIN_BYTES:
+                for encoding in compression.encodings():
+                    encoded = compression.compress(data, encoding)
+                    if len(encoded) < len(data):
+                        asset.bodies[encoding] = encoded
+        return asset
+
+    def build(self) -> None:
+        signature = self._scan()
+        assets: Dict[str, Asset] = {}
+        pages: Dict[str, bytes] = {}
+        for name in signature:
+            path = os.path.join(self.root, name)
+            with open(path, "rb") as handle:
+                data = handle.read()
+            if name.endswith(".html"):
+                # Pages link to fingerprinted names, so they are built last.
+                pages[name] = data
+                continue
+            assets[name] = self._load(name, path, data)
+        fingerprinted = {self.fingerprint(name, asset): name for name, asset in assets.items()}
+        for name, data in pages.items():
+            page = self._rewrite(name, data.decode("utf-8"), assets)
+            assets[name] = self._load(name, os.path.join(self.root, name), page.encode("utf-8"))
+        with self._lock:
+            self._assets = assets
+            self._fingerprinted = fingerprinted
+            self._signature = signature
+            self._checked = time.monotonic()
+
+    @staticmethod
+    def fingerprint(name: str, asset: Asset) -> str:
+        stem, dot, extension = name.rpartition(".")
+        return f"{stem}.{asset.etag}.{extension}" if dot else f"{name}.{asset.etag}"
+
+    def _rewrite(self, page: str, html: str, assets: Dict[str, Asset]) -> str:
+        # Points src/href references to local assets at their fingerprinted
+        # names; external URLs and unknown paths are left as they are.
+        base = os.path.dirname(page)
+
+        def replace(match: "re.Match[str]") -> str:
+            reference = match.group(2)
+            if reference.startswith("/"):
+                return match.group(0)
+            name = os.path.normpath(os.path.join(base, reference)).replace(os.sep, "/")
+            asset = assets.get(name)
+            if asset is None:
+                return match.group(0)
+            fingerprinted = self.fingerprint(reference, asset)
+            return f"{match.group(1)}{fingerprinted}{match.group(3)}"
+
+        return _REFERENCE_RE.sub(replace, html)
+
+    def _maybe_reload(self) -> None:
+        if not STATIC_RELOAD or time.monotonic() - self._checked < RELOAD_CHECK_SECONDS:
+            return
+        self._checked = time.monotonic()
+        if self._scan() != self._signature:
+            print("[Kural IDE] Frontend changed; rebuilding static assets.")
+            self.build()
+
+    def lookup(self, name: str) -> Optional[Tuple[Asset, bool]]:
+        # Returns (asset, immutable) for a plain or fingerprinted name.
+        self._maybe_reload()
+        with self._lock:
+            asset = self._assets.get(name)
+            if asset is not None:
+                return asset, False
+            plain = self._fingerprinted.get(name)
+            if plain is not None:
+                return self._assets[plain], True
+        return None
+
+    @staticmethod
+    def encoding(asset: Asset, accept_encoding: Optional[str]) -> str:
+        # The best prebuilt encoding the client accepts, "" for none.
+        variants = asset.bodies or asset.files
+        available = tuple(encoding for encoding in ("br", "gzip") if encoding in variants)
+        return (compression.negotiate(accept_encoding, available) if available else None) or ""
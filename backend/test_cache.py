@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+# Building requests imports the history module; keep it off the disk.
+os.environ["KURAL_SESSION_LOG_DIR"] = ""
+
+import pytest
+
+import cache
+from agents.architect import ARCHITECT_ROLE
+from agents.builder import BUILDER_ROLE
+from cache import ResponseCache, request_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def _value(text):
+    return {"response": text, "model_used": "openrouter", "fallback_used": False}
+
+
+def _size(value):
+    return len(json.dumps(value))
+
+
+def test_entries_expire_after_the_ttl(clock):
+    responses = ResponseCache(ttl_seconds=60)
+    responses.put("key", _value("hello"))
+    clock[0] += 59
+    assert responses.get("key") == _value("hello")
+    clock[0] += 2
+    assert responses.get("key") is None
+    assert responses.stats()["entries"] == 0
+    assert responses.stats()["bytes"] == 0
+
+
+def test_oldest_entry_is_evicted_past_the_entry_limit():
+    responses = ResponseCache(max_entries=2)
+    responses.put("a", _value("a"))
+    responses.put("b", _value("b"))
+    # Reading "a" makes "b" the least recently used.
+    assert responses.get("a") is not None
+    responses.put("c", _value("c"))
+    assert responses.get("b") is None
+    assert responses.get("a") is not None
+    assert responses.get("c") is not None
+
+
+def test_entries_are_evicted_past_the_byte_limit():
+    size = _size(_value("x" * 100))
+    responses = ResponseCache(max_bytes=2 * size + 10)
+    for key in "abc":
+        responses.put(key, _value("x" * 100))
+    assert responses.get("a") is None
+    assert responses.stats()["entries"] == 2
+    assert responses.stats()["bytes"] == 2 * size
+
+
+def test_replacing_an_entry_does_not_count_its_bytes_twice():
+    responses = ResponseCache()
+    responses.put("a", _value("first"))
+    responses.put("a", _value("second"))
+    assert responses.stats()["bytes"] == _size(_value("second"))
+    assert responses.get("a") == _value("second")
+
+
+def test_sqlite_reads_through_to_a_new_process(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(db_path=path).put("key", _value("hello"))
+    restarted = ResponseCache(db_path=path)
+    assert restarted.stats()["entries"] == 0
+    assert restarted.get("key") == _value("hello")
+    assert restarted.get("key") == _value("hello")
+    stats = restarted.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["entries"]) == (2, 1, 1)
+
+
+def test_expired_sqlite_rows_are_not_served(tmp_path, clock):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(db_path=path, ttl_seconds=60).put("key", _value("hello"))
+    clock[0] += 61
+    assert ResponseCache(db_path=path).get("key") is None
+
+
+def _history(*contents):
+    return [{"role": "user", "content": content, "type": "input"} for content in contents]
+
+
+def test_request_key_changes_with_the_history():
+    key = request_key(BUILDER_ROLE, "openrouter", _history("a", "b"), "next")
+    assert key == request_key(BUILDER_ROLE, "openrouter", _history("a", "b"), "next")
+    assert key != request_key(BUILDER_ROLE, "openrouter", _history("a", "c"), "next")
+    assert key != request_key(BUILDER_ROLE, "openrouter", _history("a", "b", "c"), "next")
+    assert key != request_key(BUILDER_ROLE, "openrouter", _history("a", "b"), "other")
+
+
+def test_request_key_changes_with_the_role_and_provider():
+    key = request_key(BUILDER_ROLE, "openrouter", _history("a"), "next")
+    assert key != request_key(ARCHITECT_ROLE, "openrouter", _history("a"), "next")
+    assert key != request_key(BUILDER_ROLE, "mistral", _history("a"), "next")
+
+
+def test_unconfigured_provider_has_no_key():
+    assert request_key(BUILDER_ROLE, "gpt4o", _history("a"), "next") is None
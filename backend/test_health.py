@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import time
+from uuid import uuid4
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx
+
+import health
+from providers.base import ProviderError
+
+
+def _model():
+    return f"model-{uuid4().hex}"
+
+
+def _server_error():
+    return ProviderError("test", "boom", status_code=503)
+
+
+def _trip(model):
+    for _ in range(health.BREAKER_FAILURE_THRESHOLD):
+        health.record_failure(model, _server_error())
+
+
+def _after_open_period():
+    return time.time() + health.BREAKER_OPEN_SECONDS + 1
+
+
+def test_classify_error_by_status_and_reason():
+    assert health.classify_error(ProviderError("test", "x", status_code=429)) == "rate_limited"
+    assert health.classify_error(ProviderError("test", "x", status_code=413)) == "too_large"
+    assert health.classify_error(ProviderError("test", "x", status_code=504)) == "timeout"
+    assert health.classify_error(ProviderError("test", "x", status_code=401)) == "auth"
+    assert health.classify_error(ProviderError("test", "x", status_code=500)) == "server_error"
+    assert health.classify_error(ProviderError("test", "x", status_code=400)) == "client_error"
+    # An explicit reason wins over the status, and the message text is never read.
+    assert health.classify_error(ProviderError("test", "429 timeout", reason="not_configured")) == "not_configured"
+    assert health.classify_error(asyncio.TimeoutError()) == "timeout"
+    assert health.classify_error(httpx.ConnectError("refused")) == "unknown"
+    assert health.classify_error(ValueError("rate limit")) == "unknown"
+
+
+def test_breaker_opens_after_consecutive_failures():
+    model = _model()
+    for _ in range(health.BREAKER_FAILURE_THRESHOLD - 1):
+        health.record_failure(model, _server_error())
+    assert health.is_available(model)
+    health.record_failure(model, _server_error())
+    assert not health.is_available(model)
+    assert not health.try_acquire_trial(model)
+    assert health.order_chain([model]) == [model]
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    model = _model()
+    for _ in range(health.BREAKER_FAILURE_THRESHOLD + 1):
+        health.record_failure(model, ProviderError("test", "bad request", status_code=400))
+    assert health.is_available(model)
+
+
+def test_open_breaker_lets_one_trial_through():
+    model = _model()
+    _trip(model)
+    later = _after_open_period()
+    assert health.is_available(model, later)
+    assert health.try_acquire_trial(model, later)
+    # The trial is taken: nobody else gets through until it finishes.
+    assert not health.try_acquire_trial(model, later)
+    assert not health.is_available(model, later)
+
+
+def test_successful_trial_closes_the_breaker():
+    model = _model()
+    _trip(model)
+    assert health.try_acquire_trial(model, _after_open_period())
+    health.record_success(model, "complete", 0.5)
+    assert health.is_available(model)
+    assert health.try_acquire_trial(model)
+    assert health.try_acquire_trial(model)
+
+
+def test_failed_trial_reopens_the_breaker():
+    model = _model()
+    _trip(model)
+    later = _after_open_period()
+    assert health.try_acquire_trial(model, later)
+    health.record_failure(model, _server_error())
+    assert not health.is_available(model)
+    assert not health.try_acquire_trial(model)
+    assert health.try_acquire_trial(model, _after_open_period())
+
+
+def test_cancelled_trial_frees_it_for_the_next_request():
+    model = _model()
+    _trip(model)
+    later = _after_open_period()
+    assert health.try_acquire_trial(model, later)
+    health.record_cancelled(model)
+    assert health.try_acquire_trial(model, later)
+
+
+def test_rate_limit_cools_down_for_retry_after():
+    model = _model()
+    health.record_failure(model, ProviderError("test", "slow down", status_code=429, retry_after=5))
+    assert not health.is_available(model)
+    assert health.is_available(model, time.time() + 6)
+    # A cooldown is not a breaker trip.
+    assert health.try_acquire_trial(model)
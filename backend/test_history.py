@@ -0,0 +1,126 @@
+import os
+import sys
+from uuid import uuid4
+sys.path.insert(0, os.path.dirname(__file__))
+# Keep these sessions in memory only.
+os.environ["KURAL_SESSION_LOG_DIR"] = ""
+
+import pytest
+
+from agents.builder import BUILDER_ROLE
+from providers.engine import build_request
+from providers.registry import get_adapter
+from utils.history import (
+    HistoryConflict,
+    add_message,
+    apply_history_delta,
+    get_history,
+    get_history_since,
+    get_trimmed_history,
+    history_version,
+    set_history,
+)
+from utils.tokens import get_counter
+
+
+def _session():
+    return uuid4().hex
+
+
+def _turns(*contents):
+    return [{"role": "user", "content": content} for content in contents]
+
+
+def test_delta_appends_and_bumps_version():
+    session = _session()
+    start = history_version(session)
+    version = apply_history_delta(start, _turns("a", "b"), session)
+    assert version == start + 2
+    version = apply_history_delta(version, _turns("c"), session)
+    assert version == start + 3
+    assert [message["content"] for message in get_history(session)] == ["a", "b", "c"]
+    assert [message["content"] for message in get_history_since(start + 1, session)] == ["b", "c"]
+    assert get_history_since(version, session) == []
+
+
+def test_empty_delta_keeps_version():
+    session = _session()
+    version = apply_history_delta(history_version(session), _turns("a"), session)
+    assert apply_history_delta(version, [], session) == version
+
+
+def test_stale_version_conflicts():
+    session = _session()
+    version = apply_history_delta(history_version(session), _turns("a"), session)
+    add_message("architect", "from another tab", session_id=session)
+    with pytest.raises(HistoryConflict) as conflict:
+        apply_history_delta(version, _turns("b"), session)
+    assert conflict.value.current_version == version + 1
+    # Nothing from the rejected delta was applied.
+    assert [message["content"] for message in get_history(session)] == ["a", "from another tab"]
+    with pytest.raises(HistoryConflict):
+        apply_history_delta(version + 5, _turns("b"), session)
+
+
+def test_reset_starts_a_new_version_range():
+    session = _session()
+    old = apply_history_delta(history_version(session), _turns("a", "b"), session)
+    set_history([], session)
+    assert get_history(session) == []
+    assert history_version(session) > old
+    # Versions from before the reset no longer describe this history.
+    assert get_history_since(old, session) is None
+    with pytest.raises(HistoryConflict):
+        apply_history_delta(old, _turns("c"), session)
+    version = apply_history_delta(history_version(session), _turns("c"), session)
+    assert [message["content"] for message in get_history(session)] == ["c"]
+    assert get_history_since(version - 1, session)[0]["content"] == "c"
+
+
+def test_set_history_replaces_messages():
+    session = _session()
+    apply_history_delta(history_version(session), _turns("a"), session)
+    set_history(_turns("x", "y"), session)
+    version = history_version(session)
+    assert [message["content"] for message in get_history(session)] == ["x", "y"]
+    assert [message["content"] for message in get_history_since(version - 2, session)] == ["x", "y"]
+
+
+def test_trim_always_keeps_the_newest_message():
+    counter = get_counter()
+    history = _turns("idea", "plan") + _turns(*(f"turn {number} " + "word " * 100 for number in range(30)))
+    message = {"role": "user", "content": "Review this code " + "word " * 3000, "type": "input"}
+    trimmed = get_trimmed_history(4000, history + [message], counter)
+    assert trimmed[-1] is message
+    assert [item["content"] for item in trimmed[:2]] == ["idea", "plan"]
+    assert len(trimmed) > 3
+    assert counter.count_messages(trimmed) <= 4000
+
+
+def test_trim_gives_up_the_head_before_the_newest_message():
+    counter = get_counter()
+    history = _turns("idea " + "word " * 500, "plan " + "word " * 500, "turn")
+    message = {"role": "user", "content": "Review this code " + "word " * 3200, "type": "input"}
+    trimmed = get_trimmed_history(4000, history + [message], counter)
+    assert trimmed[-1] is message
+    assert trimmed[0]["content"].startswith("idea")
+    assert counter.count_messages(trimmed) <= 4000
+
+
+def test_trim_truncates_a_message_over_the_whole_budget():
+    counter = get_counter()
+    message = {"role": "user", "content": "Review this code " + "word " * 6000, "type": "input"}
+    trimmed = get_trimmed_history(4000, _turns("idea", "plan") + [message], counter)
+    assert len(trimmed) == 1
+    assert trimmed[0]["content"].startswith("Review this code word")
+    assert "truncated" in trimmed[0]["content"]
+    assert counter.count_messages(trimmed) <= 4000
+
+
+def test_request_carries_the_current_message():
+    adapter = get_adapter("openrouter")
+    history = _turns("idea " + "word " * 500, "plan " + "word " * 500) + _turns(*("word " * 300 for _ in range(20)))
+    message = "Review this code " + "word " * 3200
+    request = build_request(BUILDER_ROLE, adapter, history, message)
+    assert request.messages[-1]["content"] == message
+    assert request.messages[0]["content"].startswith("idea")
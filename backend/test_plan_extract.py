@@ -0,0 +1,111 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from utils.extract import merge_documents
+from utils.plan import parse_task_graph
+
+
+def _graph(*titles):
+    plan = "\n".join(f"Task {number}: {title}" for number, title in enumerate(titles, 1))
+    return [task["depends_on"] for task in parse_task_graph(plan)]
+
+
+def test_explicit_dependencies():
+    assert _graph(
+        "Page skeleton",
+        "Navbar markup",
+        "Style the navbar (depends on 1, 2)",
+        "Scores after Task 3",
+        "Requires tasks 1 and 2: footer",
+    ) == [[], [0], [0, 1], [2], [0, 1]]
+
+
+def test_inferred_dependencies():
+    assert _graph(
+        "HTML structure",
+        "CSS styling for the board",
+        "JavaScript click handlers",
+        "Add a footer",
+        "Dark mode theme",
+    ) == [[], [0], [0], [0], [1, 3]]
+
+
+def test_barrier_and_unknown_tasks_wait_for_everything():
+    assert _graph("HTML structure", "CSS styling", "Integrate and polish", "Something else") == [
+        [],
+        [0],
+        [0, 1],
+        [0, 1, 2],
+    ]
+
+
+def test_forward_and_self_references_cannot_form_cycles():
+    graph = _graph("HTML structure (after Task 2)", "CSS styling (depends on 2, 3)", "JavaScript logic after task 3")
+    assert graph == [[], [0], [0]]
+    for index, dependencies in enumerate(graph):
+        assert all(dependency < index for dependency in dependencies)
+
+
+def test_bold_task_lines():
+    plan = "TASKS:\n**Task 1:** Header\n  task 2: Style it, after task 1\nNot a task"
+    assert parse_task_graph(plan) == [
+        {"title": "Header", "depends_on": []},
+        {"title": "Style it, after task 1", "depends_on": [0]},
+    ]
+
+
+def _block(language, code):
+    return {"language": language, "code": code}
+
+
+PAGE = "<!DOCTYPE html>\n<html>\n<head>\n<title>t</title>\n</head>\n<body>\n<main></main>\n</body>\n</html>"
+
+
+def test_merge_keeps_task_order():
+    html = merge_documents(
+        [
+            [_block("html", PAGE)],
+            [_block("html", "<header>one</header>"), _block("css", "header { color: red; }")],
+            [_block("html", "<footer>two</footer>"), _block("javascript", "console.log(2);")],
+        ]
+    )
+    assert html.index("<main></main>") < html.index("<header>one</header>") < html.index("<footer>two</footer>")
+    assert html.index("<style>") < html.index("</head>")
+    assert html.index("<footer>two</footer>") < html.index("console.log(2);") < html.index("</body>")
+
+
+def test_merge_uses_latest_full_document_as_base():
+    later = PAGE.replace("<main></main>", "<main>v2</main>")
+    html = merge_documents(
+        [
+            [_block("html", PAGE), _block("css", "main { margin: 0; }")],
+            [_block("html", later)],
+            [_block("css", "main { padding: 0; }")],
+        ]
+    )
+    assert "<main>v2</main>" in html and "<main></main>" not in html
+    # Blocks from answers before the base are already part of it, or replaced.
+    assert "margin: 0" not in html
+    assert "padding: 0" in html
+
+
+def test_merge_skips_what_the_page_already_has():
+    html = merge_documents(
+        [
+            [_block("html", PAGE.replace("</head>", "<style>p { margin: 0; }</style>\n</head>"))],
+            [_block("html", "<main></main>"), _block("css", "p { margin: 0; }"), _block("css", "a { color: red; }")],
+            [_block("css", "a { color: red; }"), _block("text", "ignored")],
+        ]
+    )
+    assert html.count("<main></main>") == 1
+    assert html.count("p { margin: 0; }") == 1
+    assert html.count("a { color: red; }") == 1
+    assert "ignored" not in html
+
+
+def test_merge_wraps_fragments_without_a_page():
+    html = merge_documents([[_block("html", "<p>a</p>")], [_block("js", "run();")]])
+    assert html.startswith("<!DOCTYPE html>")
+    assert html.index("<body>") < html.index("<p>a</p>") < html.index("run();") < html.index("</body>")
+    assert merge_documents([[], [_block("python", "print(1)")]]) == ""
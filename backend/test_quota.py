@@ -0,0 +1,139 @@
+import os
+import sys
+from uuid import uuid4
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+import quota
+from quota import Bucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(quota.time, "time", lambda: now[0])
+    return now
+
+
+def _provider(monkeypatch, **limits):
+    # A provider nobody else has used, with only the given budgets.
+    name = f"test{uuid4().hex[:12]}"
+    for bucket in quota.LIMIT_WINDOWS:
+        monkeypatch.setenv(f"{name.upper()}_{bucket.upper()}", str(limits.get(bucket, 0)))
+    return name
+
+
+def _remaining(provider, bucket):
+    return quota.snapshot([provider])[provider]["limits"][bucket]["remaining"]
+
+
+def test_bucket_refills_at_its_rate_up_to_the_limit():
+    bucket = Bucket(limit=60, window=60, level=0, updated=0)
+    assert bucket.wait(10) == 10
+    bucket.refill(30)
+    assert bucket.level == 30
+    assert bucket.wait(10) == 0
+    bucket.refill(1000)
+    assert bucket.level == 60
+    # More than the whole budget waits for a full bucket, not forever.
+    bucket.level = 0
+    assert bucket.wait(600) == 60
+
+
+def test_reserve_returns_the_wait_once_the_budget_is_spent(monkeypatch, clock):
+    provider = _provider(monkeypatch, rpm=2)
+    assert quota.reserve(provider, 100) == 0
+    assert quota.reserve(provider, 100) == 0
+    assert quota.wait_time(provider, 100) == 30
+    assert quota.reserve(provider, 100) == 30
+    # Once the third request's wait has passed, the next one queues behind it.
+    clock[0] += 30
+    assert quota.wait_time(provider, 100) == 30
+
+
+def test_settle_gives_back_what_the_request_did_not_use(monkeypatch, clock):
+    provider = _provider(monkeypatch, tpm=1000)
+    reserved_at = clock[0]
+    quota.reserve(provider, 600)
+    assert _remaining(provider, "tpm") == 400
+    quota.settle(provider, 600, 200, reserved_at)
+    assert _remaining(provider, "tpm") == 800
+
+
+def test_settle_charges_what_the_request_used_beyond_its_reservation(monkeypatch, clock):
+    provider = _provider(monkeypatch, tpm=1000)
+    reserved_at = clock[0]
+    quota.reserve(provider, 300)
+    quota.settle(provider, 300, 900, reserved_at)
+    assert _remaining(provider, "tpm") == 100
+
+
+def test_failed_request_returns_its_tokens_but_not_its_request(monkeypatch, clock):
+    provider = _provider(monkeypatch, rpm=10, tpm=1000)
+    reserved_at = clock[0]
+    quota.reserve(provider, 600)
+    quota.settle(provider, 600, None, reserved_at)
+    assert _remaining(provider, "tpm") == 1000
+    assert _remaining(provider, "rpm") == 9
+
+
+def test_settle_leaves_a_level_the_provider_reported_afterwards(monkeypatch, clock):
+    provider = _provider(monkeypatch, tpm=1000)
+    reserved_at = clock[0]
+    quota.reserve(provider, 600)
+    clock[0] += 1
+    quota.observe_headers(provider, {"x-ratelimit-remaining-tokens": "500"})
+    quota.settle(provider, 600, 200, reserved_at)
+    assert _remaining(provider, "tpm") == 500
+
+
+def test_observe_headers_learns_limits_and_remaining(monkeypatch, clock):
+    provider = _provider(monkeypatch)
+    # Groq reports requests per day (a reset hours away) and tokens per minute.
+    quota.observe_headers(
+        provider,
+        {
+            "x-ratelimit-limit-requests": "1000",
+            "x-ratelimit-remaining-requests": "3",
+            "x-ratelimit-reset-requests": "2h59m",
+            "x-ratelimit-limit-tokens": "6000",
+            "x-ratelimit-remaining-tokens": "100",
+            "x-ratelimit-reset-tokens": "7.5s",
+        },
+    )
+    limits = quota.snapshot([provider])[provider]["limits"]
+    assert limits["rpd"] == {"limit": 1000, "remaining": 3}
+    assert limits["tpm"] == {"limit": 6000, "remaining": 100}
+    assert "rpm" not in limits
+    assert quota.wait_time(provider, 1100) == pytest.approx(10)
+
+
+def test_observe_headers_reads_per_minute_request_headers(monkeypatch, clock):
+    provider = _provider(monkeypatch, rpm=20)
+    # OpenRouter: unsuffixed headers with the reset in epoch milliseconds.
+    quota.observe_headers(
+        provider,
+        {
+            "x-ratelimit-limit": "20",
+            "x-ratelimit-remaining": "0",
+            "x-ratelimit-reset": str(int((clock[0] + 30) * 1000)),
+        },
+    )
+    assert _remaining(provider, "rpm") == 0
+    assert quota.wait_time(provider, 0) == 3
+
+
+def test_observe_headers_ignores_responses_without_limits(monkeypatch, clock):
+    provider = _provider(monkeypatch, rpm=20)
+    quota.observe_headers(provider, {"content-type": "application/json"})
+    assert _remaining(provider, "rpm") == 20
+
+
+def test_reset_durations():
+    assert quota._reset_seconds("2m59.5s", 0) == pytest.approx(179.5)
+    assert quota._reset_seconds("120ms", 0) == pytest.approx(0.12)
+    assert quota._reset_seconds("7", 0) == 7
+    assert quota._reset_seconds("1700000030000", 1_700_000_000) == pytest.approx(30)
+    assert quota._reset_seconds("2023-11-14T22:13:50Z", 1_700_000_000) == pytest.approx(30)
+    assert quota._reset_seconds("soon", 0) is None
@@ -0,0 +1,108 @@
+import os
+import sys
+from uuid import uuid4
+sys.path.insert(0, os.path.dirname(__file__))
+# Keep these sessions in memory only.
+os.environ["KURAL_SESSION_LOG_DIR"] = ""
+
+import pytest
+
+import server
+from utils.history import add_message, apply_history_delta, set_history
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def _session(count=0):
+    session = uuid4().hex
+    if count:
+        apply_history_delta(0, [{"role": "user", "content": f"m{index}"} for index in range(count)], session)
+    return session
+
+
+def _get(client, session, **query):
+    return client.get("/api/history", query_string=query, headers={server.SESSION_HEADER: session})
+
+
+def _contents(body, field="history"):
+    return [message["content"] for message in body[field]]
+
+
+def test_pages_walk_back_from_the_newest_message(client):
+    session = _session(7)
+    page = _get(client, session, limit=3).get_json()
+    assert _contents(page) == ["m4", "m5", "m6"]
+    assert (page["cursor"], page["has_more"], page["history_version"]) == (4, True, 7)
+
+    page = _get(client, session, limit=3, before=page["cursor"]).get_json()
+    assert _contents(page) == ["m1", "m2", "m3"]
+    assert (page["cursor"], page["has_more"]) == (1, True)
+
+    page = _get(client, session, limit=3, before=page["cursor"]).get_json()
+    assert _contents(page) == ["m0"]
+    assert (page["cursor"], page["has_more"]) == (0, False)
+
+
+def test_page_size_is_clamped(client):
+    session = _session(3)
+    assert _contents(_get(client, session, limit=0).get_json()) == ["m2"]
+    assert len(_get(client, session, limit=server.HISTORY_PAGE_MAX + 10).get_json()["history"]) == 3
+
+
+def test_cursor_from_before_a_reset_conflicts(client):
+    session = _session(5)
+    cursor = _get(client, session, limit=2).get_json()["cursor"]
+    set_history([{"role": "user", "content": "fresh"}], session)
+    response = _get(client, session, limit=2, before=cursor)
+    assert response.status_code == 409
+    assert response.get_json()["code"] == "history_conflict"
+    assert response.get_json()["history_version"] == 7
+
+
+def test_since_returns_only_the_newer_messages(client):
+    session = _session(3)
+    add_message("architect", "plan", session_id=session)
+    add_message("builder", "code", session_id=session)
+    body = _get(client, session, since=3).get_json()
+    assert _contents(body, "history_delta") == ["plan", "code"]
+    assert body["history_version"] == 5
+    assert "history" not in body
+    assert _get(client, session, since=5).get_json()["history_delta"] == []
+
+
+def test_since_before_a_reset_sends_the_whole_history(client):
+    session = _session(3)
+    set_history([{"role": "user", "content": "fresh"}], session)
+    body = _get(client, session, since=2).get_json()
+    assert _contents(body) == ["fresh"]
+    assert body["history_reset"] is True
+    assert body["history_version"] == 5
+
+
+def test_unchanged_history_is_not_modified(client):
+    session = _session(2)
+    first = _get(client, session)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    again = client.get("/api/history", headers={server.SESSION_HEADER: session, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_etag_changes_with_the_history_and_the_query(client):
+    session = _session(2)
+    etag = _get(client, session).headers["ETag"]
+    assert _get(client, session, limit=1).headers["ETag"] != etag
+    assert _get(client, _session(2)).headers["ETag"] != etag
+
+    add_message("architect", "plan", session_id=session)
+    response = client.get("/api/history", headers={server.SESSION_HEADER: session, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert _contents(response.get_json())[-1] == "plan"
@@ -0,0 +1,140 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import session_log
+from session_log import SessionLog
+
+SESSION = "logsession"
+
+
+def _messages(start, count, size=20):
+    return [{"role": "user", "content": f"message {index} " + "x" * size} for index in range(start, start + count)]
+
+
+def _meta(**fields):
+    return {"base_version": 0, "memory": "", **fields}
+
+
+def _files(root, suffix):
+    return sorted(name for name in os.listdir(os.path.join(root, SESSION)) if name.endswith(suffix))
+
+
+def _append_one_at_a_time(log, messages, start=0):
+    for offset, message in enumerate(messages):
+        log.write_session(SESSION, _meta(), [message], start + offset)
+
+
+def test_messages_round_trip_through_a_restart(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(memory="notes"), _messages(0, 3), 0)
+    _append_one_at_a_time(log, _messages(3, 4), 3)
+    log.forget(SESSION)
+
+    reopened = SessionLog(root)
+    assert reopened.meta(SESSION) == {**_meta(), "count": 7}
+    assert reopened.read_messages(SESSION) == _messages(0, 7)
+    # The index gives any slice without reading the rest.
+    assert reopened.read_messages(SESSION, 5) == _messages(5, 2)
+    assert reopened.read_messages(SESSION, 2, 4) == _messages(2, 2)
+    assert reopened.read_messages(SESSION, 6, 100) == _messages(6, 1)
+
+
+def test_unknown_session_has_nothing(tmp_path):
+    log = SessionLog(str(tmp_path))
+    assert log.meta("missing") is None
+    assert log.read_messages("missing") == []
+
+
+def test_metadata_only_update_keeps_the_messages(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 2), 0)
+    log.write_session(SESSION, _meta(memory="summary"), [], None)
+    reopened = SessionLog(root)
+    assert reopened.meta(SESSION)["memory"] == "summary"
+    assert reopened.read_messages(SESSION) == _messages(0, 2)
+
+
+def test_appends_roll_over_into_new_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_log, "SEGMENT_BYTES", 200)
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), [], 0)
+    _append_one_at_a_time(log, _messages(0, 30))
+    assert len(_files(root, ".jsonl")) > 5
+    assert all(os.path.getsize(os.path.join(root, SESSION, name)) < 300 for name in _files(root, ".jsonl"))
+    assert SessionLog(root).read_messages(SESSION) == _messages(0, 30)
+
+
+def test_rewritten_tail_replaces_the_old_messages(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 5), 0)
+    replacement = [{"role": "builder", "content": "rewritten"}]
+    log.write_session(SESSION, _meta(), replacement, 3)
+    assert log.read_messages(SESSION) == _messages(0, 3) + replacement
+    assert SessionLog(root).read_messages(SESSION) == _messages(0, 3) + replacement
+
+
+def test_reset_starts_a_new_generation(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 5), 0)
+    log.write_session(SESSION, _meta(), _messages(10, 2), 0)
+    assert _files(root, ".idx") == ["000001.idx"]
+    assert all(name.startswith("000001-") for name in _files(root, ".jsonl"))
+    assert SessionLog(root).read_messages(SESSION) == _messages(10, 2)
+
+
+def test_torn_append_is_dropped_on_reload(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 3), 0)
+    log.forget(SESSION)
+    # A crash after the index entry but before the whole line hit the disk.
+    segment = os.path.join(root, SESSION, _files(root, ".jsonl")[-1])
+    offset = os.path.getsize(segment)
+    with open(segment, "ab") as handle:
+        handle.write(b'{"role":"user","con')
+    with open(os.path.join(root, SESSION, "000000.idx"), "ab") as handle:
+        handle.write(session_log._INDEX_ENTRY.pack(0, offset))
+
+    reopened = SessionLog(root)
+    assert reopened.meta(SESSION)["count"] == 3
+    assert reopened.read_messages(SESSION) == _messages(0, 3)
+    # New appends never land after the torn line.
+    reopened.write_session(SESSION, _meta(), _messages(3, 1), 3)
+    assert SessionLog(root).read_messages(SESSION) == _messages(0, 4)
+
+
+def test_short_segments_left_by_restarts_are_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_log, "MAX_SEGMENTS", 3)
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 2), 0)
+    log.forget(SESSION)
+    # Each restart appends to a fresh segment of its own.
+    for index in range(2, 5):
+        restarted = SessionLog(root)
+        restarted.write_session(SESSION, _meta(), _messages(index, 1), index)
+        restarted.forget(SESSION)
+    assert len(_files(root, ".jsonl")) == 4
+
+    reopened = SessionLog(root)
+    assert reopened.read_messages(SESSION) == _messages(0, 5)
+    assert _files(root, ".idx") == ["000001.idx"]
+    assert _files(root, ".jsonl") == ["000001-000000.jsonl"]
+    assert SessionLog(root).read_messages(SESSION) == _messages(0, 5)
+
+
+def test_idle_sessions_are_pruned(tmp_path):
+    root = str(tmp_path)
+    log = SessionLog(root)
+    log.write_session(SESSION, _meta(), _messages(0, 1), 0)
+    log.write_session("kept", _meta(), _messages(0, 1), 0)
+    assert log.prune_sessions(idle_seconds=60) == 0
+    assert log.prune_sessions(idle_seconds=-1, keep=["kept"]) == 1
+    assert log.meta(SESSION) is None
+    assert log.read_messages("kept") == _messages(0, 1)
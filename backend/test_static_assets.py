@@ -0,0 +1,103 @@
+import gzip
+import os
+import re
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+# Keep these sessions in memory only.
+os.environ["KURAL_SESSION_LOG_DIR"] = ""
+
+import server
+from static_assets import IMMUTABLE_CACHE, REVALIDATE_CACHE, StaticAssets
+
+_LOCAL_REFERENCE_RE = re.compile(r"""(?:src|href)=["']([^"':?#/][^"':?#]*)["']""")
+
+
+def _frontend(tmp_path):
+    (tmp_path / "index.html").write_text(
+        '<link rel="stylesheet" href="style.css">'
+        '<link rel="icon" href="assets/logo.svg">'
+        '<script src="https://cdn.example.com/lib.js"></script>'
+        '<script src="app.js"></script>'
+        '<a href="missing.html">x</a>'
+    )
+    (tmp_path / "style.css").write_text("body { color: black; }\n" * 200)
+    (tmp_path / "app.js").write_text("console.log('kural');\n")
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "logo.svg").write_text("<svg></svg>")
+    (tmp_path / ".env").write_text("SECRET=1")
+    (tmp_path / "server.py").write_text("")
+    return StaticAssets(str(tmp_path))
+
+
+def _page(assets):
+    asset, immutable = assets.lookup("index.html")
+    assert not immutable
+    return asset.bodies[""].decode("utf-8")
+
+
+def test_page_links_to_fingerprinted_names(tmp_path):
+    assets = _frontend(tmp_path)
+    page = _page(assets)
+    for name in ("style.css", "app.js", "assets/logo.svg"):
+        asset, _ = assets.lookup(name)
+        assert f'"{StaticAssets.fingerprint(name, asset)}"' in page
+    # External URLs and paths that are not assets are left alone.
+    assert '"https://cdn.example.com/lib.js"' in page
+    assert '"missing.html"' in page
+
+
+def test_fingerprinted_names_resolve_as_immutable(tmp_path):
+    assets = _frontend(tmp_path)
+    for reference in _LOCAL_REFERENCE_RE.findall(_page(assets)):
+        if reference == "missing.html":
+            continue
+        asset, immutable = assets.lookup(reference)
+        assert immutable
+        assert (asset, False) == assets.lookup(reference.replace(f".{asset.etag}", ""))
+
+
+def test_changed_content_gets_a_new_fingerprint(tmp_path):
+    before = _frontend(tmp_path)
+    old_name = StaticAssets.fingerprint("app.js", before.lookup("app.js")[0])
+    (tmp_path / "app.js").write_text("console.log('changed');\n")
+    after = StaticAssets(str(tmp_path))
+    assert after.lookup(old_name) is None
+    assert StaticAssets.fingerprint("app.js", after.lookup("app.js")[0]) in _page(after)
+
+
+def test_hidden_and_source_files_are_not_served(tmp_path):
+    assets = _frontend(tmp_path)
+    assert assets.lookup(".env") is None
+    assert assets.lookup("server.py") is None
+
+
+def test_server_sends_fingerprinted_assets_with_immutable_caching():
+    client = server.app.test_client()
+    page = client.get("/")
+    assert page.status_code == 200
+    assert page.headers["Cache-Control"] == REVALIDATE_CACHE
+    references = _LOCAL_REFERENCE_RE.findall(page.get_data(as_text=True))
+    assert references
+    for reference in references:
+        response = client.get(f"/{reference}")
+        assert response.status_code == 200, reference
+        assert response.headers["Cache-Control"] == IMMUTABLE_CACHE
+        assert response.headers["ETag"]
+        plain = client.get("/" + re.sub(r"\.[0-9a-f]{12}(\.[^.]+)$", r"\1", reference))
+        assert plain.headers["Cache-Control"] == REVALIDATE_CACHE
+        assert plain.data == response.data
+
+
+def test_server_revalidates_and_compresses_assets():
+    client = server.app.test_client()
+    reference = next(
+        name for name in _LOCAL_REFERENCE_RE.findall(client.get("/").get_data(as_text=True)) if name.endswith(".css")
+    )
+    response = client.get(f"/{reference}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    plain = client.get(f"/{reference}")
+    assert gzip.decompress(response.data) == plain.data
+    again = client.get(f"/{reference}", headers={"If-None-Match": plain.headers["ETag"]})
+    assert again.status_code == 304
+    assert client.get("/app.000000000000.js").status_code == 404
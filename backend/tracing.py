@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+import functools
+import ipaddress
+import os
+import threading
+from typing import Dict, Iterator, Sequence
+
+import httpx
+
+# "otlp" (OTEL_EXPORTER_OTLP_ENDPOINT, default http://localhost:4318),
+# "file" (KURAL_TRACE_FILE) or "console"; unset disables tracing.
+TRACE_EXPORTER = os.getenv("KURAL_TRACE_EXPORTER", "").strip().lower()
+TRACE_FILE = os.getenv("KURAL_TRACE_FILE", "kural-traces.jsonl")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "kural-ide")
+TRACE_PROPAGATE = os.getenv("KURAL_TRACE_PROPAGATE", "").lower() in {"1", "true", "yes"}
+
+trace = None
+# The OpenTelemetry SDK is only imported when an exporter is configured, so
+# it adds nothing to start-up otherwise.
+if TRACE_EXPORTER:
+    try:
+        from opentelemetry import context as otel_context
+        from opentelemetry import propagate, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+        from opentelemetry.sdk.trace.export import (
+            BatchSpanProcessor,
+            ConsoleSpanExporter,
+            SpanExporter,
+            SpanExportResult,
+        )
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+    except ImportError:  # tracing is optional; spans become no-ops
+        trace = None
+        print("[Kural IDE] KURAL_TRACE_EXPORTER is set but opentelemetry-sdk is not installed.")
+
+_TRACER = None
+
+if trace is not None:
+
+    class JsonLinesSpanExporter(SpanExporter):
+        def __init__(self, path: str) -> None:
+            self.path = path
+            self._lock = threading.Lock()
+
+        def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            with self._lock, open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(lines)
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self) -> None:
+            pass
+
+    def _exporter():
+        if TRACE_EXPORTER == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            return OTLPSpanExporter()
+        if TRACE_EXPORTER == "file":
+            return JsonLinesSpanExporter(TRACE_FILE)
+        if TRACE_EXPORTER == "console":
+            return ConsoleSpanExporter()
+        return None
+
+    _span_exporter = _exporter()
+    if _span_exporter is not None:
+        _provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        _provider.add_span_processor(BatchSpanProcessor(_span_exporter))
+        trace.set_tracer_provider(_provider)
+        _TRACER = trace.get_tracer("kural-ide")
+
+
+def enabled() -> bool:
+    return _TRACER is not None
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Dict | None = None) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def set_status(self, *args) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _clean(attributes: Dict) -> Dict:
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator:
+    if _TRACER is None:
+        yield _NOOP_SPAN
+        return
+    span_kind = {"server": SpanKind.SERVER, "client": SpanKind.CLIENT}.get(kind, SpanKind.INTERNAL)
+    with _TRACER.start_as_current_span(
+        name,
+        kind=span_kind,
+        attributes=_clean(attributes),
+        record_exception=False,
+        set_status_on_exception=False,
+    ) as current:
+        try:
+            yield current
+        except Exception as exc:
+            # A cancelled hedge (CancelledError) is not an error, so only
+            # real exceptions mark the span.
+            mark_error(current, exc)
+            raise
+
+
+def traced(name: str):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def mark_error(current, exc: BaseException, reason: str | None = None) -> None:
+    if _TRACER is None:
+        return
+    current.record_exception(exc)
+    current.set_status(Status(StatusCode.ERROR, reason or type(exc).__name__))
+
+
+def instrument_flask(app) -> None:
+    if _TRACER is None:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_span():
+        parent = propagate.extract(request.headers)
+        route = request.url_rule.rule if request.url_rule else request.path
+        current = _TRACER.start_span(
+            f"{request.method} {route}",
+            context=parent,
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": request.method, "http.route": route},
+        )
+        g.trace_span = current
+        g.trace_token = otel_context.attach(trace.set_span_in_context(current))
+
+    @app.after_request
+    def _record_status(response):
+        current = g.get("trace_span")
+        if current is not None:
+            current.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                current.set_status(Status(StatusCode.ERROR))
+        return response
+
+    @app.teardown_request
+    def _end_request_span(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            otel_context.detach(token)
+        # Streamed responses hand their span to wrap_stream, which ends it.
+        current = g.pop("trace_span", None)
+        if current is None:
+            return
+        if exc is not None:
+            mark_error(current, exc)
+        current.end()
+
+
+def wrap_stream(chunks: Iterator) -> Iterator:
+    # Flask tears the request down before a streamed body is sent, so carry
+    # the request span and its context into the generator and end it there.
+    if _TRACER is None:
+        return chunks
+    from flask import g
+
+    current = g.pop("trace_span", None)
+    parent = otel_context.get_current()
+
+    def generator():
+        token = otel_context.attach(parent)
+        try:
+            yield from chunks
+        except Exception as exc:
+            if current is not None:
+                mark_error(current, exc)
+            raise
+        finally:
+            otel_context.detach(token)
+            if current is not None:
+                current.end()
+
+    return generator()
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost" or host.endswith(".localhost"):
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    # One client span per provider HTTP call. W3C trace headers are injected
+    # only for endpoints we run (an overridden base URL or a loopback host),
+    # so a tracing proxy or mock can join the trace without our trace IDs
+    # going to third-party APIs; KURAL_TRACE_PROPAGATE=1 sends them everywhere.
+    def __init__(self, transport: httpx.AsyncBaseTransport, provider: str) -> None:
+        self._transport = transport
+        self._provider = provider
+        self._propagate = TRACE_PROPAGATE or bool(os.getenv(f"{provider.upper()}_BASE_URL", "").strip())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if _TRACER is None:
+            return await self._transport.handle_async_request(request)
+        with span(
+            f"{request.method} {request.url.host}",
+            kind="client",
+            **{
+                "http.request.method": request.method,
+                "url.full": str(request.url.copy_with(query=None)),
+                "kural.provider": self._provider,
+            },
+        ) as current:
+            if self._propagate or _is_loopback(request.url.host):
+                propagate.inject(request.headers)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except Exception as exc:
+                mark_error(current, exc)
+                raise
+            current.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 400:
+                current.set_status(Status(StatusCode.ERROR, f"HTTP {response.status_code}"))
+            return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
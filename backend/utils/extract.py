@@ -1,14 +1,179 @@
 import re
-from typing import List, Dict
+from typing import Dict, List, Optional
 
+from tracing import traced
 
-_CODE_BLOCK_RE = re.compile(r"```(\w+)?\n([\s\S]*?)```", re.MULTILINE)
 
+# An opening fence: optional indent, three or more backticks or tildes, then
+# an optional language. Code glued to the fence ("```html<!DOCTYPE html>")
+# is kept; anything after a space is the fence's info string.
+_OPEN_FENCE_RE = re.compile(r"^[ \t]*(`{3,}|~{3,})([A-Za-z0-9_+#.-]*)(.*)$")
+_CLOSE_FENCE_RE = re.compile(r"^[ \t]*(`{3,}|~{3,})[ \t]*$")
 
+
+class CodeBlockExtractor:
+    # Line-by-line fence state machine. feed() takes streamed text and
+    # returns the blocks that closed in it; close() ends the text and also
+    # returns a block left open by truncation, marked "partial". Every
+    # character is looked at a bounded number of times, so the cost stays
+    # linear in the length of the answer.
+    def __init__(self) -> None:
+        self.blocks: List[Dict] = []
+        self._pending: List[str] = []
+        self._fence = ""
+        self._language = ""
+        self._lines: List[str] = []
+        self._depth = 0
+
+    def feed(self, text: str) -> List[Dict]:
+        closed: List[Dict] = []
+        start = 0
+        while True:
+            end = text.find("\n", start)
+            if end == -1:
+                if start < len(text):
+                    self._pending.append(text[start:])
+                return closed
+            self._pending.append(text[start:end])
+            line = "".join(self._pending)
+            self._pending = []
+            block = self._line(line)
+            if block is not None:
+                closed.append(block)
+            start = end + 1
+
+    def close(self) -> List[Dict]:
+        closed: List[Dict] = []
+        if self._pending:
+            line = "".join(self._pending)
+            self._pending = []
+            block = self._line(line)
+            if block is not None:
+                closed.append(block)
+        if self._fence:
+            block = self._finish(partial=True)
+            closed.append(block)
+        return closed
+
+    def _line(self, line: str) -> Optional[Dict]:
+        if line.endswith("\r"):
+            line = line[:-1]
+        if not self._fence:
+            if "`" not in line and "~" not in line:
+                return None
+            match = _OPEN_FENCE_RE.match(line)
+            if match is None or (match.group(1)[0] == "`" and "`" in match.group(3)):
+                return None
+            self._fence = match.group(1)
+            self._language = match.group(2)
+            self._lines = []
+            self._depth = 0
+            rest = match.group(3)
+            if rest and not rest[0].isspace():
+                self._lines.append(rest + "\n")
+            return None
+        fence_char, fence_length = self._fence[0], len(self._fence)
+        if fence_char not in line:
+            self._lines.append(line + "\n")
+            return None
+        stripped = line.strip()
+        if _CLOSE_FENCE_RE.match(line) and stripped[0] == fence_char and len(stripped) >= fence_length:
+            if self._depth == 0:
+                return self._finish()
+            self._depth -= 1
+        elif stripped.startswith(self._fence) and _OPEN_FENCE_RE.match(line):
+            # A fence with a language inside a block opens a nested block
+            # (a Markdown answer that shows code); its bare fence closes it.
+            self._depth += 1
+        elif self._depth == 0 and stripped.endswith(self._fence) and len(stripped) > fence_length:
+            # The closing fence glued to the last line of code: "</html>```".
+            self._lines.append(line.rstrip()[:-fence_length] + "\n")
+            return self._finish()
+        self._lines.append(line + "\n")
+        return None
+
+    def _finish(self, partial: bool = False) -> Dict:
+        block = {"language": self._language, "code": "".join(self._lines)}
+        if partial:
+            block["partial"] = True
+        self.blocks.append(block)
+        self._fence = ""
+        self._language = ""
+        self._lines = []
+        return block
+
+
+@traced("extract_code_blocks")
 def extract_code_blocks(text: str) -> List[Dict[str, str]]:
-    blocks = []
-    for match in _CODE_BLOCK_RE.finditer(text):
-        language = match.group(1) or ""
-        code = match.group(2)
-        blocks.append({"language": language, "code": code})
-    return blocks
+    extractor = CodeBlockExtractor()
+    extractor.feed(text)
+    extractor.close()
+    return extractor.blocks
+
+
+_FULL_DOCUMENT_RE = re.compile(r"<html[\s>]|<body[\s>]|<!doctype html", re.IGNORECASE)
+_INLINE_RE = {
+    "css": re.compile(r"<style[^>]*>([\s\S]*?)</style>", re.IGNORECASE),
+    "js": re.compile(r"<script(?![^>]*\bsrc=)[^>]*>([\s\S]*?)</script>", re.IGNORECASE),
+}
+_LANGUAGES = {"html": "html", "css": "css", "javascript": "js", "js": "js"}
+
+
+def _insert_before(html: str, closing_tag: str, content: str, at_start: bool = False) -> str:
+    position = html.lower().rfind(closing_tag)
+    if position == -1:
+        return f"{content}\n{html}" if at_start else f"{html}\n{content}"
+    return f"{html[:position]}{content}\n{html[position:]}"
+
+
+@traced("merge_documents")
+def merge_documents(block_lists: List[List[Dict[str, str]]]) -> str:
+    # Combines the code blocks of several Builder answers, in task order, into
+    # the single HTML document the preview shows. The latest full document is
+    # the base; HTML fragments, CSS and JavaScript from its answer onwards are
+    # added to it unless it already contains them.
+    blocks = [
+        (position, _LANGUAGES.get((block.get("language") or "").lower()), block["code"].strip())
+        for position, block_list in enumerate(block_lists)
+        for block in block_list
+    ]
+    blocks = [block for block in blocks if block[1] and block[2]]
+    base_index = max(
+        (index for index, (_, language, code) in enumerate(blocks) if language == "html" and _FULL_DOCUMENT_RE.search(code)),
+        default=-1,
+    )
+    html = blocks[base_index][2] if base_index >= 0 else ""
+    base_position = blocks[base_index][0] if base_index >= 0 else 0
+    fragments: List[str] = []
+    extra = {"css": [], "js": []}
+    for index, (position, language, code) in enumerate(blocks):
+        if index == base_index or position < base_position:
+            continue
+        if language != "html":
+            extra[language].append(code)
+        elif _FULL_DOCUMENT_RE.search(code):
+            # A second full page in the same answer: keep its styles and
+            # scripts, not its markup.
+            for kind, pattern in _INLINE_RE.items():
+                extra[kind].extend(match.strip() for match in pattern.findall(code))
+        elif code not in html:
+            fragments.append(code)
+    if not html and not fragments:
+        return ""
+    if not html:
+        html = "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"UTF-8\">\n</head>\n<body>\n</body>\n</html>"
+    seen = set()
+    css = []
+    js = []
+    for kind, target in (("css", css), ("js", js)):
+        for code in extra[kind]:
+            if code and code not in html and code not in seen:
+                seen.add(code)
+                target.append(code)
+    if fragments:
+        html = _insert_before(html, "</body>", "\n\n".join(fragments))
+    if css:
+        html = _insert_before(html, "</head>", "<style>\n" + "\n\n".join(css) + "\n</style>", at_start=True)
+    if js:
+        html = _insert_before(html, "</body>", "<script>\n" + "\n\n".join(js) + "\n</script>")
+    return html
@@ -1,12 +1,33 @@
 from __future__ import annotations
 
-from copy import deepcopy
+from collections.abc import Mapping
 from datetime import datetime, timezone
+import os
 import re
-from typing import Dict, List, Optional
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import session_log
+import state
+from utils.tokens import TokenCounter, get_counter
 
 _VALID_ROLES = {"architect", "builder", "user"}
-_HISTORY: List[Dict[str, str]] = []
+DEFAULT_SESSION = "default"
+MEMORY_TYPE = "memory"
+HEAD_MESSAGES = 2
+SESSION_IDLE_SECONDS = int(os.getenv("KURAL_SESSION_IDLE_SECONDS", str(6 * 60 * 60)))
+# Recent messages kept in memory per session, besides the opening turns.
+# Older ones are dropped once they are safely in the session log or the
+# shared store and read back from there when needed; 0 keeps everything.
+SESSION_WINDOW = int(os.getenv("KURAL_SESSION_WINDOW", "512"))
+SPILL_BATCH = 64
+# A memory claim older than this belongs to a summary that never finished
+# (e.g. its worker was recycled), so another worker may claim the backlog.
+MEMORY_CLAIM_SECONDS = 300
+SHARED_PRUNE_INTERVAL_SECONDS = 60
+LOG_PRUNE_INTERVAL_SECONDS = 60 * 60
 MODEL_TOKEN_LIMITS = {
     "gemini": 30000,
     "groq": 4000,
@@ -15,113 +36,601 @@ MODEL_TOKEN_LIMITS = {
 }
 
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+class HistoryConflict(RuntimeError):
+    def __init__(self, current_version: int) -> None:
+        super().__init__("History is out of sync with the server.")
+        self.current_version = current_version
+
+
+_MESSAGE_KEYS = ("role", "content", "timestamp", "type")
+
+
+def _parse_timestamp(value: object) -> Union[float, str, None]:
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        # Kept verbatim rather than lost; the client sent something odd.
+        return str(value)
+
+
+class Message(Mapping):
+    # An immutable history entry. Role and type come from a handful of values
+    # and are interned, and the timestamp is kept as epoch seconds and only
+    # formatted when read. Being immutable, records are shared between the
+    # session, snapshots and requests instead of copied; being a Mapping,
+    # they read like the message dicts the adapters expect.
+    __slots__ = ("role", "content", "type", "created")
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        message_type: str = "general",
+        created: Union[float, str, None] = None,
+    ) -> None:
+        object.__setattr__(self, "role", sys.intern(role))
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "type", sys.intern(message_type))
+        object.__setattr__(self, "created", created)
+
+    @classmethod
+    def from_dict(cls, item: Mapping) -> "Message":
+        if isinstance(item, Message):
+            return item
+        return cls(
+            item.get("role") or "user",
+            item.get("content") or "",
+            item.get("type") or "general",
+            _parse_timestamp(item.get("timestamp")) or time.time(),
+        )
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError("Message is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("Message is immutable")
+
+    @property
+    def timestamp(self) -> str:
+        if self.created is None or isinstance(self.created, str):
+            return self.created or ""
+        return datetime.fromtimestamp(self.created, timezone.utc).isoformat()
+
+    def __getitem__(self, key: str) -> object:
+        if key == "timestamp":
+            return self.timestamp
+        if key in _MESSAGE_KEYS:
+            return object.__getattribute__(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: object = None) -> object:
+        if key in _MESSAGE_KEYS:
+            return self[key]
+        return default
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_MESSAGE_KEYS)
+
+    def __len__(self) -> int:
+        return len(_MESSAGE_KEYS)
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content[:40]!r}, {self.type!r})"
+
+    def __reduce__(self):
+        return (Message, (self.role, self.content, self.type, self.created))
+
+    def __copy__(self) -> "Message":
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> "Message":
+        return self
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp, "type": self.type}
+
+
+def as_dicts(messages: List[Message]) -> List[Dict[str, str]]:
+    return [item.to_dict() for item in messages]
+
+
+class _Session:
+    __slots__ = (
+        "key",
+        "messages",
+        "spilled",
+        "base_version",
+        "lock",
+        "last_used",
+        "memory",
+        "memory_version",
+        "memory_pending",
+    )
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        # The opening HEAD_MESSAGES turns followed by the most recent ones;
+        # `spilled` messages in between live only in storage.
+        self.messages: List[Message] = []
+        self.spilled = 0
+        # Versions count appended messages. A reset starts a new range above
+        # every version handed out before it, so stale clients are detected.
+        self.base_version = 0
+        if state.backend.shared:
+            # Holding the lock excludes other workers too, and taking it
+            # first brings this copy up to date with the shared store.
+            self.lock = state.SharedLock(
+                state.backend.lock_path(f"session-{key}"),
+                on_acquire=lambda: _refresh(self),
+            )
+        else:
+            self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        # Summary of the middle turns up to (not including) memory_version.
+        self.memory = ""
+        self.memory_version = 0
+        # Wall-clock time of the outstanding memory claim, or 0.
+        self.memory_pending = 0.0
+
+    @property
+    def count(self) -> int:
+        return len(self.messages) + self.spilled
+
+    @property
+    def version(self) -> int:
+        return self.base_version + self.count
+
+    def reset(self, messages: List[Message]) -> None:
+        self.base_version = self.version + 1
+        self.messages = messages
+        self.spilled = 0
+        self.memory = ""
+        self.memory_version = 0
+        self.memory_pending = 0.0
+
+    def meta(self) -> Dict[str, object]:
+        return {
+            "base_version": self.base_version,
+            "count": self.count,
+            "memory": self.memory,
+            "memory_version": self.memory_version,
+            "memory_pending": self.memory_pending,
+        }
+
+
+_SESSIONS: Dict[str, _Session] = {}
+_SESSIONS_LOCK = threading.Lock()
+_last_shared_prune = 0.0
+_last_log_prune = 0.0
+
+
+def _storage():
+    # Where sessions are persisted: the shared backend, the session log, or
+    # nowhere (then nothing can be spilled).
+    return state.backend if state.backend.shared else session_log.log
+
+
+def _load_window(session: _Session, count: int) -> None:
+    storage = _storage()
+    start = count - SESSION_WINDOW
+    if not SESSION_WINDOW or start <= HEAD_MESSAGES + SPILL_BATCH:
+        session.messages = [Message.from_dict(item) for item in storage.read_messages(session.key)]
+        session.spilled = 0
+        return
+    head = storage.read_messages(session.key, 0, HEAD_MESSAGES)
+    session.messages = [Message.from_dict(item) for item in head + storage.read_messages(session.key, start)]
+    session.spilled = start - HEAD_MESSAGES
 
 
-def add_message(role: str, content: str, message_type: str = "general") -> None:
+def _spill(session: _Session) -> None:
+    # Runs after _save, so what is dropped here is already in storage.
+    if not SESSION_WINDOW or _storage() is None:
+        return
+    excess = len(session.messages) - HEAD_MESSAGES - SESSION_WINDOW
+    if excess < SPILL_BATCH:
+        return
+    del session.messages[HEAD_MESSAGES:HEAD_MESSAGES + excess]
+    session.spilled += excess
+
+
+def _slice(session: _Session, start: int, end: Optional[int] = None) -> List[Message]:
+    # Messages [start, end) of the session, reading the spilled middle back
+    # from storage only when the range reaches into it.
+    end = session.count if end is None else min(end, session.count)
+    start = max(0, start)
+    if start >= end:
+        return []
+    messages = session.messages
+    if not session.spilled:
+        return messages[start:end]
+    recent = HEAD_MESSAGES + session.spilled
+    result: List[Message] = messages[start:min(end, HEAD_MESSAGES)]
+    if start < recent and end > HEAD_MESSAGES:
+        result.extend(
+            Message.from_dict(item)
+            for item in _storage().read_messages(session.key, max(start, HEAD_MESSAGES), min(end, recent))
+        )
+    if end > recent:
+        result.extend(messages[max(start, recent) - session.spilled:end - session.spilled])
+    return result
+
+
+def _refresh(session: _Session) -> None:
+    # Another worker may have appended to or replaced this session since this
+    # process last held its lock; fetch only the messages it missed.
+    meta = state.backend.get("sessions", session.key)
+    if meta is None:
+        # The shared copy was pruned or lost: the log has what every worker
+        # wrote. Without one, restore it from this copy; spilled messages
+        # went with it, so the history restarts from what is still in memory.
+        if _restore(session):
+            return
+        if session.count or session.base_version:
+            if session.spilled:
+                session.reset(session.messages)
+            _save(session, 0)
+        return
+    count = meta["count"]
+    if meta["base_version"] != session.base_version or count < session.count:
+        _load_window(session, count)
+    elif count > session.count:
+        missed = state.backend.read_messages(session.key, session.count)
+        session.messages = session.messages + [Message.from_dict(item) for item in missed]
+        _spill(session)
+    session.base_version = meta["base_version"]
+    session.memory = meta["memory"]
+    session.memory_version = meta["memory_version"]
+    session.memory_pending = meta["memory_pending"]
+
+
+def _save(session: _Session, start: Optional[int] = None) -> None:
+    # Write-through to the shared backend and the session log: messages from
+    # `start` on (all of them when 0, none when None) plus the session
+    # metadata.
+    storage = _storage()
+    if storage is None:
+        return
+    messages = as_dicts(_slice(session, start)) if start is not None else []
+    storage.write_session(session.key, session.meta(), messages, start)
+    if session_log.log is not None and storage is not session_log.log:
+        session_log.log.write_session(session.key, session.meta(), messages, start)
+
+
+def _restore(session: _Session) -> bool:
+    # A session this process has not seen (e.g. after a restart), or one
+    # the shared store no longer has, picks up its history from the log.
+    if session_log.log is None:
+        return False
+    meta = session_log.log.meta(session.key)
+    if meta is None:
+        return False
+    if state.backend.shared:
+        # Seed the shared store first; the window below is read from it.
+        state.backend.write_session(session.key, meta, session_log.log.read_messages(session.key), 0)
+    _load_window(session, meta["count"])
+    session.base_version = meta["base_version"]
+    session.memory = meta["memory"]
+    session.memory_version = meta["memory_version"]
+    session.memory_pending = meta["memory_pending"]
+    return True
+
+
+def _prune_idle_sessions(now: float) -> None:
+    global _last_shared_prune, _last_log_prune
+    for key, session in list(_SESSIONS.items()):
+        if key != DEFAULT_SESSION and now - session.last_used > SESSION_IDLE_SECONDS:
+            del _SESSIONS[key]
+            if session_log.log is not None:
+                session_log.log.forget(key)
+    if session_log.log is not None and now - _last_log_prune > LOG_PRUNE_INTERVAL_SECONDS:
+        _last_log_prune = now
+        session_log.log.prune_sessions(keep=[DEFAULT_SESSION, *_SESSIONS])
+    if state.backend.shared and now - _last_shared_prune > SHARED_PRUNE_INTERVAL_SECONDS:
+        _last_shared_prune = now
+        state.backend.prune_sessions(SESSION_IDLE_SECONDS, keep=[DEFAULT_SESSION, *_SESSIONS])
+
+
+def _get_session(session_id: Optional[str] = None) -> _Session:
+    key = session_id or DEFAULT_SESSION
+    now = time.monotonic()
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            _prune_idle_sessions(now)
+            session = _SESSIONS[key] = _Session(key)
+            if not state.backend.shared:
+                _restore(session)
+        session.last_used = now
+    return session
+
+
+def session_lock(session_id: Optional[str] = None) -> threading.RLock:
+    return _get_session(session_id).lock
+
+
+def add_message(
+    role: str,
+    content: str,
+    message_type: str = "general",
+    session_id: Optional[str] = None,
+) -> None:
     role_normalized = role.lower()
     if role_normalized not in _VALID_ROLES:
         role_normalized = "user"
-    _HISTORY.append(
-        {
-            "role": role_normalized,
-            "content": content,
-            "timestamp": _now_iso(),
-            "type": message_type,
-        }
-    )
+    session = _get_session(session_id)
+    with session.lock:
+        session.messages.append(Message(role_normalized, content, message_type, time.time()))
+        _save(session, session.count - 1)
+        _spill(session)
+
+
+_CODE_BLOCK_RE = re.compile(r"```[\w]*\n[\s\S]*?```")
 
 
-def add_message_compressed(role: str, content: str, message_type: str = "general") -> None:
+def _code_block_stub(match: "re.Match[str]") -> str:
+    # Keep the language and first line (usually a file name or signature) so
+    # later turns and the project memory still know what was written.
+    header, _, body = match.group(0).partition("\n")
+    language = header.strip("`") or "code"
+    first_line = body.strip().split("\n", 1)[0][:80]
+    return f"[CODE BLOCK: {language} | {first_line}]"
+
+
+def add_message_compressed(
+    role: str,
+    content: str,
+    message_type: str = "general",
+    session_id: Optional[str] = None,
+) -> None:
     compressed_content = content
     if "```" in content and message_type == "code":
-        code_blocks = re.findall(r"```[\w]*\n[\s\S]*?```", content)
-        text_only = re.sub(r"```[\w]*\n[\s\S]*?```", "[CODE BLOCK]", content)
+        code_blocks = _CODE_BLOCK_RE.findall(content)
+        text_only = _CODE_BLOCK_RE.sub(_code_block_stub, content)
         total_lines = sum(len(block.split("\n")) for block in code_blocks)
         compressed_content = (
             f"{text_only}\n"
             f"[Code written: {len(code_blocks)} block(s), ~{total_lines} lines total]"
         )
-    add_message(role, compressed_content, message_type)
-
-
-def set_history(history: List[Dict[str, str]]) -> None:
-    _HISTORY.clear()
-    for item in history:
-        role = item.get("role", "user")
-        content = item.get("content", "")
-        message_type = item.get("type", "general")
-        timestamp = item.get("timestamp") or _now_iso()
-        _HISTORY.append(
-            {
-                "role": role,
-                "content": content,
-                "timestamp": timestamp,
-                "type": message_type,
-            }
+    add_message(role, compressed_content, message_type, session_id)
+
+
+def set_history(history: List[Dict[str, str]], session_id: Optional[str] = None) -> None:
+    messages = [Message.from_dict(item) for item in history]
+    session = _get_session(session_id)
+    with session.lock:
+        session.reset(messages)
+        _save(session, 0)
+        _spill(session)
+
+
+def clear_history(session_id: Optional[str] = None) -> None:
+    session = _get_session(session_id)
+    with session.lock:
+        session.reset([])
+        _save(session, 0)
+
+
+def history_version(session_id: Optional[str] = None) -> int:
+    session = _get_session(session_id)
+    with session.lock:
+        return session.version
+
+
+def apply_history_delta(
+    version: int,
+    delta: List[Dict[str, str]],
+    session_id: Optional[str] = None,
+) -> int:
+    session = _get_session(session_id)
+    with session.lock:
+        if version != session.version:
+            raise HistoryConflict(session.version)
+        start = session.count
+        session.messages.extend(Message.from_dict(item) for item in delta)
+        if delta:
+            _save(session, start)
+            _spill(session)
+        return session.version
+
+
+def get_history_since(
+    version: int,
+    session_id: Optional[str] = None,
+) -> Optional[List[Message]]:
+    session = _get_session(session_id)
+    with session.lock:
+        if not session.base_version <= version <= session.version:
+            return None
+        return _slice(session, version - session.base_version)
+
+
+def get_history(session_id: Optional[str] = None) -> List[Message]:
+    # Records are immutable, so a new list of the same records is as safe
+    # to hand out as a deep copy was.
+    session = _get_session(session_id)
+    with session.lock:
+        return _slice(session, 0)
+
+
+def get_history_page(
+    before: Optional[int],
+    limit: int,
+    session_id: Optional[str] = None,
+) -> Optional[Tuple[List[Message], int, bool]]:
+    # Up to `limit` messages ending just before version `before` (the newest
+    # ones when None), the version of the first one as the cursor for the
+    # page before it, and whether there is one. None when the cursor
+    # predates the current history.
+    session = _get_session(session_id)
+    with session.lock:
+        end = session.count if before is None else before - session.base_version
+        if not 0 <= end <= session.count:
+            return None
+        start = max(0, end - limit)
+        return _slice(session, start, end), session.base_version + start, start > 0
+
+
+def _memory_message(memory: str) -> Message:
+    return Message("architect", f"Project memory (summary of earlier turns):\n{memory}", MEMORY_TYPE)
+
+
+def context_history(session_id: Optional[str] = None) -> List[Message]:
+    # What the models see: the opening brief, the project memory standing in
+    # for the summarized middle, then every turn the memory does not cover.
+    # Without a memory, turns spilled out of the window are left out: the
+    # window already holds more than any model's context budget keeps.
+    session = _get_session(session_id)
+    with session.lock:
+        if not session.memory:
+            return list(session.messages)
+        covered = max(HEAD_MESSAGES, session.memory_version - session.base_version)
+        return session.messages[:HEAD_MESSAGES] + [_memory_message(session.memory)] + _slice(session, covered)
+
+
+def claim_memory_backlog(
+    keep_recent: int,
+    min_batch: int,
+    session_id: Optional[str] = None,
+) -> Optional[Tuple[str, List[Message], int, int]]:
+    session = _get_session(session_id)
+    with session.lock:
+        if session.memory_pending and time.time() - session.memory_pending < MEMORY_CLAIM_SECONDS:
+            return None
+        start = max(HEAD_MESSAGES, session.memory_version - session.base_version)
+        end = session.count - keep_recent
+        if end - start < min_batch:
+            return None
+        session.memory_pending = time.time()
+        _save(session)
+        return (
+            session.memory,
+            _slice(session, start, end),
+            session.base_version,
+            session.base_version + end,
         )
 
 
-def clear_history() -> None:
-    _HISTORY.clear()
-
-
-def get_history() -> List[Dict[str, str]]:
-    return deepcopy(_HISTORY)
-
-
-def get_last_n_messages(limit: int) -> List[Dict[str, str]]:
-    if limit <= 0:
-        return []
-    return deepcopy(_HISTORY[-limit:])
+def store_memory(
+    memory: Optional[str],
+    base_version: int,
+    memory_version: int,
+    session_id: Optional[str] = None,
+) -> bool:
+    session = _get_session(session_id)
+    with session.lock:
+        if session.base_version != base_version:
+            # The history was replaced while summarizing; the claim is void.
+            return False
+        if memory_version < session.memory_version:
+            # A stale claim finished after a newer summary was stored.
+            return False
+        session.memory_pending = 0.0
+        if memory:
+            session.memory = memory
+            session.memory_version = memory_version
+        _save(session)
+        return bool(memory)
+
+
+def memory_state(session_id: Optional[str] = None) -> Dict[str, object]:
+    session = _get_session(session_id)
+    with session.lock:
+        return {
+            "memory": session.memory,
+            "memory_version": session.memory_version,
+            "pending": bool(session.memory_pending),
+        }
 
 
-def _estimate_tokens(messages: List[Dict[str, str]]) -> int:
-    total_chars = sum(len(item.get("content", "")) for item in messages)
-    return total_chars // 4
+def _estimate_tokens(messages: List[Dict[str, str]], counter: Optional[TokenCounter] = None) -> int:
+    return (counter or get_counter()).count_messages(messages)
+
+
+def _fit_suffix(
+    messages: List[Dict[str, str]],
+    start: int,
+    budget: int,
+    counter: TokenCounter,
+) -> int:
+    # Walk the running total back from the newest message and stop at the
+    # first one that no longer fits, so only the kept window is ever counted.
+    used = 0
+    index = len(messages)
+    while index > start:
+        cost = counter.count_message(messages[index - 1])
+        if used + cost > budget:
+            break
+        used += cost
+        index -= 1
+    return index
+
+
+_TRUNCATED_MARKER = "\n[... truncated to fit the context window]"
+
+
+def _truncate(message: Mapping, max_tokens: int, counter: TokenCounter) -> Dict[str, str]:
+    # Keeps the longest start of the content that fits, found by bisection
+    # since token counts are not proportional to characters.
+    content = message.get("content") or ""
+    budget = max_tokens - counter.message_overhead
+    low, high = 0, len(content)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count_text(content[:middle] + _TRUNCATED_MARKER) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return {**message, "content": content[:low] + _TRUNCATED_MARKER}
 
 
 def get_trimmed_history(
     max_tokens: int = 4000,
     history: Optional[List[Dict[str, str]]] = None,
+    counter: Optional[TokenCounter] = None,
 ) -> List[Dict[str, str]]:
-    messages = history if history is not None else _HISTORY
+    messages = history if history is not None else get_history()
     if not messages:
         return []
 
-    first_messages = messages[:2]
-    last_messages = messages[-8:] if len(messages) > 2 else []
-
-    seen = set()
-    combined: List[Dict[str, str]] = []
-    for msg in first_messages + last_messages:
-        key = msg.get("content", "")[:50]
-        if key not in seen:
-            seen.add(key)
-            combined.append(msg)
-
-    if _estimate_tokens(combined) <= max_tokens:
-        return deepcopy(combined)
-
-    fallback = messages[:1] + messages[-5:] if len(messages) > 6 else list(messages)
-
-    while len(fallback) > 1 and _estimate_tokens(fallback) > max_tokens:
-        del fallback[1]
-
-    return deepcopy(fallback)
+    counter = counter or get_counter()
+    # The newest message is the one being answered, so it is always sent;
+    # only when it alone is over the budget is its content cut short.
+    *earlier, latest = messages
+    latest_tokens = counter.count_message(latest)
+    if latest_tokens > max_tokens:
+        return [_truncate(latest, max_tokens, counter)]
+    budget = max_tokens - latest_tokens
+    # The opening turns carry the project brief, followed by the project
+    # memory when there is one; keep them, then pack as much of the most
+    # recent conversation as what is left allows.
+    head = earlier[:HEAD_MESSAGES]
+    if len(earlier) > HEAD_MESSAGES and earlier[HEAD_MESSAGES].get("type") == MEMORY_TYPE:
+        head = earlier[: HEAD_MESSAGES + 1]
+    start = len(head)
+    head_tokens = counter.count_messages(head)
+    while len(head) > 1 and head_tokens > budget:
+        head_tokens -= counter.count_message(head.pop(1))
+    if head_tokens > budget:
+        head, head_tokens = [], 0
+    start = _fit_suffix(earlier, start, budget - head_tokens, counter)
+    return head + earlier[start:] + [latest]
 
 
 def get_trimmed_history_for_model(
     model_name: str,
     history: Optional[List[Dict[str, str]]] = None,
 ) -> List[Dict[str, str]]:
-    limit = MODEL_TOKEN_LIMITS.get((model_name or "").lower(), 6000)
-    return get_trimmed_history(max_tokens=limit, history=history)
+    provider = (model_name or "").lower()
+    limit = MODEL_TOKEN_LIMITS.get(provider, 6000)
+    return get_trimmed_history(max_tokens=limit, history=history, counter=get_counter(provider))
 
 
 def format_for_gemini(history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, object]]:
-    messages = history if history is not None else _HISTORY
+    messages = history if history is not None else get_history()
     formatted: List[Dict[str, object]] = []
     for item in messages:
         role = "user" if item.get("role") == "user" else "model"
@@ -136,7 +645,7 @@ def format_for_gemini(history: Optional[List[Dict[str, str]]] = None) -> List[Di
 
 
 def format_for_groq(history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
-    messages = history if history is not None else _HISTORY
+    messages = history if history is not None else get_history()
     formatted: List[Dict[str, str]] = []
     for item in messages:
         role = item.get("role", "user")
@@ -0,0 +1,129 @@
+import re
+from typing import Dict, List, Sequence
+
+# Same task lines the frontend lists: "Task 1: ...", "**Task 2:** ...".
+_TASK_LINE_RE = re.compile(r"^\s*\**\s*task\s*\d+\s*:\**\s*", re.IGNORECASE)
+AWAITING_DECISION_MARKER = "AWAITING USER DECISION"
+
+# "(depends on 1, 2)", "after Task 3", "requires tasks 1 and 4".
+_DEPENDS_RE = re.compile(
+    r"\b(?:depends\s+on|after|requires|needs|builds\s+on)\s+"
+    r"((?:tasks?\s*#?\s*)?\d+(?:\s*(?:,|and|&)\s*(?:tasks?\s*#?\s*)?\d+)*)",
+    re.IGNORECASE,
+)
+_TASK_REF_RE = re.compile(r"\btask\s*#?\s*(\d+)", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\d+")
+
+# Without explicit references, tasks are ordered by the part of the page they
+# touch: one after the latest earlier task on the same part, and everything
+# after the latest markup task, since styles and scripts target its elements.
+_AREA_KEYWORDS = {
+    "markup": ("html", "markup", "structure", "layout", "skeleton"),
+    "style": (
+        "css", "style", "styling", "color", "colour", "font", "theme", "animation",
+        "animate", "responsive", "design", "look", "hover", "dark mode",
+    ),
+    "script": (
+        "javascript", "js", "logic", "function", "event", "click", "score", "state",
+        "calculate", "validate", "validation", "storage", "timer", "interactiv", "game loop",
+        "fetch", "handler", "keyboard", "update",
+    ),
+}
+# Page elements mean markup work only when the task is not styling or
+# scripting them ("add a footer" vs "style the header").
+_ELEMENT_KEYWORDS = (
+    "page", "section", "element", "form", "button", "canvas", "header", "footer", "navbar",
+    "menu", "modal", "table", "list", "container", "input",
+)
+# Tasks like these touch everything built so far, so they wait for all of it.
+_BARRIER_KEYWORDS = (
+    "integrate", "integration", "connect", "combine", "wire", "hook up", "test", "polish",
+    "final", "refactor", "review", "fix", "bug", "cleanup", "clean up", "optimi",
+)
+
+
+def parse_tasks(plan: str) -> List[str]:
+    return [
+        _TASK_LINE_RE.sub("", line).strip()
+        for line in (plan or "").split("\n")
+        if _TASK_LINE_RE.match(line.strip())
+    ]
+
+
+def _contains(text: str, keyword: str) -> bool:
+    return re.search(rf"\b{re.escape(keyword)}", text) is not None
+
+
+def _areas(title: str) -> List[str]:
+    text = title.lower()
+    areas = [area for area, keywords in _AREA_KEYWORDS.items() if any(_contains(text, word) for word in keywords)]
+    if not areas and any(_contains(text, word) for word in _ELEMENT_KEYWORDS):
+        areas = ["markup"]
+    return areas
+
+
+def _explicit_dependencies(title: str, index: int) -> List[int]:
+    numbers = set()
+    for match in _DEPENDS_RE.finditer(title):
+        numbers.update(int(number) for number in _NUMBER_RE.findall(match.group(1)))
+    numbers.update(int(number) for number in _TASK_REF_RE.findall(title))
+    # Plans number tasks from 1; only earlier tasks count, so there are no cycles.
+    return sorted(number - 1 for number in numbers if 0 < number <= index)
+
+
+def _inferred_dependencies(titles: Sequence[str], index: int) -> List[int]:
+    if index == 0:
+        return []
+    title = titles[index].lower()
+    areas = _areas(titles[index])
+    if not areas or any(_contains(title, word) for word in _BARRIER_KEYWORDS):
+        return list(range(index))
+    latest: Dict[str, int] = {}
+    for earlier in range(index):
+        for area in _areas(titles[earlier]) or _AREA_KEYWORDS:
+            latest[area] = earlier
+    wanted = set(areas) | {"markup"}
+    return sorted({latest[area] for area in wanted if area in latest})
+
+
+def parse_task_graph(plan: str) -> List[Dict]:
+    titles = parse_tasks(plan)
+    return [
+        {
+            "title": title,
+            "depends_on": _explicit_dependencies(title, index) or _inferred_dependencies(titles, index),
+        }
+        for index, title in enumerate(titles)
+    ]
+
+
+def task_instruction(title: str, index: int) -> str:
+    return title.strip() or f"Implement task {index + 1} from the approved plan."
+
+
+def parallel_task_instruction(title: str, index: int, siblings: Sequence[str]) -> str:
+    # Tasks built side by side each see the page as it was before the batch,
+    # so they return only their own part and the job merges the parts.
+    others = "; ".join(siblings)
+    return (
+        f"{task_instruction(title, index)}\n\n"
+        f"Other tasks are being built at the same time ({others}). Return only the code "
+        "this task adds or changes: new markup as an HTML fragment, and CSS and JavaScript "
+        "in their own code blocks. Do not repeat the rest of the page."
+    )
+
+
+def review_message(builder_response: str, index: int) -> str:
+    return builder_response.strip() or f"Task {index + 1} completed. Review output and provide the next task."
+
+
+def batch_review_message(items: Sequence[Dict]) -> str:
+    # items: [{"index", "title", "response"}] for tasks built in the same batch.
+    if len(items) == 1:
+        return review_message(items[0]["response"], items[0]["index"])
+    numbers = ", ".join(str(item["index"] + 1) for item in items)
+    parts = [f"Tasks {numbers} were built in parallel. Review them together."]
+    for item in items:
+        response = item["response"].strip() or "(no output)"
+        parts.append(f"Task {item['index'] + 1}: {item['title']}\n{response}")
+    return "\n\n".join(parts)
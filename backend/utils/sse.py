@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import json
+from typing import AsyncIterator, Dict
+
+
+def format_sse(event: str, data: Dict, event_id: int | None = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def aiter_sse_data(response) -> AsyncIterator[str]:
+    async for raw_line in response.aiter_lines():
+        if not raw_line or raw_line.startswith(":"):
+            continue
+        if raw_line.startswith("data:"):
+            yield raw_line[5:].strip()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # optional: exact counts for OpenAI-style tokenizers
+    tiktoken = None
+
+COUNT_CACHE_SIZE = int(os.getenv("KURAL_TOKEN_CACHE_SIZE", "8192"))
+# Role markers and separators every chat API wraps around a message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Words, numbers, runs of punctuation and indentation all tend to become
+# separate tokens, which is why chars // 4 undercounts code badly.
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d+|\n[ \t]*|[^\w\s]+|[^\x00-\x7f]")
+
+
+def _heuristic_count(text: str) -> int:
+    total = 0
+    for match in _PIECE_RE.finditer(text):
+        piece = match.group()
+        first = piece[0]
+        if first.isalpha() and first.isascii():
+            total += math.ceil(len(piece) / 4)
+        elif first.isdigit():
+            total += math.ceil(len(piece) / 3)
+        elif first == "\n":
+            total += 1 + len(piece) // 8
+        elif first.isascii():
+            total += math.ceil(len(piece) / 2)
+        else:
+            total += 1
+    return total
+
+
+def _tiktoken_counter(encoding_name: str) -> Callable[[str], int] | None:
+    if tiktoken is None:
+        return None
+    try:
+        encoding = tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class TokenCounter:
+    def __init__(
+        self,
+        name: str,
+        count: Callable[[str], int],
+        message_overhead: int = MESSAGE_OVERHEAD_TOKENS,
+        scale: float = 1.0,
+    ) -> None:
+        self.name = name
+        self._count = count
+        self.message_overhead = message_overhead
+        # Lets one base tokenizer approximate a vendor whose tokens run larger or smaller.
+        self.scale = scale
+
+    def count_text(self, text: str) -> int:
+        return math.ceil(self._count(text) * self.scale)
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        content = message.get("content", "")
+        key = (self.name, content)
+        with _CACHE_LOCK:
+            cached = _COUNT_CACHE.get(key)
+            if cached is not None:
+                _COUNT_CACHE.move_to_end(key)
+                return cached
+        count = self.count_text(content) + self.message_overhead
+        with _CACHE_LOCK:
+            _COUNT_CACHE[key] = count
+            while len(_COUNT_CACHE) > COUNT_CACHE_SIZE:
+                _COUNT_CACHE.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count_message(item) for item in messages)
+
+
+# Stored messages are immutable, so a count computed once is reused by every
+# later trim of the same session. Python caches str hashes, so lookups for
+# the same content object do not rehash it.
+_COUNT_CACHE: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+HEURISTIC = TokenCounter("heuristic", _heuristic_count)
+_COUNTERS: Dict[str, TokenCounter] = {}
+
+
+def register_counter(provider: str, counter: TokenCounter) -> None:
+    _COUNTERS[provider.lower()] = counter
+
+
+def get_counter(provider: str | None = None) -> TokenCounter:
+    return _COUNTERS.get((provider or "").lower(), HEURISTIC)
+
+
+def count_tokens(text: str, provider: str | None = None) -> int:
+    return get_counter(provider).count_text(text)
+
+
+def _register_defaults() -> None:
+    cl100k = _tiktoken_counter("cl100k_base")
+    base = cl100k or _heuristic_count
+    prefix = "cl100k" if cl100k is not None else "heuristic"
+    if cl100k is not None:
+        openai_style = TokenCounter("cl100k", cl100k)
+        register_counter("openrouter", openai_style)
+        register_counter("mistral", openai_style)
+        register_counter("claude", TokenCounter("cl100k-claude", cl100k, scale=1.1))
+    # Groq history is sent with a "[ROLE | type] " prefix on assistant turns.
+    register_counter("groq", TokenCounter(f"{prefix}-groq", base, MESSAGE_OVERHEAD_TOKENS + 6))
+
+
+_register_defaults()
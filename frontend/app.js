@@ -5,10 +5,14 @@ const state = {
   isAutoMode: false,
   isPaused: false,
   conversationHistory: [],
+  historyVersion: null,
   taskList: [],
   currentTaskIndex: 0,
   sessionHealth: { architectAccuracy: 1, builderSuccess: 1 },
   isWaitingForApproval: false,
+  jobId: sessionStorage.getItem("kuralJobId"),
+  jobStatus: null,
+  jobSeq: 0,
 };
 
 const API_BASE = (() => {
@@ -29,6 +33,16 @@ const API_BASE = (() => {
   return `${protocol}//${hostname}:5000`;
 })();
 
+const SESSION_ID = (() => {
+  const existing = sessionStorage.getItem("kuralSessionId");
+  if (existing) return existing;
+  const created = window.crypto?.randomUUID
+    ? window.crypto.randomUUID().replace(/-/g, "")
+    : `${Date.now().toString(16)}${Math.random().toString(16).slice(2)}`;
+  sessionStorage.setItem("kuralSessionId", created);
+  return created;
+})();
+
 const elements = {
   architectChat: document.getElementById("architect-chat"),
   builderChat: document.getElementById("builder-chat"),
@@ -253,16 +267,6 @@ function updatePreview(code) {
   preview.srcdoc = code;
 }
 
-function extractCodeBlocks(text) {
-  const regex = /```(\w+)?\n([\s\S]*?)```/g;
-  const blocks = [];
-  let match;
-  while ((match = regex.exec(text)) !== null) {
-    blocks.push({ language: match[1] || "", code: match[2] });
-  }
-  return blocks;
-}
-
 function selectBestCodeBlock(blocks) {
   const htmlBlock = blocks.find((block) => (block.language || "").toLowerCase() === "html");
   if (htmlBlock) {
@@ -325,68 +329,264 @@ function composePreviewDocument(blocks) {
   return html;
 }
 
-async function callApi(path, payload) {
+async function callApi(path, payload, method = "POST") {
   try {
     const response = await fetch(`${API_BASE}${path}`, {
-      method: "POST",
+      method,
       credentials: "include",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(payload),
+      headers: { "Content-Type": "application/json", "X-Kural-Session": SESSION_ID },
+      body: method === "GET" ? undefined : JSON.stringify(payload),
     });
     if (!response.ok) {
       const rawBody = await response.text();
       let message = `Request failed (${response.status})`;
+      let code = "";
       try {
         const parsed = JSON.parse(rawBody);
         message = parsed.error || message;
+        code = parsed.code || "";
       } catch (_parseError) {
         if (response.status === 401 || response.status === 403) {
           message = "Codespaces auth required for backend port. Open the 5000 port URL in your browser and allow access.";
         }
       }
-      throw new Error(message);
+      const requestError = new Error(message);
+      requestError.code = code;
+      throw requestError;
     }
     return response.json();
+  } catch (error) {
+    const message = error instanceof Error ? error.message : "Unknown request error";
+    const wrapped = new Error(`Backend request failed at ${API_BASE || "current host"}: ${message}`);
+    wrapped.code = error?.code || "";
+    throw wrapped;
+  }
+}
+
+function historyPayload() {
+  if (state.historyVersion === null) {
+    return { history: state.conversationHistory };
+  }
+  return { history_version: state.historyVersion };
+}
+
+function applyHistoryUpdate(data) {
+  if (Array.isArray(data.history)) {
+    state.conversationHistory = data.history;
+  } else if (Array.isArray(data.history_delta)) {
+    state.conversationHistory = state.conversationHistory.concat(data.history_delta);
+  }
+  state.historyVersion = typeof data.history_version === "number" ? data.history_version : null;
+}
+
+function resetHistory() {
+  state.conversationHistory = [];
+  state.historyVersion = null;
+}
+
+async function refreshHistory() {
+  const since = state.historyVersion === null ? "" : `?since=${state.historyVersion}`;
+  applyHistoryUpdate(await callApi(`/api/history${since}`, undefined, "GET"));
+}
+
+async function withHistorySync(send) {
+  try {
+    return await send(historyPayload());
+  } catch (error) {
+    if (error.code !== "history_conflict") throw error;
+    // The server lost or replaced this session's history; resend it in full.
+    state.historyVersion = null;
+    return send(historyPayload());
+  }
+}
+
+function parseSseEvent(rawEvent) {
+  let event = "message";
+  let id = null;
+  const dataLines = [];
+  rawEvent.split("\n").forEach((line) => {
+    if (line.startsWith("event:")) event = line.slice(6).trim();
+    if (line.startsWith("id:")) id = line.slice(3).trim();
+    if (line.startsWith("data:")) dataLines.push(line.slice(5).trimStart());
+  });
+  if (!dataLines.length) return null;
+  return { event, id, data: JSON.parse(dataLines.join("\n")) };
+}
+
+async function openEventStream(path, options = {}) {
+  let response;
+  try {
+    response = await fetch(`${API_BASE}${path}`, {
+      method: "GET",
+      credentials: "include",
+      ...options,
+      headers: {
+        Accept: "text/event-stream",
+        "X-Kural-Session": SESSION_ID,
+        ...options.headers,
+      },
+    });
   } catch (error) {
     const message = error instanceof Error ? error.message : "Unknown request error";
     throw new Error(`Backend request failed at ${API_BASE || "current host"}: ${message}`);
   }
+  if (!response.ok || !response.body) {
+    const rawBody = await response.text();
+    let message = `Request failed (${response.status})`;
+    let code = "";
+    try {
+      const parsed = JSON.parse(rawBody);
+      message = parsed.error || message;
+      code = parsed.code || "";
+    } catch (_parseError) {
+      // Non-JSON error body; keep the status message.
+    }
+    const requestError = new Error(`Backend request failed at ${API_BASE || "current host"}: ${message}`);
+    requestError.code = code;
+    throw requestError;
+  }
+  return response;
 }
 
-async function callArchitect(message) {
-  const safeMessage = (message || "").trim();
-  if (!safeMessage) {
-    throw new Error("Architect message is empty.");
+async function* readSseEvents(response) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf("\n\n");
+    while (boundary !== -1) {
+      const parsed = parseSseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf("\n\n");
+      if (parsed) yield parsed;
+    }
   }
-  setStatus("architect", "Thinking...");
-  const data = await callApi("/api/architect", {
-    message: safeMessage,
-    history: state.conversationHistory,
+}
+
+async function callApiStream(path, payload, onToken) {
+  const response = await openEventStream(path, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
   });
-  state.conversationHistory = data.history;
-  const modelName = data.model_used || "gemini";
-  elements.architectStatus.textContent = data.fallback_used ? `Auto: ${modelName}` : modelName;
-  if (data.fallback_used) showToast(`Architect switched to ${modelName} automatically`);
-  setStatus("architect", "Idle");
-  return data.response;
+  for await (const parsed of readSseEvents(response)) {
+    if (parsed.event === "token") onToken(parsed.data.text, parsed.data.model);
+    if (parsed.event === "error") throw new Error(parsed.data.error || "Stream failed");
+    if (parsed.event === "done") return parsed.data;
+  }
+  throw new Error("Stream ended before the response was complete.");
 }
 
-async function callBuilder(message) {
+function createStreamingMessage(container, type) {
+  let wrapper = null;
+  let message = null;
+  return {
+    append(text) {
+      if (!wrapper) {
+        wrapper = document.createElement("div");
+        wrapper.className = `message-wrapper ${type} streaming`;
+        const label = document.createElement("div");
+        label.className = "message-label";
+        label.textContent = MESSAGE_LABELS[type] || type.toUpperCase();
+        message = document.createElement("div");
+        message.className = `message ${type}`;
+        wrapper.appendChild(label);
+        wrapper.appendChild(message);
+        container.appendChild(wrapper);
+      }
+      message.textContent += text;
+      container.scrollTop = container.scrollHeight;
+    },
+    remove() {
+      wrapper?.remove();
+    },
+  };
+}
+
+function usageSummary(data) {
+  const usage = data.usage || {};
+  const parts = [];
+  if (usage.cached_tokens) parts.push(`${usage.cached_tokens} cached tok`);
+  if (typeof data.first_token_ms === "number") parts.push(`${data.first_token_ms} ms to first token`);
+  return parts.length ? ` · ${parts.join(" · ")}` : "";
+}
+
+function usageTitle(data) {
+  const usage = data.usage || {};
+  if (!usage.input_tokens) return "";
+  return (
+    `Prompt ${usage.input_tokens} tokens (${usage.cached_tokens || 0} from provider cache, ` +
+    `${usage.cache_write_tokens || 0} written), output ${usage.output_tokens || 0} tokens`
+  );
+}
+
+const QUOTA_LOW_HEADROOM = 0.2;
+
+function quotaTitle(budget) {
+  const parts = Object.entries(budget.limits).map(
+    ([name, values]) => `${values.remaining}/${values.limit} ${name.toUpperCase()}`
+  );
+  if (!parts.length) return "No rate limits known";
+  if (budget.wait_seconds) parts.push(`next request waits ${budget.wait_seconds}s`);
+  return `Quota left: ${parts.join(", ")}`;
+}
+
+async function refreshQuota() {
+  try {
+    const { providers } = await callApi("/api/providers/quota", undefined, "GET");
+    [elements.architectModel, elements.builderModel].forEach((select) => {
+      Array.from(select.options).forEach((option) => {
+        option.title = providers[option.value] ? quotaTitle(providers[option.value]) : "";
+      });
+      const current = providers[select.value];
+      select.title = current ? quotaTitle(current) : "";
+      select.classList.toggle("quota-low", Boolean(current) && current.headroom < QUOTA_LOW_HEADROOM);
+    });
+  } catch (_error) {
+    // Headroom is informational; the router enforces the budgets itself.
+  }
+}
+
+function showAgentResult(panel, data, defaultModel) {
+  const target = panel === "architect" ? elements.architectStatus : elements.builderStatus;
+  const label = panel === "architect" ? "Architect" : "Builder";
+  const modelName = data.model_used || defaultModel;
+  target.textContent = data.fallback_used ? `Auto: ${modelName}` : modelName;
+  target.title = usageTitle(data);
+  if (data.fallback_used) showToast(`${label} switched to ${modelName} automatically`);
+  if (data.cached) showToast(`${label} answer reused from cache (${modelName})`);
+  setStatus(panel, `Idle${usageSummary(data)}`);
+  refreshQuota();
+}
+
+async function callArchitect(message) {
   const safeMessage = (message || "").trim();
   if (!safeMessage) {
-    throw new Error("Builder task instruction is empty.");
+    throw new Error("Architect message is empty.");
   }
-  setStatus("builder", "Thinking...");
-  const data = await callApi("/api/builder", {
-    message: safeMessage,
-    history: state.conversationHistory,
-  });
-  state.conversationHistory = data.history;
-  const modelName = data.model_used || "openrouter";
-  elements.builderStatus.textContent = data.fallback_used ? `Auto: ${modelName}` : modelName;
-  if (data.fallback_used) showToast(`Builder switched to ${modelName} automatically`);
-  setStatus("builder", "Idle");
-  return data;
+  setStatus("architect", "Thinking...");
+  const draft = createStreamingMessage(elements.architectChat, "architect");
+  let data;
+  try {
+    data = await withHistorySync((historyFields) =>
+      callApiStream(
+        "/api/architect/stream",
+        { message: safeMessage, ...historyFields },
+        (text) => {
+          setStatus("architect", "Streaming...");
+          draft.append(text);
+        }
+      )
+    );
+  } finally {
+    draft.remove();
+  }
+  applyHistoryUpdate(data);
+  showAgentResult("architect", data, "gemini");
+  return data.response;
 }
 
 async function startProject(idea) {
@@ -394,7 +594,7 @@ async function startProject(idea) {
   elements.projectName.textContent = idea;
   state.isPaused = false;
   state.currentTaskIndex = 0;
-  state.conversationHistory = [];
+  resetHistory();
   elements.architectChat.innerHTML = "";
   elements.builderChat.innerHTML = "";
   addMessage(elements.architectChat, idea, "user");
@@ -411,6 +611,105 @@ async function startProject(idea) {
   updateFlowStatus("awaiting_approval");
 }
 
+function trackJob(job) {
+  state.jobId = job.id;
+  state.jobStatus = job.status;
+  sessionStorage.setItem("kuralJobId", job.id);
+}
+
+function forgetJob() {
+  state.jobId = null;
+  state.jobStatus = null;
+  state.jobSeq = 0;
+  sessionStorage.removeItem("kuralJobId");
+}
+
+function applyJobStatus(data) {
+  state.jobStatus = data.status;
+  state.isPaused = data.status === "paused";
+  elements.pauseBtn.classList.toggle("active", state.isPaused);
+  if (data.status === "paused") {
+    showToast(`Paused before task ${data.current_task + 1}. Press pause again to resume.`);
+  } else if (data.status === "failed") {
+    updateFlowStatus("error");
+    showToast(`${data.error || "Task run failed"}. Press pause to retry from this step.`, true);
+  } else if (data.status === "cancelled") {
+    forgetJob();
+    showToast("Task run cancelled.");
+  } else if (data.status === "awaiting_user_decision") {
+    forgetJob();
+    updateFlowStatus("awaiting_user_decision");
+    showProjectDecisionPanel();
+  } else if (data.status === "awaiting_approval") {
+    forgetJob();
+    elements.planEditor.value = data.next_plan || elements.planEditor.value;
+    toggleModal(true);
+    updateFlowStatus("awaiting_approval");
+  }
+}
+
+function handleJobEvent(parsed, drafts, liveBlocks) {
+  const { event, data } = parsed;
+  if (event === "token") {
+    // Tasks of one batch stream side by side, each into its own draft.
+    const key = `${data.panel}:${data.index}`;
+    const container = data.panel === "architect" ? elements.architectChat : elements.builderChat;
+    drafts[key] = drafts[key] || createStreamingMessage(container, data.panel);
+    setStatus(data.panel, "Streaming...");
+    drafts[key].append(data.text);
+  } else if (event === "block") {
+    liveBlocks[data.index] = (liveBlocks[data.index] || []).concat(data);
+    showCodeBlocks(liveBlocks[data.index]);
+  } else if (event === "task") {
+    updateTaskStatus(data.index, data.status);
+    if (data.status === "in-progress") {
+      state.currentTaskIndex = data.index;
+      updateFlowStatus("builder_working", `Task ${data.index + 1} of ${data.total}`);
+      setStatus("builder", "Thinking...");
+    }
+  } else if (event === "builder") {
+    drafts[`builder:${data.index}`]?.remove();
+    delete drafts[`builder:${data.index}`];
+    updateFlowStatus("builder_done", `Task ${data.index + 1} complete`);
+    addMessage(elements.builderChat, data.response, "builder");
+    updateMessageCount();
+    handleBuilderResponse(data);
+    showAgentResult("builder", data, "openrouter");
+  } else if (event === "document") {
+    // All tasks built so far, merged into one page.
+    updatePreview(data.html);
+    updateFlowStatus("architect_reviewing");
+    setStatus("architect", "Thinking...");
+  } else if (event === "review") {
+    drafts[`architect:${data.index}`]?.remove();
+    delete drafts[`architect:${data.index}`];
+    addMessage(elements.architectChat, data.response, "architect");
+    updateMessageCount();
+    showAgentResult("architect", data, "gemini");
+    elements.planEditor.value = data.response;
+  } else if (event === "status") {
+    applyJobStatus(data);
+  }
+}
+
+async function followJob() {
+  // The job runs on the server; this only mirrors its progress, so a reload
+  // or a dropped connection picks up again from the last event seen.
+  const jobId = state.jobId;
+  const drafts = {};
+  const liveBlocks = {};
+  try {
+    const response = await openEventStream(`/api/jobs/${jobId}/events?after=${state.jobSeq}`);
+    for await (const parsed of readSseEvents(response)) {
+      if (parsed.id) state.jobSeq = Number(parsed.id);
+      handleJobEvent(parsed, drafts, liveBlocks);
+    }
+  } finally {
+    Object.values(drafts).forEach((draft) => draft.remove());
+  }
+  await refreshHistory();
+}
+
 async function runTaskLoop(approvedPlan) {
   toggleModal(false);
   hideProjectDecisionPanel();
@@ -419,75 +718,50 @@ async function runTaskLoop(approvedPlan) {
   updateTaskList(approvedPlan);
   state.currentTaskIndex = 0;
 
-  async function runNextTask(index) {
-    if (state.isPaused) return;
-    if (index >= state.taskList.length) {
-      updateFlowStatus("awaiting_user_decision");
-      showProjectDecisionPanel();
-      return;
-    }
-
-    updateTaskStatus(index, "in-progress");
-    const taskInstruction = (state.taskList[index].title || "").trim()
-      || `Implement task ${index + 1} from the approved plan.`;
-
-    try {
-      updateFlowStatus("builder_working", `Task ${index + 1} of ${state.taskList.length}`);
-      const builderResponse = await callBuilder(taskInstruction);
-      updateFlowStatus("builder_done", `Task ${index + 1} complete`);
-      addMessage(elements.builderChat, builderResponse.response, "builder");
-      updateMessageCount();
-      handleBuilderResponse(builderResponse);
-      updateTaskStatus(index, "completed");
-      state.currentTaskIndex = index + 1;
-
-      updateFlowStatus("architect_reviewing");
-      const architectReviewInput = (builderResponse.response || "").trim()
-        || `Task ${index + 1} completed. Review output and provide the next task.`;
-      const nextPlan = await callArchitect(architectReviewInput);
-      addMessage(elements.architectChat, nextPlan, "architect");
-      updateMessageCount();
-
-      if (nextPlan.includes("AWAITING USER DECISION")) {
-        updateFlowStatus("awaiting_user_decision");
-        showProjectDecisionPanel();
-        return;
-      }
-
-      if (state.currentTaskIndex >= state.taskList.length) {
-        elements.planEditor.value = nextPlan;
-        toggleModal(true);
-        updateFlowStatus("awaiting_approval");
-        return;
-      }
+  const data = await withHistorySync((historyFields) =>
+    callApi("/api/jobs", { plan: approvedPlan, auto: state.isAutoMode, ...historyFields })
+  );
+  state.jobSeq = 0;
+  trackJob(data.job);
+  await followJob();
+}
 
-      if (state.isAutoMode) {
-        elements.planEditor.value = nextPlan;
-        await runNextTask(index + 1);
-      } else {
-        elements.planEditor.value = nextPlan;
-        toggleModal(true);
-        updateFlowStatus("awaiting_approval");
-      }
-    } catch (error) {
-      updateFlowStatus("error");
-      showToast(error.message, true);
-    }
+async function restoreJob() {
+  if (!state.jobId) return;
+  try {
+    const { job } = await callApi(`/api/jobs/${state.jobId}`, undefined, "GET");
+    trackJob(job);
+    state.taskList = job.tasks.map((task) => ({ ...task }));
+    renderTaskList();
+    state.jobSeq = 0;
+    showToast("Reconnected to the running task loop.");
+    await followJob();
+  } catch (error) {
+    forgetJob();
+    showToast(error.message, true);
   }
-
-  await runNextTask(0);
 }
 
-function handleBuilderResponse(builderData) {
-  const blocks = builderData.codeBlocks?.length
-    ? builderData.codeBlocks
-    : extractCodeBlocks(builderData.response);
-  if (!blocks.length) {
-    updateEditor("plaintext", builderData.response?.trim() || "No code output received.");
-    showToast("Builder returned no fenced code block; showing raw output in editor.");
+async function togglePause() {
+  if (!state.jobId) {
+    state.isPaused = !state.isPaused;
+    elements.pauseBtn.classList.toggle("active", state.isPaused);
     return;
   }
+  if (state.jobStatus === "paused" || state.jobStatus === "failed") {
+    const data = await callApi(`/api/jobs/${state.jobId}/resume`, {});
+    trackJob(data.job);
+    state.isPaused = false;
+    elements.pauseBtn.classList.remove("active");
+    await followJob();
+    return;
+  }
+  await callApi(`/api/jobs/${state.jobId}/pause`, {});
+  elements.pauseBtn.classList.add("active");
+  showToast("Pausing after the current step...");
+}
 
+function showCodeBlocks(blocks) {
   const selected = selectBestCodeBlock(blocks);
   const language = detectLanguage(selected.code, selected.language);
   updateEditor(language, selected.code.trim());
@@ -496,8 +770,23 @@ function handleBuilderResponse(builderData) {
   if (previewDoc) {
     updatePreview(previewDoc);
   }
+  return language;
+}
 
-  if (blocks.length > 1) {
+function handleBuilderResponse(builderData) {
+  // The server extracts the blocks while the answer streams.
+  const blocks = builderData.codeBlocks || [];
+  if (!blocks.length) {
+    updateEditor("plaintext", builderData.response?.trim() || "No code output received.");
+    showToast("Builder returned no fenced code block; showing raw output in editor.");
+    return;
+  }
+
+  const language = showCodeBlocks(blocks);
+
+  if (blocks[blocks.length - 1].partial) {
+    showToast("Builder output was cut off; the last code block is incomplete.", true);
+  } else if (blocks.length > 1) {
     showToast(`Applied ${blocks.length} code blocks. Editor showing ${language}.`);
   }
 }
@@ -511,12 +800,10 @@ function toggleAutoMode() {
 async function handleUserIntervention(panel, message) {
   addMessage(panel === "architect" ? elements.architectChat : elements.builderChat, message, "user");
   updateMessageCount();
-  const data = await callApi("/api/user-intervention", {
-    panel,
-    message,
-    history: state.conversationHistory,
-  });
-  state.conversationHistory = data.history;
+  const data = await withHistorySync((historyFields) =>
+    callApi("/api/user-intervention", { panel, message, ...historyFields })
+  );
+  applyHistoryUpdate(data);
   if (data.model_used) {
     const modelLabel = document.querySelector(`#${panel}-model option[value="${data.model_used}"]`);
     const modelName = modelLabel ? modelLabel.textContent : data.model_used;
@@ -563,9 +850,13 @@ elements.startBtn.addEventListener("click", async () => {
   }
 });
 
-elements.pauseBtn.addEventListener("click", () => {
-  state.isPaused = !state.isPaused;
-  elements.pauseBtn.classList.toggle("active", state.isPaused);
+elements.pauseBtn.addEventListener("click", async () => {
+  try {
+    await togglePause();
+  } catch (error) {
+    updateFlowStatus("error");
+    showToast(error.message, true);
+  }
 });
 
 elements.autoBtn.addEventListener("click", () => {
@@ -631,16 +922,22 @@ elements.architectModel.addEventListener("change", async (event) => {
   state.architectModel = event.target.value;
   await callApi("/api/switch-model", { panel: "architect", model: state.architectModel });
   showToast(`Architect model: ${state.architectModel}`);
+  refreshQuota();
 });
 
 elements.builderModel.addEventListener("change", async (event) => {
   state.builderModel = event.target.value;
   await callApi("/api/switch-model", { panel: "builder", model: state.builderModel });
   showToast(`Builder model: ${state.builderModel}`);
+  refreshQuota();
 });
 
 elements.newProjectBtn?.addEventListener("click", () => {
-  state.conversationHistory = [];
+  if (state.jobId) {
+    callApi(`/api/jobs/${state.jobId}/cancel`, {}).catch(() => {});
+    forgetJob();
+  }
+  resetHistory();
   elements.architectChat.innerHTML = "";
   elements.builderChat.innerHTML = "";
   elements.taskList.innerHTML = "";
@@ -702,3 +999,6 @@ elements.saveSessionBtn?.addEventListener("click", () => {
 
 calculateSessionHealth();
 updateFlowStatus("ready", "Enter your project idea below");
+refreshQuota();
+setInterval(refreshQuota, 30000);
+restoreJob();
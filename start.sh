@@ -3,5 +3,14 @@ set -e
 
 echo "Starting Kural IDE..."
 ROOT_DIR="$(cd "$(dirname "$0")" && pwd)"
+PORT="${FLASK_PORT:-5000}"
+
+if [ "${1:-${KURAL_MODE:-dev}}" = "production" ]; then
+  # Multi-worker gunicorn; exec so SIGTERM reaches it for a graceful shutdown.
+  cd "$ROOT_DIR/backend"
+  echo "Kural IDE (production) running at http://localhost:$PORT"
+  exec gunicorn -c gunicorn.conf.py server:app
+fi
+
 python "$ROOT_DIR/backend/server.py" &
-echo "Kural IDE running at http://localhost:5000"
+echo "Kural IDE running at http://localhost:$PORT"